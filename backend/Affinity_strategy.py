@@ -2,6 +2,7 @@ from __future__ import annotations
 from abc import abstractmethod
 from typing import List
 from sklearn.cluster import AgglomerativeClustering
+from sklearn.metrics import pairwise_distances
 from transformers import BertTokenizer, BertModel
 from sentence_transformers import SentenceTransformer
 import torch
@@ -10,29 +11,155 @@ import spacy
 import numpy as np
 from scipy.sparse import csr_matrix
 from sklearn.feature_extraction.text import TfidfVectorizer
-from backend.utils import Utils
+from backend.utils import Utils, EMBEDDING_DTYPE
+from backend.runtime_config import load_runtime_config
+from backend import metrics
+from backend.dimensionality_reduction import reduce_embeddings
+from backend.onnx_inference import OnnxEncoder, check_inference_backend
 
 BATCH_SIZE = 32
+# Above this size the square distance matrix costs more memory than parallelism saves
+MAX_PRECOMPUTED_SAMPLES = 10000
+
+
+def uses_precomputed_distances(linkage, n_samples):
+    return linkage != 'ward' and n_samples <= MAX_PRECOMPUTED_SAMPLES
+
+
+def cluster_embeddings(dense_data_array, linkage, distance_threshold, metric, n_jobs=None, distance_matrix=None):
+    with metrics.span('cluster'):
+        clustering_model = _fit_clustering(dense_data_array, linkage, distance_threshold, metric, n_jobs, distance_matrix)
+    metrics.count('clusters_out', clustering_model.n_clusters_)
+    return clustering_model
+
+
+def _fit_clustering(dense_data_array, linkage, distance_threshold, metric, n_jobs, distance_matrix):
+    if not uses_precomputed_distances(linkage, len(dense_data_array)):
+        clustering_model = AgglomerativeClustering(n_clusters=None,
+                                                   linkage=linkage,
+                                                   distance_threshold=distance_threshold,
+                                                   metric=metric,
+                                                   compute_full_tree=True)
+        return clustering_model.fit(dense_data_array)
+
+    # Compute the distance matrix up front so it is spread over n_jobs workers
+    if distance_matrix is None:
+        with metrics.span('distance_matrix'):
+            distance_matrix = pairwise_distances(dense_data_array, metric=metric, n_jobs=n_jobs)
+    clustering_model = AgglomerativeClustering(n_clusters=None,
+                                               linkage=linkage,
+                                               distance_threshold=distance_threshold,
+                                               metric='precomputed',
+                                               compute_full_tree=True)
+    return clustering_model.fit(distance_matrix)
 
 
 class AffinityStrategy():
+    model_name = None
+    # Whether embeddings of a feature are independent of the other features being embedded
+    shared_embeddings = True
+    runtime_config = None
+
     @abstractmethod
-    def compute_affinity(self, data: List):
+    def compute_embeddings(self, labels: List):
         pass
 
+    def tag_features(self, labels):
+        return Utils.tag_features(labels, n_process=self.runtime_config['spacy_n_process'])
+
+    def cluster(self, dense_data_array, linkage, distance_threshold, metric):
+        return cluster_embeddings(dense_data_array, linkage, distance_threshold, metric,
+                                  n_jobs=self.runtime_config['sklearn_n_jobs'])
+
+    def compute_affinity(self,
+                         application_name,
+                         labels,
+                         linkage,
+                         object_weight,
+                         verb_weight,
+                         distance_threshold,
+                         metric,
+                         reduction=None,
+                         duplicates=None):
+        self.verb_weight = verb_weight
+        self.object_weight = object_weight
+
+        with metrics.span('embed'):
+            dense_data_array, labels = self.compute_embeddings(labels)
+        metrics.count('features_embedded', len(labels))
+        if len(dense_data_array) == 0:
+            return None
+
+        reduced_data_array, reduction_info = None, None
+        if reduction is not None:
+            with metrics.span('reduce'):
+                reduced_data_array, reduction_info = reduce_embeddings(dense_data_array, reduction)
+            print(f"Reduced {reduction_info['input_dimension']} dimensions to {reduction_info['n_components']} "
+                  f"with {reduction_info['method']}...")
+
+        print("Performing Agglomerative Clustering...")
+        clustering_model = self.cluster(dense_data_array if reduction is None else reduced_data_array,
+                                        linkage, distance_threshold, metric)
+
+        return Utils.generate_pkl(application_name,
+                                  clustering_model,
+                                  self.model_name,
+                                  dense_data_array,
+                                  labels,
+                                  distance_threshold,
+                                  linkage,
+                                  metric,
+                                  self.verb_weight,
+                                  self.object_weight,
+                                  reduced_data_array=reduced_data_array,
+                                  reduction=reduction_info,
+                                  duplicates=duplicates)
+
+    def prepare_sweep(self, labels):
+        """Compute everything that does not depend on the verb/object weights."""
+        return {'labels': labels}
+
+    def reweight(self, sweep_state, verb_weight, object_weight):
+        self.verb_weight = verb_weight
+        self.object_weight = object_weight
+        return self.compute_embeddings(sweep_state['labels'])
+
 class BertEmbeddingAffinity(AffinityStrategy):
-    def __init__(self, verb_weight=1.0, object_weight=1.0):
+    model_name = 'Bert'
+
+    def __init__(self, verb_weight=1.0, object_weight=1.0, runtime_config=None, inference_backend='torch'):
+        self.inference_backend = check_inference_backend(inference_backend)
+        self.runtime_config = runtime_config or load_runtime_config()
         self.tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
-        self.model = BertModel.from_pretrained('bert-base-uncased')
-        self.nlp = spacy.load("en_core_web_sm")
+        if self.inference_backend == 'torch':
+            self.model = BertModel.from_pretrained('bert-base-uncased')
+            self.encoder = None
+        else:
+            self.model = None
+            self.encoder = OnnxEncoder('bert',
+                                       quantize=self.inference_backend == 'onnx-int8',
+                                       runtime_config=self.runtime_config)
+        self.nlp = Utils.load_spacy_model()
         self.verb_weight = verb_weight
         self.object_weight = object_weight
 
-    def process_batch(self, batch_data):
+    def encode_batch(self, batch_data):
+        # Averaging over the attention mask keeps a feature's vector independent of the padding of its
+        # batch, so features encoded together with other apps or windows match a single-app run
+        if self.encoder is not None:
+            return torch.from_numpy(self.encoder.encode(batch_data))
         inputs = self.tokenizer(batch_data, return_tensors='pt', padding=True, truncation=True)
         with torch.no_grad():
-            outputs = self.model(**inputs)
-            embeddings = outputs.last_hidden_state.mean(dim=1)
+            hidden_state = self.model(**inputs).last_hidden_state
+        mask = inputs['attention_mask'].unsqueeze(-1).to(hidden_state.dtype)
+        return (hidden_state * mask).sum(dim=1) / mask.sum(dim=1)
+
+    def encode_tokens(self, tokens):
+        return self.encode_batch(tokens).numpy()
+
+    def process_batch(self, batch_data, tagged_data=None):
+        embeddings = self.encode_batch(batch_data)
+        token_encoder = self.encoder.encode if self.encoder is not None else None
 
         Utils.ponderate_embeddings_with_weights(
             batch_data=batch_data,
@@ -40,90 +167,94 @@ class BertEmbeddingAffinity(AffinityStrategy):
             verb_weight=self.verb_weight,
             object_weight=self.object_weight,
             tokenizer=self.tokenizer,
-            model=self.model
+            model=self.model,
+            tagged_data=tagged_data,
+            token_encoder=token_encoder
         )
         return embeddings
 
-    def compute_affinity(self,
-                         application_name,
-                         labels,
-                         linkage,
-                         object_weight,
-                         verb_weight,
-                         distance_threshold,
-                         metric):
-
-        self.verb_weight = verb_weight
-        self.object_weight = object_weight
-
+    def compute_embeddings(self, labels):
         all_embeddings = []
         batch_size = 32
 
+        print("Tagging features with spaCy...")
+        tagged_data = self.tag_features(labels)
+
         print(f"Processing data in batches of size {batch_size}...")
         for i in range(0, len(labels), batch_size):
             batch_data = labels[i:i + batch_size]
-            batch_embeddings = self.process_batch(batch_data)
+            batch_embeddings = self.process_batch(batch_data, tagged_data[i:i + batch_size])
             all_embeddings.append(batch_embeddings)
 
         print("Concatenating all batch embeddings...")
         all_embeddings = torch.cat(all_embeddings, dim=0)
 
-        print("Converting embeddings to dense format...")
-        sparse_matrix = csr_matrix(all_embeddings.numpy())
-        dense_data_array = sparse_matrix.toarray()
+        return Utils.to_embedding_dtype(all_embeddings.numpy()), labels
 
+    def prepare_sweep(self, labels):
+        print("Tagging features with spaCy...")
+        pos_masks = Utils.pos_masks(self.tag_features(labels))
 
-        print("Performing Agglomerative Clustering...")
-        clustering_model = AgglomerativeClustering(
-            n_clusters=None,
-            linkage=linkage,
-            distance_threshold=distance_threshold,
-            metric=metric,
-            compute_full_tree=True
-        )
+        print(f"Encoding {len(labels)} features without weights...")
+        base_embeddings = torch.cat([self.encode_batch(labels[i:i + BATCH_SIZE])
+                                     for i in range(0, len(labels), BATCH_SIZE)], dim=0)
 
-        clustering_model.fit(dense_data_array)
+        vocabulary = sorted(set(pos_masks['text']))
+        vocabulary_index = {token: i for i, token in enumerate(vocabulary)}
+        print(f"Encoding {len(vocabulary)} unique verb and object tokens...")
+        token_vectors = np.concatenate([self.encode_tokens(vocabulary[i:i + 256])
+                                        for i in range(0, len(vocabulary), 256)]) if vocabulary else None
 
-        return Utils.generate_pkl(application_name,
-                                  clustering_model,
-                                  'Bert',
-                                  dense_data_array,
-                                  labels,
-                                  distance_threshold,
-                                  linkage,
-                                  metric,
-                                  verb_weight,
-                                  object_weight)
+        return {
+            'labels': labels,
+            'base_embeddings': Utils.to_embedding_dtype(base_embeddings.numpy()),
+            'pos_masks': pos_masks,
+            'token_index': np.array([vocabulary_index[token] for token in pos_masks['text']], dtype=np.intp),
+            'token_vectors': token_vectors,
+        }
+
+    def reweight(self, sweep_state, verb_weight, object_weight):
+        self.verb_weight = verb_weight
+        self.object_weight = object_weight
+        dense_data_array = sweep_state['base_embeddings'].copy()
+        if sweep_state['token_vectors'] is None:
+            return dense_data_array, sweep_state['labels']
+
+        included, sentence, weights, n_tokens, _ = Utils.positional_token_weights(
+            sweep_state['pos_masks'], verb_weight, object_weight)
+        # Weighted sum of token vectors per feature as one sparse product
+        weight_matrix = csr_matrix((weights, (sentence, sweep_state['token_index'][included])),
+                                   shape=(len(dense_data_array), len(sweep_state['token_vectors'])))
+        weighted_sums = np.asarray(weight_matrix @ sweep_state['token_vectors'])
+
+        has_tokens = n_tokens > 0
+        dense_data_array[has_tokens] = weighted_sums[has_tokens] / n_tokens[has_tokens, np.newaxis]
+        return dense_data_array, sweep_state['labels']
 
 class TfidfEmbeddingService(AffinityStrategy):
-    def __init__(self, verb_weight=1.0, object_weight=1.0):
+    model_name = 'Tfidf'
+    # IDF weights depend on the whole corpus being vectorized
+    shared_embeddings = False
+
+    def __init__(self, verb_weight=1.0, object_weight=1.0, runtime_config=None):
         self.vectorizer = TfidfVectorizer()
-        self.nlp = spacy.load("en_core_web_sm")
+        self.nlp = Utils.load_spacy_model()
         self.verb_weight = verb_weight
         self.object_weight = object_weight
+        self.runtime_config = runtime_config or load_runtime_config()
 
     def get_dense_data_array(self, data: List) -> np.ndarray:
-        tfidf_vectorizer = TfidfVectorizer()
+        tfidf_vectorizer = TfidfVectorizer(dtype=EMBEDDING_DTYPE)
         tf_idf_data_vector = tfidf_vectorizer.fit_transform(data)
         return tf_idf_data_vector.toarray(), tfidf_vectorizer
 
-    def compute_affinity(self,
-                         application_name,
-                         labels,
-                         linkage,
-                         object_weight,
-                         verb_weight,
-                         distance_threshold,
-                         metric):
-
-        self.verb_weight = verb_weight
-        self.object_weight = object_weight
-
+    def compute_embeddings(self, labels):
         print("Converting data to dense TF-IDF vectors...")
         dense_data_array, tfidf_vectorizer = self.get_dense_data_array(labels)
 
         zero_vectors = np.all(dense_data_array == 0, axis=1)
         print(f"Number of zero vectors: {np.sum(zero_vectors)}")
+        metrics.count('zero_vectors_dropped', int(np.sum(zero_vectors)))
 
         if np.sum(zero_vectors) > 0:
             dense_data_array = dense_data_array[~zero_vectors]
@@ -131,7 +262,7 @@ class TfidfEmbeddingService(AffinityStrategy):
 
         if len(dense_data_array) == 0:
             print("All vectors are zero vectors, aborting clustering.")
-            return None
+            return dense_data_array, labels
 
         print("Ponderating TF-IDF embeddings with verb and object weights...")
         # Adjust TF-IDF values based on verb and object weights
@@ -140,82 +271,118 @@ class TfidfEmbeddingService(AffinityStrategy):
             dense_data_array,  # tfidf_matrix
             tfidf_vectorizer,  # vectorizer
             verb_weight=self.verb_weight,
-            object_weight=self.object_weight
+            object_weight=self.object_weight,
+            tagged_data=self.tag_features(labels)
         )
+        return dense_data_array, labels
 
-        print("Performing Agglomerative Clustering...")
-        clustering_model = AgglomerativeClustering(n_clusters=None,
-                                                   linkage=linkage,
-                                                   distance_threshold=distance_threshold,
-                                                   metric=metric)
-        clustering_model.fit(dense_data_array)
-
-        return Utils.generate_pkl(application_name,
-                                  clustering_model,
-                                  'Tfidf',
-                                  dense_data_array,
-                                  labels,
-                                  distance_threshold,
-                                  linkage,
-                                  metric,
-                                  self.verb_weight,
-                                  self.object_weight)
-class MiniLMEmbeddingService(AffinityStrategy):
-    def __init__(self, verb_weight=1.0, object_weight=1.0):
-        self.model = SentenceTransformer('paraphrase-MiniLM-L6-v2')
+    def prepare_sweep(self, labels):
+        print("Converting data to dense TF-IDF vectors...")
+        dense_data_array, tfidf_vectorizer = self.get_dense_data_array(labels)
+        non_zero_vectors = ~np.all(dense_data_array == 0, axis=1)
+        metrics.count('zero_vectors_dropped', int(np.count_nonzero(~non_zero_vectors)))
+        dense_data_array = dense_data_array[non_zero_vectors]
+        labels = [label for i, label in enumerate(labels) if non_zero_vectors[i]]
+
+        print("Tagging features with spaCy...")
+        pos_masks = Utils.pos_masks(self.tag_features(labels))
+        vocabulary_index = tfidf_vectorizer.vocabulary_
+        return {
+            'labels': labels,
+            'tfidf': dense_data_array,
+            'pos_masks': pos_masks,
+            'token_column': np.array([vocabulary_index.get(token, -1) for token in pos_masks['text']],
+                                     dtype=np.intp),
+        }
+
+    def reweight(self, sweep_state, verb_weight, object_weight):
         self.verb_weight = verb_weight
         self.object_weight = object_weight
-        self.nlp = spacy.load("en_core_web_sm")
+        dense_data_array = sweep_state['tfidf'].copy()
+        pos_masks = sweep_state['pos_masks']
+        in_vocabulary = sweep_state['token_column'] >= 0
+
+        # Every occurrence of a token multiplies its TF-IDF value by the weight once more
+        as_verb, as_object = Utils.token_weight_masks(pos_masks, verb_weight, object_weight)
+        for selected, weight in ((as_verb & in_vocabulary, verb_weight), (as_object & in_vocabulary, object_weight)):
+            occurrences = csr_matrix((np.ones(np.count_nonzero(selected)),
+                                      (pos_masks['sentence'][selected], sweep_state['token_column'][selected])),
+                                     shape=dense_data_array.shape).tocoo()
+            dense_data_array[occurrences.row, occurrences.col] *= np.power(weight, occurrences.data)
+        return dense_data_array, sweep_state['labels']
 
-    def compute_affinity(self,
-                         application_name,
-                         labels,
-                         linkage,
-                         object_weight,
-                         verb_weight,
-                         distance_threshold,
-                         metric):
+class MiniLMEmbeddingService(AffinityStrategy):
+    model_name = 'MiniLM'
+
+    def __init__(self, verb_weight=1.0, object_weight=1.0, runtime_config=None, inference_backend='torch'):
+        self.inference_backend = check_inference_backend(inference_backend)
+        self.runtime_config = runtime_config or load_runtime_config()
+        if self.inference_backend == 'torch':
+            self.model = SentenceTransformer('paraphrase-MiniLM-L6-v2')
+            self.encoder = None
+        else:
+            self.model = None
+            self.encoder = OnnxEncoder('paraphrase',
+                                       quantize=self.inference_backend == 'onnx-int8',
+                                       runtime_config=self.runtime_config)
         self.verb_weight = verb_weight
         self.object_weight = object_weight
+        self.nlp = Utils.load_spacy_model()
 
+    def encode(self, batch_data):
+        if self.encoder is not None:
+            return torch.from_numpy(self.encoder.encode(batch_data))
+        return self.model.encode(batch_data, convert_to_tensor=True)
+
+    def compute_embeddings(self, labels):
         all_embeddings = []
 
+        print("Tagging features with spaCy...")
+        tagged_data = self.tag_features(labels)
+
         print(f"Processing data in batches of size {BATCH_SIZE}...")
         for i in range(0, len(labels), BATCH_SIZE):
             batch_data = labels[i:i + BATCH_SIZE]
             batch_index = i // BATCH_SIZE
             print(f"Processing batch {batch_index}...")
-            batch_embeddings = self.model.encode(batch_data, convert_to_tensor=True)
+            batch_embeddings = self.encode(batch_data)
 
             Utils.ponderate_embeddings_with_weights(batch_data,
                                        batch_embeddings,
                                        self.verb_weight,
                                        self.object_weight,
                                        tokenizer=None,
-                                       model=None)
+                                       model=None,
+                                       tagged_data=tagged_data[i:i + BATCH_SIZE])
 
             all_embeddings.append(batch_embeddings)
 
         print("Concatenating all batch embeddings...")
         all_embeddings = torch.cat(all_embeddings, dim=0)
-        dense_data_array = all_embeddings.cpu().numpy()
-
-        print("Performing Agglomerative Clustering...")
-        clustering_model = AgglomerativeClustering(
-            n_clusters=None,
-            linkage=linkage,
-            distance_threshold=distance_threshold,
-            metric=metric
-        )
-        clustering_model.fit(dense_data_array)
-
-        return Utils.generate_pkl(application_name,
-                                  clustering_model,
-                                  'MiniLM',
-                                  dense_data_array,
-                                  labels,
-                                  distance_threshold,
-                                  linkage,
-                                  metric,
-                                  verb_weight,
-                                  object_weight)
+        return Utils.to_embedding_dtype(all_embeddings.cpu().numpy()), labels
+
+    def prepare_sweep(self, labels):
+        print("Tagging features with spaCy...")
+        pos_masks = Utils.pos_masks(self.tag_features(labels))
+
+        print(f"Encoding {len(labels)} features without weights...")
+        base_embeddings = torch.cat([self.encode(labels[i:i + BATCH_SIZE])
+                                     for i in range(0, len(labels), BATCH_SIZE)], dim=0)
+        return {
+            'labels': labels,
+            'base_embeddings': Utils.to_embedding_dtype(base_embeddings.cpu().numpy()),
+            'pos_masks': pos_masks,
+        }
+
+    def reweight(self, sweep_state, verb_weight, object_weight):
+        # Without token vectors the weighting reduces to scaling by the mean selected weight
+        self.verb_weight = verb_weight
+        self.object_weight = object_weight
+        dense_data_array = sweep_state['base_embeddings'].copy()
+        _, _, _, n_tokens, n_verbs = Utils.positional_token_weights(sweep_state['pos_masks'],
+                                                                    verb_weight, object_weight)
+        has_tokens = n_tokens > 0
+        scale = (n_verbs[has_tokens] * verb_weight + (n_tokens - n_verbs)[has_tokens] * object_weight) \
+            / n_tokens[has_tokens]
+        dense_data_array[has_tokens] *= scale[:, np.newaxis].astype(dense_data_array.dtype)
+        return dense_data_array, sweep_state['labels']
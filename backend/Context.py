@@ -13,6 +13,6 @@ class Context():
     def strategy(self, strategy: Affinity_strategy) -> None:
         self.affinity_strategy = strategy
 
-    def use_affinity_algorithm(self, application_name, data: List, linkage, object_weight, verb_weight, distance_threshold, metric):
-        return self.affinity_strategy.compute_affinity(application_name, data, linkage,object_weight, verb_weight, distance_threshold, metric)
+    def use_affinity_algorithm(self, application_name, data: List, linkage, object_weight, verb_weight, distance_threshold, metric, reduction=None, duplicates=None):
+        return self.affinity_strategy.compute_affinity(application_name, data, linkage,object_weight, verb_weight, distance_threshold, metric, reduction, duplicates)
     
\ No newline at end of file
@@ -1,13 +1,28 @@
-from flask import Flask
-
-
 def create_app():
+    # Imported here so scripts can use backend modules without the server dependencies
+    from flask import Flask
+    from .runtime_config import configure_environment
+
+    # Thread pools are sized when numpy/torch load, so export limits before the controllers import them
+    configure_environment()
     app = Flask(__name__, instance_relative_config=True)
 
+    from . import metrics_controller
+    app.register_blueprint(metrics_controller.bp)
+
     from . import dendogram_controller
     app.register_blueprint(dendogram_controller.bp)
 
     from . import graph_controller
     app.register_blueprint(graph_controller.bp)
 
+    from . import visualization_controller
+    app.register_blueprint(visualization_controller.bp)
+
+    from . import profiling_controller
+    app.register_blueprint(profiling_controller.bp)
+
+    from . import index_controller
+    app.register_blueprint(index_controller.bp)
+
     return app
\ No newline at end of file
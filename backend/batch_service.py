@@ -0,0 +1,138 @@
+import logging
+import numpy as np
+from joblib import Parallel, delayed
+from .Affinity_strategy import cluster_embeddings
+from .dendogram_service import prepare_features, create_strategy
+from .onnx_inference import DEFAULT_INFERENCE_BACKEND
+from .runtime_config import load_runtime_config, runtime_scope
+from .utils import Utils
+from .dimensionality_reduction import reduce_embeddings
+from . import metrics
+
+
+def cluster_app(application_name, model_name, dense_data_array, labels, linkage, metric, parameters, subdirectory='',
+                reduced_data_array=None, reduction=None, duplicates=None):
+    """
+    Cluster one app/parameter combination and save its artifact. This runs in joblib worker
+    processes, so its stages are recorded in the workers' metrics and callers time the whole
+    Parallel run with a single span.
+    """
+    clustering_model = cluster_embeddings(dense_data_array if reduction is None else reduced_data_array,
+                                          linkage,
+                                          parameters['distance_threshold'],
+                                          metric,
+                                          n_jobs=1)
+    return Utils.generate_pkl(application_name,
+                              clustering_model,
+                              model_name,
+                              dense_data_array,
+                              labels,
+                              parameters['distance_threshold'],
+                              linkage,
+                              metric,
+                              parameters['verb_weight'],
+                              parameters['object_weight'],
+                              subdirectory,
+                              reduced_data_array=reduced_data_array,
+                              reduction=reduction,
+                              duplicates=duplicates)
+
+
+def union_features(apps):
+    seen = set()
+    union = []
+    for app in apps:
+        for feature in app['features']:
+            if feature not in seen:
+                seen.add(feature)
+                union.append(feature)
+    return union
+
+
+def embed_apps(strategy, apps):
+    """Yield (app, embeddings, labels), encoding the union of all features once when the strategy allows it."""
+    if not strategy.shared_embeddings:
+        for app in apps:
+            with metrics.span('embed'):
+                dense_data_array, labels = strategy.compute_embeddings(app['features'])
+            yield app, dense_data_array, labels
+        return
+
+    union = union_features(apps)
+    logging.info(f"Encoding {len(union)} unique features shared by {len(apps)} apps")
+    with metrics.span('embed'):
+        dense_data_array, labels = strategy.compute_embeddings(union)
+    row_index = {label: row for row, label in enumerate(labels)}
+    for app in apps:
+        app_labels = [feature for feature in app['features'] if feature in row_index]
+        rows = np.array([row_index[feature] for feature in app_labels], dtype=np.intp)
+        yield app, dense_data_array[rows], app_labels
+
+
+def generate_dendograms_batch(preprocessing,
+                              embedding,
+                              metric,
+                              linkage,
+                              apps,
+                              parameter_sets,
+                              runtime_overrides=None,
+                              inference_backend=DEFAULT_INFERENCE_BACKEND,
+                              reduction=None,
+                              dedupe=None):
+    runtime_config = load_runtime_config(runtime_overrides)
+    prepared = []
+    for app in apps:
+        features, duplicates = prepare_features(app['app_name'], app['features'], preprocessing, dedupe)
+        prepared.append({'app_name': app['app_name'], 'features': features, 'duplicates': duplicates})
+    apps = prepared
+
+    # Embeddings only depend on the weights, thresholds just change where the tree is cut
+    weight_groups = {}
+    for parameters in parameter_sets:
+        weights = (parameters['verb_weight'], parameters['object_weight'])
+        weight_groups.setdefault(weights, []).append(parameters)
+
+    results = []
+    with runtime_scope(runtime_config):
+        strategy = create_strategy(embedding, runtime_config, inference_backend)
+
+        for (verb_weight, object_weight), group in weight_groups.items():
+            strategy.verb_weight = verb_weight
+            strategy.object_weight = object_weight
+
+            tasks = []
+            for app, dense_data_array, labels in embed_apps(strategy, apps):
+                if len(dense_data_array) < 2:
+                    logging.warning(f"Skipping {app['app_name']}: not enough features to cluster")
+                    continue
+                # Each app gets its own reducer, fitted once for all of its thresholds
+                reduced_data_array, reduction_info = None, None
+                if reduction is not None:
+                    with metrics.span('reduce'):
+                        reduced_data_array, reduction_info = reduce_embeddings(dense_data_array, reduction)
+                for parameters in group:
+                    tasks.append((app['app_name'], dense_data_array, labels, parameters,
+                                  reduced_data_array, reduction_info, app['duplicates']))
+
+            logging.info(f"Clustering {len(tasks)} app/parameter combinations "
+                         f"with {runtime_config['sklearn_n_jobs']} workers")
+            with metrics.span('cluster_batch'):
+                paths = Parallel(n_jobs=runtime_config['sklearn_n_jobs'])(
+                    delayed(cluster_app)(app_name, strategy.model_name, dense_data_array, labels,
+                                         linkage, metric, parameters, reduced_data_array=reduced_data_array,
+                                         reduction=reduction_info, duplicates=duplicates)
+                    for (app_name, dense_data_array, labels, parameters,
+                         reduced_data_array, reduction_info, duplicates) in tasks
+                )
+
+            for (app_name, _, labels, parameters, *_), path in zip(tasks, paths):
+                results.append({
+                    'app_name': app_name,
+                    'n_features': len(labels),
+                    'threshold': parameters['distance_threshold'],
+                    'verb_weight': parameters['verb_weight'],
+                    'object_weight': parameters['object_weight'],
+                    'dendrogram_path': path,
+                })
+
+    return results
@@ -0,0 +1,115 @@
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Columnar hand-off between Stage 1 and Stage 2:
+#   <name>.parquet           one row per review, features as a list<string> column
+#   <name>.features.parquet  one row per extracted feature, exploded from the reviews table
+FEATURES_COLUMN = 'extracted_features_TransFeatEx'
+LIST_FEATURES_COLUMN = 'features'
+FEATURE_COLUMN = 'feature'
+DICTIONARY_COLUMNS = ['app_name', 'app_package', 'app_categoryId']
+REVIEWS_SUFFIX = '.parquet'
+FEATURES_SUFFIX = '.features.parquet'
+
+
+def split_features(value):
+    if not isinstance(value, str) or not value:
+        return []
+    return [feature for feature in value.split(';') if feature]
+
+
+def features_path(reviews_path):
+    return reviews_path[:-len(REVIEWS_SUFFIX)] + FEATURES_SUFFIX
+
+
+def is_reviews_file(file_name):
+    return file_name.endswith(REVIEWS_SUFFIX) and not file_name.endswith(FEATURES_SUFFIX)
+
+
+def build_reviews_table(df, features_column=FEATURES_COLUMN, features=None):
+    """
+    Convert a Stage 1 dataframe into the reviews table.
+    The ';'-joined features become a list column and app columns are dictionary-encoded.
+    Already split features can be given as one list per row instead.
+    """
+    if features is not None:
+        features = list(features)
+    elif features_column in df.columns:
+        features = [split_features(value) for value in df[features_column]]
+    else:
+        features = [[] for _ in range(len(df))]
+
+    table = pa.Table.from_pandas(df.drop(columns=[features_column], errors='ignore'), preserve_index=False)
+    for name in DICTIONARY_COLUMNS:
+        if name in table.column_names:
+            column = pc.dictionary_encode(table[name].cast(pa.string()))
+            table = table.set_column(table.column_names.index(name), name, column)
+
+    return table.append_column(LIST_FEATURES_COLUMN, pa.array(features, type=pa.list_(pa.string())))
+
+
+def build_features_table(reviews):
+    """Explode the features list column, keeping the review and app columns of every feature."""
+    features = reviews[LIST_FEATURES_COLUMN].combine_chunks()
+    parents = pc.list_parent_indices(features)
+
+    columns = {}
+    for name in ['reviewId'] + DICTIONARY_COLUMNS:
+        if name in reviews.column_names:
+            columns[name] = pc.take(reviews[name], parents)
+    columns[FEATURE_COLUMN] = pc.list_flatten(features)
+    return pa.table(columns)
+
+
+def write_columnar(df, output_base, features_column=FEATURES_COLUMN, features=None):
+    """Write <output_base>.parquet and <output_base>.features.parquet, returning the reviews path."""
+    reviews = build_reviews_table(df, features_column, features)
+    reviews_path = output_base + REVIEWS_SUFFIX
+    pq.write_table(reviews, reviews_path)
+    pq.write_table(build_features_table(reviews), features_path(reviews_path))
+    return reviews_path
+
+
+def read_reviews(reviews_path, columns=None, filters=None):
+    return pq.read_table(reviews_path, columns=columns, filters=filters, memory_map=True)
+
+
+def read_features(reviews_path, columns=None, filters=None):
+    """Scan the exploded features table of a reviews file, e.g. filters=[('app_categoryId', '=', 'TOOLS')]."""
+    return pq.read_table(features_path(reviews_path), columns=columns, filters=filters, memory_map=True)
+
+
+def reviews_to_dataframe(reviews, features_column=FEATURES_COLUMN):
+    """Inverse of build_reviews_table, with the features joined back with ';'."""
+    df = reviews.drop_columns([LIST_FEATURES_COLUMN]).to_pandas()
+    for name in DICTIONARY_COLUMNS:
+        if name in df.columns:
+            df[name] = df[name].astype(object)
+    df[features_column] = [";".join(features) for features in reviews[LIST_FEATURES_COLUMN].to_pylist()]
+    return df
+
+
+
+def check_columnar_support():
+    if pa is None:
+        raise ValueError("Parquet files require the pyarrow package")
+
+
+def features_from_parquet(data):
+    """
+    Read the features of an uploaded Parquet file, either a reviews table with the
+    features list column or an exploded features table.
+    """
+    check_columnar_support()
+    table = pq.read_table(pa.BufferReader(data))
+    if FEATURE_COLUMN in table.column_names:
+        features = table[FEATURE_COLUMN]
+    elif LIST_FEATURES_COLUMN in table.column_names:
+        features = pc.list_flatten(table[LIST_FEATURES_COLUMN])
+    else:
+        raise ValueError(f"Parquet file has no '{FEATURE_COLUMN}' or '{LIST_FEATURES_COLUMN}' column")
+    return [feature for feature in features.to_pylist() if feature]
@@ -0,0 +1,177 @@
+import os
+import re
+import zlib
+import unicodedata
+from collections import Counter
+import numpy as np
+
+# exact collapses features equal after normalisation, minhash also merges near-duplicates
+DEDUPE_METHODS = ('exact', 'minhash')
+DEFAULT_DEDUPE = os.getenv('DG_DEDUPE', 'exact')
+# Jaccard similarity of character shingles above which two features are merged.
+# 0.75 merges "send message" with "send messages" but keeps "block user" apart from "unblock user"
+DEFAULT_DEDUPE_THRESHOLD = float(os.getenv('DG_DEDUPE_THRESHOLD', 0.75))
+SHINGLE_SIZE = 3
+NUM_PERMUTATIONS = 128
+# Probability that a pair exactly at the threshold becomes a merge candidate
+LSH_RECALL = 0.99
+# Leaders whose estimated similarity is this far below the threshold are not checked exactly (3 standard errors)
+ESTIMATE_MARGIN = 3 * (0.25 / NUM_PERMUTATIONS) ** 0.5
+# Shingle hash x permutation cells computed at once while signing
+SIGNATURE_CHUNK_CELLS = 1 << 22
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+_NON_ALPHANUMERIC = re.compile(r'[^\w]+|_')
+
+
+def check_dedupe(method):
+    if method not in DEDUPE_METHODS:
+        raise ValueError(f"Unsupported dedupe method: {method}, expected one of {', '.join(DEDUPE_METHODS)}")
+    return method
+
+
+def dedupe_from_args(args):
+    """Dedupe settings of the dedupe and dedupe-threshold query parameters."""
+    method = check_dedupe(args.get('dedupe', DEFAULT_DEDUPE))
+    try:
+        threshold = float(args.get('dedupe-threshold', DEFAULT_DEDUPE_THRESHOLD))
+    except ValueError:
+        raise ValueError(f"Invalid dedupe-threshold: {args.get('dedupe-threshold')!r}, expected a number in (0, 1]")
+    if not 0 < threshold <= 1:
+        raise ValueError(f"Invalid dedupe-threshold: {threshold}, expected a number in (0, 1]")
+    return {'method': method, 'threshold': threshold}
+
+
+def normalize_feature(feature):
+    """Case, accents of compatibility characters, punctuation and spacing do not make a feature distinct."""
+    feature = unicodedata.normalize('NFKC', feature).casefold()
+    return ' '.join(_NON_ALPHANUMERIC.sub(' ', feature).split())
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    padded = f" {text} "
+    return {padded[i:i + size] for i in range(max(1, len(padded) - size + 1))}
+
+
+def minhash_signatures(shingle_sets, num_permutations=NUM_PERMUTATIONS, seed=1):
+    """
+    MinHash signature of every shingle set, shape (n_sets, num_permutations).
+    Shingles are hashed with crc32 so signatures are stable across processes.
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, MERSENNE_PRIME, size=num_permutations, dtype=np.uint64)
+    b = rng.integers(0, MERSENNE_PRIME, size=num_permutations, dtype=np.uint64)
+
+    signatures = np.empty((len(shingle_sets), num_permutations), dtype=np.uint64)
+    lengths = np.array([len(shingle_set) for shingle_set in shingle_sets], dtype=np.intp)
+    hashes = np.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle_set in shingle_sets for shingle in shingle_set),
+                         dtype=np.uint64, count=int(lengths.sum()))
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+
+    # Sign sets in chunks so the (shingles, permutations) matrix stays bounded
+    start = 0
+    while start < len(shingle_sets):
+        stop = start + 1
+        while stop < len(shingle_sets) and (offsets[stop + 1] - offsets[start]) * num_permutations <= SIGNATURE_CHUNK_CELLS:
+            stop += 1
+        chunk = hashes[offsets[start]:offsets[stop], np.newaxis]
+        # uint64 products wrap around, which keeps them a usable universal hash family
+        permuted = ((chunk * a + b) % MERSENNE_PRIME) & MAX_HASH
+        signatures[start:stop] = np.minimum.reduceat(permuted, offsets[start:stop] - offsets[start], axis=0)
+        start = stop
+    return signatures
+
+
+def lsh_bands(threshold, num_permutations=NUM_PERMUTATIONS):
+    """
+    (bands, rows) dividing num_permutations with the fewest bands that still make a pair at the
+    similarity threshold share a bucket with probability LSH_RECALL. Fewer bands mean fewer
+    candidates to check, missed pairs are never recovered.
+    """
+    for rows in sorted((rows for rows in range(1, num_permutations + 1) if num_permutations % rows == 0),
+                       reverse=True):
+        bands = num_permutations // rows
+        if 1 - (1 - threshold ** rows) ** bands >= LSH_RECALL:
+            return bands, rows
+    return num_permutations, 1
+
+
+def jaccard(first, second):
+    intersection = len(first & second)
+    return intersection / (len(first) + len(second) - intersection)
+
+
+def near_duplicate_groups(texts, threshold=DEFAULT_DEDUPE_THRESHOLD, weights=None):
+    """
+    Index of the leader each text is merged into, itself for leaders.
+    Texts are visited from the most to the least weighted. Each one joins the most similar
+    leader whose shingle Jaccard similarity reaches threshold, otherwise it becomes a leader.
+    Merging into leaders rather than chaining similar pairs keeps "delete photo" and
+    "share photo" apart even when variants of them resemble each other.
+    Leaders are found through MinHash LSH buckets and checked against the exact Jaccard similarity.
+    """
+    shingle_sets = [shingles(text) for text in texts]
+    signatures = minhash_signatures(shingle_sets)
+    bands, rows = lsh_bands(threshold)
+    keys = [list(map(bytes, signatures[:, band * rows:(band + 1) * rows])) for band in range(bands)]
+
+    order = np.argsort(-np.asarray(weights if weights is not None else np.ones(len(texts))), kind='stable')
+    leaders = np.full(len(texts), -1, dtype=np.intp)
+    buckets = [{} for _ in range(bands)]
+    for i in order:
+        candidates = np.fromiter({leader for band in range(bands) for leader in buckets[band].get(keys[band][i], ())},
+                                 dtype=np.intp)
+        # The share of equal MinHash values estimates the Jaccard similarity, only close leaders are checked exactly
+        estimates = np.mean(signatures[candidates] == signatures[i], axis=1)
+        candidates = candidates[estimates >= threshold - ESTIMATE_MARGIN]
+        similarities = [(jaccard(shingle_sets[i], shingle_sets[leader]), -leader) for leader in candidates]
+        best = max(similarities, default=None)
+        if best is not None and best[0] >= threshold:
+            leaders[i] = -best[1]
+            continue
+        leaders[i] = i
+        for band in range(bands):
+            buckets[band].setdefault(keys[band][i], []).append(i)
+    return leaders.tolist()
+
+
+def deduplicate(features, method=DEFAULT_DEDUPE, threshold=DEFAULT_DEDUPE_THRESHOLD):
+    """
+    Collapse duplicate features, keeping the order in which they first appear.
+    Returns the representative features and, for each one, {'count': occurrences, 'members': distinct spellings}.
+    The representative is the most frequent spelling of its group.
+    """
+    check_dedupe(method)
+    spellings = Counter(feature for feature in features if feature)
+    groups = {}
+    for feature in spellings:
+        normalized = normalize_feature(feature)
+        if normalized:
+            groups.setdefault(normalized, []).append(feature)
+
+    if method == 'minhash' and len(groups) > 1:
+        normalized_features = list(groups)
+        weights = [sum(spellings[member] for member in groups[normalized]) for normalized in normalized_features]
+        leaders = near_duplicate_groups(normalized_features, threshold, weights)
+        merged = {}
+        # Keyed by first appearance in the group, so the groups keep the order of the features
+        first_member = {}
+        for i, leader in enumerate(leaders):
+            first_member.setdefault(leader, i)
+        for normalized, leader in zip(normalized_features, leaders):
+            merged.setdefault(normalized_features[first_member[leader]], []).extend(groups[normalized])
+        groups = merged
+
+    representatives = []
+    duplicates = {}
+    for members in groups.values():
+        # Groups are in order of first appearance, max keeps the first of equally frequent spellings
+        representative = max(members, key=lambda member: spellings[member])
+        representatives.append(representative)
+        duplicates[representative] = {
+            'count': sum(spellings[member] for member in members),
+            'members': members,
+        }
+    return representatives, duplicates
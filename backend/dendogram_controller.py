@@ -1,6 +1,13 @@
 import csv
 from flask import Blueprint, request, make_response, jsonify
-from . import dendogram_service, visualization_service
+from . import dendogram_service, visualization_service, batch_service, sweep_service, temporal_service
+from . import profiling_service
+from .runtime_config import load_runtime_config, runtime_overrides_from_args
+from .onnx_inference import DEFAULT_INFERENCE_BACKEND
+from .columnar_format import features_from_parquet
+from .dimensionality_reduction import reduction_from_args
+from .dedupe_service import dedupe_from_args
+from . import metrics
 import os
 
 import sys
@@ -15,6 +22,18 @@ bp = Blueprint('dendogram', __name__, url_prefix='/dendogram')
 
 
 
+def extract_features(analyzed_reviews):
+    all_features = []
+
+    for review in analyzed_reviews:
+        sentences = review.get('sentences', [])
+        for sentence in sentences:
+            feature = sentence.get('featureData', {}).get('feature', None)
+            if feature:
+                all_features.append(feature)
+    return all_features
+
+
 @bp.route('/generate', methods=['POST'])
 def generate_dendogram():
     preprocessing = request.args.get('preprocessing', 'false').lower() == 'true'
@@ -25,43 +44,65 @@ def generate_dendogram():
     object_weight = float(request.args.get('obj-weight', 0.25))
     verb_weight = float(request.args.get('verb-weight', 0.75))
     app_name = request.args.get('app_name', 'unknown')
+    inference_backend = request.args.get('inference', DEFAULT_INFERENCE_BACKEND)
+    render = request.args.get('render', 'false').lower() == 'true'
+    runtime_overrides = runtime_overrides_from_args(request.args)
 
     request_body = request.get_json()
     if not request_body or 'analyzed_reviews' not in request_body:
         return make_response({"error": "Invalid or missing 'analyzed_reviews' in JSON payload"}, 400)
 
-    analyzed_reviews = request_body['analyzed_reviews']
-    all_features = []
+    try:
+        profiler = profiling_service.profile_requested(request.args)
+        reduction = reduction_from_args(request.args)
+        dedupe = dedupe_from_args(request.args)
+    except PermissionError as e:
+        return make_response({"error": str(e)}, 403)
+    except ValueError as e:
+        return make_response({"error": str(e)}, 400)
 
-    for review in analyzed_reviews:
-        sentences = review.get('sentences', [])
-        for sentence in sentences:
-            feature = sentence.get('featureData', {}).get('feature', None)
-            if feature:
-                all_features.append(feature)
+    all_features = extract_features(request_body['analyzed_reviews'])
 
     request_simplified = {}
     request_simplified["app_name"] = app_name
     request_simplified["features"] = all_features
     try:
-        dendogram_file = dendogram_service.generate_dendogram(
-            preprocessing=preprocessing,
-            embedding=affinity,
-            metric=metric,
-            linkage=linkage,
-            distance_threshold=threshold,
-            object_weight=object_weight,
-            verb_weight=verb_weight,
-            request_content=request_simplified
-        )
-        if threshold is not None:
-            visualization_service.generate_dendrogram_visualization(dendogram_file)
+        with profiling_service.profile_request(profiler) as profile:
+            dendogram_file = dendogram_service.generate_dendogram(
+                preprocessing=preprocessing,
+                embedding=affinity,
+                metric=metric,
+                linkage=linkage,
+                distance_threshold=threshold,
+                object_weight=object_weight,
+                verb_weight=verb_weight,
+                request_content=request_simplified,
+                runtime_overrides=runtime_overrides,
+                inference_backend=inference_backend,
+                reduction=reduction,
+                dedupe=dedupe
+            )
+            visualization = None
+            if threshold is not None:
+                visualization = visualization_service.generate_dendrogram_visualization(
+                    dendogram_file, load_runtime_config(runtime_overrides), render)
 
-        return jsonify({
+        response = {
             "message": "Dendrogram generated successfully",
             "features": all_features,
             "dendrogram_path": dendogram_file,
-        }), 200
+            "visualization": visualization,
+            "timings": metrics.timing_breakdown(),
+        }
+        if profile is not None:
+            profile_name = os.path.splitext(os.path.basename(dendogram_file))[0] if dendogram_file else app_name
+            response["profile"] = profile.save(profile_name, {
+                "endpoint": request.path,
+                "arguments": request.args.to_dict(),
+                "n_features": len(all_features),
+                "dendrogram_path": dendogram_file,
+            })
+        return jsonify(response), 200
 
     except ValueError as e:
         return make_response({"error": str(e)}, 400)
@@ -77,6 +118,8 @@ def generate_dendogram_from_csv():
     object_weight = float(request.args.get('obj-weight', 0.25))
     verb_weight = float(request.args.get('verb-weight', 0.75))
     app_name = request.args.get('app_name', '')
+    inference_backend = request.args.get('inference', DEFAULT_INFERENCE_BACKEND)
+    runtime_overrides = runtime_overrides_from_args(request.args)
 
     print(f"Request arguments: preprocessing={preprocessing}, "
           f"affinity={affinity}, "
@@ -85,26 +128,41 @@ def generate_dendogram_from_csv():
           f"threshold={threshold}, "
           f"object_weight={object_weight}, "
           f"verb_weight={verb_weight}, "
-          f"app_name={app_name}")
+          f"app_name={app_name}, "
+          f"inference={inference_backend}")
+
+    try:
+        reduction = reduction_from_args(request.args)
+        dedupe = dedupe_from_args(request.args)
+    except ValueError as e:
+        return make_response(str(e), 400)
 
     if 'file' not in request.files:
-        return make_response("CSV file is required", 400)
+        return make_response("CSV or Parquet file is required", 400)
 
     file = request.files['file']
-    if not file.filename.endswith('.csv'):
-        return make_response("File must be a CSV", 400)
-
-    features = []
-    try:
-        file_content = file.stream.read().decode('utf-8')
-        csv_reader = csv.DictReader(file_content.splitlines())
-        for row in csv_reader:
-            extracted_features = row.get("extracted_features_TransFeatEx", "")
-            if extracted_features:
-                features.extend(extracted_features.split(';'))
-    except Exception as e:
-        print(f"Error processing CSV: {e}")
-        return make_response("Error processing CSV file", 500)
+    if file.filename.endswith('.parquet'):
+        try:
+            features = features_from_parquet(file.stream.read())
+        except ValueError as e:
+            return make_response(str(e), 400)
+        except Exception as e:
+            print(f"Error processing Parquet: {e}")
+            return make_response("Error processing Parquet file", 500)
+    elif file.filename.endswith('.csv'):
+        features = []
+        try:
+            file_content = file.stream.read().decode('utf-8')
+            csv_reader = csv.DictReader(file_content.splitlines())
+            for row in csv_reader:
+                extracted_features = row.get("extracted_features_TransFeatEx", "")
+                if extracted_features:
+                    features.extend(extracted_features.split(';'))
+        except Exception as e:
+            print(f"Error processing CSV: {e}")
+            return make_response("Error processing CSV file", 500)
+    else:
+        return make_response("File must be a CSV or Parquet file", 400)
 
     request_content = {
         "app_name": app_name,
@@ -118,6 +176,189 @@ def generate_dendogram_from_csv():
                                                            threshold,
                                                            object_weight,
                                                            verb_weight,
-                                                           request_content)
+                                                           request_content,
+                                                           runtime_overrides,
+                                                           inference_backend,
+                                                           reduction,
+                                                           dedupe)
+
+    return jsonify({"message": "Dendrogram generated successfully",
+                    "dendrogram_path": dendrogram_file,
+                    "timings": metrics.timing_breakdown()}), 200
+
 
-    return jsonify({"message": "Dendrogram generated successfully", "dendrogram_path": dendrogram_file}), 200
\ No newline at end of file
+@bp.route('/generate_batch', methods=['POST'])
+def generate_dendogram_batch():
+    preprocessing = request.args.get('preprocessing', 'false').lower() == 'true'
+    affinity = request.args.get('affinity', 'bert')
+    linkage = request.args.get('linkage', 'average')
+    metric = request.args.get('metric', 'cosine')
+    threshold = float(request.args.get('threshold', 0.2))
+    object_weight = float(request.args.get('obj-weight', 0.25))
+    verb_weight = float(request.args.get('verb-weight', 0.75))
+    visualize = request.args.get('visualize', 'false').lower() == 'true'
+    render = request.args.get('render', 'false').lower() == 'true'
+    inference_backend = request.args.get('inference', DEFAULT_INFERENCE_BACKEND)
+    runtime_overrides = runtime_overrides_from_args(request.args)
+
+    request_body = request.get_json()
+    if not request_body or not request_body.get('apps'):
+        return make_response({"error": "Invalid or missing 'apps' in JSON payload"}, 400)
+
+    apps = []
+    for app in request_body['apps']:
+        if 'app_name' not in app:
+            return make_response({"error": "Every app requires an 'app_name'"}, 400)
+        if 'features' in app:
+            features = app['features']
+        elif 'analyzed_reviews' in app:
+            features = extract_features(app['analyzed_reviews'])
+        else:
+            return make_response({"error": f"App {app['app_name']} has no 'features' or 'analyzed_reviews'"}, 400)
+        apps.append({"app_name": app['app_name'], "features": features})
+
+    try:
+        parameter_sets = [{
+            "distance_threshold": float(parameters.get('threshold', threshold)),
+            "verb_weight": float(parameters.get('verb-weight', verb_weight)),
+            "object_weight": float(parameters.get('obj-weight', object_weight)),
+        } for parameters in request_body.get('parameters') or [{}]]
+    except (ValueError, TypeError, AttributeError):
+        return make_response({"error": "Every entry of 'parameters' must be an object with numeric "
+                                       "'threshold', 'verb-weight' and 'obj-weight'"}, 400)
+
+    try:
+        results = batch_service.generate_dendograms_batch(preprocessing=preprocessing,
+                                                          embedding=affinity,
+                                                          metric=metric,
+                                                          linkage=linkage,
+                                                          apps=apps,
+                                                          parameter_sets=parameter_sets,
+                                                          runtime_overrides=runtime_overrides,
+                                                          inference_backend=inference_backend,
+                                                          reduction=reduction_from_args(request.args),
+                                                          dedupe=dedupe_from_args(request.args))
+        if visualize:
+            runtime_config = load_runtime_config(runtime_overrides)
+            for result in results:
+                result['visualization'] = visualization_service.generate_dendrogram_visualization(
+                    result['dendrogram_path'], runtime_config, render)
+
+        return jsonify({"message": "Dendrograms generated successfully",
+                        "results": results,
+                        "timings": metrics.timing_breakdown()}), 200
+
+    except ValueError as e:
+        return make_response({"error": str(e)}, 400)
+    except Exception as e:
+        return make_response({"error": "An unexpected error occurred", "details": str(e)}, 500)
+
+
+@bp.route('/sweep', methods=['POST'])
+def generate_dendogram_sweep():
+    preprocessing = request.args.get('preprocessing', 'false').lower() == 'true'
+    affinity = request.args.get('affinity', 'bert')
+    linkage = request.args.get('linkage', 'average')
+    metric = request.args.get('metric', 'cosine')
+    threshold = float(request.args.get('threshold', 0.2))
+    object_weight = float(request.args.get('obj-weight', 0.25))
+    verb_weight = float(request.args.get('verb-weight', 0.75))
+    app_name = request.args.get('app_name', 'unknown')
+    inference_backend = request.args.get('inference', DEFAULT_INFERENCE_BACKEND)
+    runtime_overrides = runtime_overrides_from_args(request.args)
+
+    request_body = request.get_json()
+    if not request_body or ('analyzed_reviews' not in request_body and 'features' not in request_body):
+        return make_response({"error": "Invalid or missing 'analyzed_reviews' or 'features' in JSON payload"}, 400)
+
+    if 'features' in request_body:
+        features = request_body['features']
+    else:
+        features = extract_features(request_body['analyzed_reviews'])
+
+    # Weight pairs are zipped like the verb/object weight lists of the requester scripts
+    verb_weights = request_body.get('verb_weights', [verb_weight])
+    object_weights = request_body.get('obj_weights', [object_weight])
+    if len(verb_weights) != len(object_weights):
+        return make_response({"error": "'verb_weights' and 'obj_weights' must have the same length"}, 400)
+    weight_pairs = [(float(vw), float(ow)) for vw, ow in zip(verb_weights, object_weights)]
+    thresholds = [float(t) for t in request_body.get('thresholds', [threshold])]
+
+    try:
+        sweep = sweep_service.run_sweep(preprocessing=preprocessing,
+                                        embedding=affinity,
+                                        metric=metric,
+                                        linkage=linkage,
+                                        app_name=app_name,
+                                        features=features,
+                                        weight_pairs=weight_pairs,
+                                        thresholds=thresholds,
+                                        runtime_overrides=runtime_overrides,
+                                        inference_backend=inference_backend,
+                                        dedupe=dedupe_from_args(request.args))
+        return jsonify({"message": "Sweep generated successfully", **sweep, "timings": metrics.timing_breakdown()}), 200
+
+    except ValueError as e:
+        return make_response({"error": str(e)}, 400)
+    except Exception as e:
+        return make_response({"error": "An unexpected error occurred", "details": str(e)}, 500)
+
+
+@bp.route('/generate_series', methods=['POST'])
+def generate_dendogram_series():
+    preprocessing = request.args.get('preprocessing', 'false').lower() == 'true'
+    affinity = request.args.get('affinity', 'bert')
+    linkage = request.args.get('linkage', 'average')
+    metric = request.args.get('metric', 'cosine')
+    threshold = float(request.args.get('threshold', 0.2))
+    object_weight = float(request.args.get('obj-weight', 0.25))
+    verb_weight = float(request.args.get('verb-weight', 0.75))
+    app_name = request.args.get('app_name', 'unknown')
+    inference_backend = request.args.get('inference', DEFAULT_INFERENCE_BACKEND)
+    runtime_overrides = runtime_overrides_from_args(request.args)
+
+    request_body = request.get_json()
+    if not request_body or not request_body.get('windows'):
+        return make_response({"error": "Invalid or missing 'windows' in JSON payload"}, 400)
+
+    windows = []
+    for window in request_body['windows']:
+        if 'date' not in window:
+            return make_response({"error": "Every window requires a 'date'"}, 400)
+        if 'features' in window:
+            features = window['features']
+        elif 'analyzed_reviews' in window:
+            features = extract_features(window['analyzed_reviews'])
+        else:
+            return make_response({"error": f"Window {window['date']} has no 'features' or 'analyzed_reviews'"}, 400)
+        windows.append({"date": window['date'], "features": features})
+
+    try:
+        series_file, frames = temporal_service.generate_series(preprocessing=preprocessing,
+                                                               embedding=affinity,
+                                                               metric=metric,
+                                                               linkage=linkage,
+                                                               distance_threshold=threshold,
+                                                               object_weight=object_weight,
+                                                               verb_weight=verb_weight,
+                                                               app_name=app_name,
+                                                               windows=windows,
+                                                               runtime_overrides=runtime_overrides,
+                                                               inference_backend=inference_backend)
+        return jsonify({
+            "message": "Dendrogram series generated successfully",
+            "series_path": series_file,
+            "frames": [{
+                "date": frame['date'],
+                "n_features": len(frame['labels']),
+                "n_clusters": frame['n_clusters'],
+                "new_features": frame['new_features'],
+                "reused": frame['reused'],
+            } for frame in frames],
+            "timings": metrics.timing_breakdown(),
+        }), 200
+
+    except ValueError as e:
+        return make_response({"error": str(e)}, 400)
+    except Exception as e:
+        return make_response({"error": "An unexpected error occurred", "details": str(e)}, 500)
@@ -6,6 +6,10 @@ from .Context import Context
 from . import Affinity_strategy
 from dotenv import load_dotenv
 from .preprocessing_service import preprocess_features
+from .runtime_config import load_runtime_config, runtime_scope
+from .onnx_inference import DEFAULT_INFERENCE_BACKEND
+from . import metrics
+from .dedupe_service import deduplicate, DEFAULT_DEDUPE, DEFAULT_DEDUPE_THRESHOLD
 
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 
@@ -30,6 +34,46 @@ def load_saved_preprocessed_features(app_name):
         return json.load(json_file)
     return None
 
+def prepare_features(app_name, features, preprocessing, dedupe=None):
+    """
+    Preprocessed features with duplicates collapsed, in order of first appearance, and for each
+    kept feature its number of occurrences and the spellings merged into it.
+    """
+    dedupe = dedupe or {'method': DEFAULT_DEDUPE, 'threshold': DEFAULT_DEDUPE_THRESHOLD}
+    metrics.count('features_in', len(features))
+
+    # Preprocessing step
+    if preprocessing:
+        cached = preprocessed_app(app_name)
+        metrics.cache_lookup('preprocessed_features', cached)
+        with metrics.span('preprocess'):
+            if not cached:
+                features = preprocess_features(features)
+                save_preprocessed_features(features, app_name)
+            else:
+                features = load_saved_preprocessed_features(app_name)
+
+    # Collapse duplicate features, keeping how often each one was mentioned
+    logging.info(f"Initial number of features: {len(features)}")
+    with metrics.span('deduplicate'):
+        features, duplicates = deduplicate(features, dedupe['method'], dedupe['threshold'])
+    metrics.count('features_deduplicated', len(features))
+    logging.info(f"Number of unique features after {dedupe['method']} deduplication: {len(features)}")
+    return features, duplicates
+
+
+def create_strategy(embedding, runtime_config, inference_backend=DEFAULT_INFERENCE_BACKEND):
+    if embedding == 'bert':
+        return Affinity_strategy.BertEmbeddingAffinity(runtime_config=runtime_config,
+                                                       inference_backend=inference_backend)
+    elif embedding == 'paraphrase':
+        return Affinity_strategy.MiniLMEmbeddingService(runtime_config=runtime_config,
+                                                        inference_backend=inference_backend)
+    elif embedding == 'tf-idf':
+        return Affinity_strategy.TfidfEmbeddingService(runtime_config=runtime_config)
+    raise ValueError(f"Unsupported embedding method: {embedding}")
+
+
 def generate_dendogram(preprocessing,
                        embedding,
                        metric,
@@ -37,40 +81,29 @@ def generate_dendogram(preprocessing,
                        distance_threshold,
                        object_weight,
                        verb_weight,
-                       request_content):
+                       request_content,
+                       runtime_overrides=None,
+                       inference_backend=DEFAULT_INFERENCE_BACKEND,
+                       reduction=None,
+                       dedupe=None):
     app_name = request_content['app_name']
-    features = request_content['features']
-
-    # Preprocessing step
-    if preprocessing and not preprocessed_app(app_name):
-        features = preprocess_features(features)
-        save_preprocessed_features(features, app_name)
-    elif preprocessing and preprocessed_app(app_name):
-        features = load_saved_preprocessed_features(app_name)
-
-    # Remove duplicate features
-    logging.info(f"Initial number of features: {len(features)}")
-    features = list(set(features))
-    logging.info(f"Number of unique features after deduplication: {len(features)}")
-
-    # Select the appropriate embedding strategy
-    if embedding == 'bert':
-        context = Context(Affinity_strategy.BertEmbeddingAffinity())
-    elif embedding == 'paraphrase':
-        context = Context(Affinity_strategy.MiniLMEmbeddingService())
-    elif embedding == 'tf-idf':
-        context = Context(Affinity_strategy.TfidfEmbeddingService())
-    else:
-        raise ValueError(f"Unsupported embedding method: {embedding}")
-
-    # Use the affinity algorithm
-    return context.use_affinity_algorithm(application_name=app_name,
-                                          data=features,
-                                          linkage=linkage,
-                                          object_weight=object_weight,
-                                          verb_weight=verb_weight,
-                                          distance_threshold=distance_threshold,
-                                          metric=metric)
+    features, duplicates = prepare_features(app_name, request_content['features'], preprocessing, dedupe)
+    runtime_config = load_runtime_config(runtime_overrides)
+
+    with runtime_scope(runtime_config):
+        # Select the appropriate embedding strategy
+        context = Context(create_strategy(embedding, runtime_config, inference_backend))
+
+        # Use the affinity algorithm
+        return context.use_affinity_algorithm(application_name=app_name,
+                                              data=features,
+                                              linkage=linkage,
+                                              object_weight=object_weight,
+                                              verb_weight=verb_weight,
+                                              distance_threshold=distance_threshold,
+                                              metric=metric,
+                                              reduction=reduction,
+                                              duplicates=duplicates)
 
 
 
@@ -0,0 +1,140 @@
+import os
+import time
+import numpy as np
+from sklearn.decomposition import PCA, TruncatedSVD
+from sklearn.random_projection import GaussianRandomProjection
+from sklearn.metrics import adjusted_rand_score
+
+# Reduction applied between embedding and clustering, 'none' keeps the embeddings as they are
+REDUCTION_METHODS = ('none', 'pca', 'svd', 'random')
+DEFAULT_REDUCTION = os.getenv('DG_REDUCTION', 'none')
+DEFAULT_REDUCTION_TARGET = os.getenv('DG_REDUCTION_TARGET', '0.95')
+RANDOM_STATE = 0
+# TruncatedSVD cannot target a variance directly, components are doubled from here until it is reached
+SVD_INITIAL_COMPONENTS = 64
+
+
+def check_reduction(method):
+    if method not in REDUCTION_METHODS:
+        raise ValueError(f"Unsupported reduction: {method}, expected one of {', '.join(REDUCTION_METHODS)}")
+    return method
+
+
+def parse_target(target):
+    """
+    A target dimension (an integer, e.g. 128) or the share of variance to keep (a float in (0, 1), e.g. 0.95).
+    """
+    try:
+        value = float(target)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid reduction target: {target!r}, expected a dimension or a variance in (0, 1)")
+    if 0 < value < 1:
+        return value
+    if value >= 1 and value.is_integer():
+        return int(value)
+    raise ValueError(f"Invalid reduction target: {target!r}, expected a dimension or a variance in (0, 1)")
+
+
+def reduction_from_args(args):
+    """Reduction requested by the reduction and reduction-target query parameters, None when disabled."""
+    method = check_reduction(args.get('reduction', DEFAULT_REDUCTION))
+    if method == 'none':
+        return None
+    return {'method': method, 'target': parse_target(args.get('reduction-target', DEFAULT_REDUCTION_TARGET))}
+
+
+def _fit_svd(dense_data_array, target, max_components):
+    if isinstance(target, int):
+        return TruncatedSVD(n_components=min(target, max_components), random_state=RANDOM_STATE).fit(dense_data_array)
+
+    n_components = min(SVD_INITIAL_COMPONENTS, max_components)
+    while True:
+        reducer = TruncatedSVD(n_components=n_components, random_state=RANDOM_STATE).fit(dense_data_array)
+        explained = np.cumsum(reducer.explained_variance_ratio_)
+        if explained[-1] >= target or n_components == max_components:
+            break
+        n_components = min(2 * n_components, max_components)
+
+    # Refit with the smallest number of components reaching the target
+    kept = min(int(np.searchsorted(explained, target)) + 1, n_components)
+    if kept < n_components:
+        reducer = TruncatedSVD(n_components=kept, random_state=RANDOM_STATE).fit(dense_data_array)
+    return reducer
+
+
+def fit_reducer(dense_data_array, method, target):
+    """
+    Fitted reducer for the embeddings.
+    pca centres the data; it suits dense BERT and MiniLM embeddings.
+    svd does not centre, so it keeps the cosine geometry of sparse TF-IDF vectors.
+    random needs a target dimension and is the cheapest to fit.
+    """
+    n_samples, n_features = dense_data_array.shape
+    max_components = max(1, min(n_samples, n_features) - 1)
+
+    if method == 'pca':
+        if isinstance(target, int):
+            return PCA(n_components=min(target, max_components), random_state=RANDOM_STATE).fit(dense_data_array)
+        return PCA(n_components=target, svd_solver='full').fit(dense_data_array)
+    if method == 'svd':
+        return _fit_svd(dense_data_array, target, max_components)
+    if method == 'random':
+        if not isinstance(target, int):
+            raise ValueError("Random projection needs a target dimension, not a variance")
+        return GaussianRandomProjection(n_components=min(target, n_features),
+                                        random_state=RANDOM_STATE).fit(dense_data_array)
+    raise ValueError(f"Unsupported reduction: {method}")
+
+
+def reduce_embeddings(dense_data_array, reduction):
+    """
+    Reduced embeddings and a description of the reduction, stored in the artifact with the
+    fitted reducer so new features can be projected the same way.
+    """
+    reducer = fit_reducer(dense_data_array, reduction['method'], reduction['target'])
+    reduced = reducer.transform(dense_data_array).astype(dense_data_array.dtype, copy=False)
+
+    explained = getattr(reducer, 'explained_variance_ratio_', None)
+    return reduced, {
+        'method': reduction['method'],
+        'target': reduction['target'],
+        'input_dimension': int(dense_data_array.shape[1]),
+        'n_components': int(reduced.shape[1]),
+        'explained_variance': float(np.sum(explained)) if explained is not None else None,
+        'reducer': reducer,
+    }
+
+
+def reduction_agreement_report(dense_data_array, cluster, reductions):
+    """
+    Compare the clusters of the full embeddings with those of each reduction.
+    cluster maps an embedding array to a fitted clustering model.
+    """
+    started = time.perf_counter()
+    baseline = cluster(dense_data_array).labels_
+    baseline_seconds = time.perf_counter() - started
+
+    reports = []
+    for reduction in reductions:
+        started = time.perf_counter()
+        reduced, info = reduce_embeddings(dense_data_array, reduction)
+        reduce_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        assignments = cluster(reduced).labels_
+        cluster_seconds = time.perf_counter() - started
+
+        reports.append({
+            'method': info['method'],
+            'target': info['target'],
+            'input_dimension': info['input_dimension'],
+            'n_components': info['n_components'],
+            'explained_variance': info['explained_variance'],
+            'n_clusters': int(len(set(assignments))),
+            'baseline_n_clusters': int(len(set(baseline))),
+            'adjusted_rand_index': float(adjusted_rand_score(baseline, assignments)),
+            'reduce_seconds': reduce_seconds,
+            'cluster_seconds': cluster_seconds,
+            'baseline_cluster_seconds': baseline_seconds,
+        })
+    return reports
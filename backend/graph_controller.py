@@ -1,6 +1,6 @@
 import io
 from flask import Blueprint, request, make_response
-from . import graph_service
+from . import graph_service, profiling_service
 
 
 bp = Blueprint('graph', __name__, url_prefix='/graph')
@@ -14,8 +14,16 @@ def generate_graph():
     request_content = request.get_json()
     if request_content['features'] is None:
         return make_response("No features", 400)
-    
-    graph_figure = graph_service.generate_graph(preprocessing, affinity, request_content)
+
+    try:
+        profiler = profiling_service.profile_requested(request.args)
+    except PermissionError as e:
+        return make_response(str(e), 403)
+    except ValueError as e:
+        return make_response(str(e), 400)
+
+    with profiling_service.profile_request(profiler) as profile:
+        graph_figure = graph_service.generate_graph(preprocessing, affinity, request_content)
     if graph_figure is None:
         return make_response("Invalid embedding type", 400)
     
@@ -26,6 +34,12 @@ def generate_graph():
     response = make_response(img_stream.read())
     response.headers.set('Content-Type', 'image/png')
     response.headers.set('Content-Disposition', 'inline; filename=graph.png')
+    if profile is not None:
+        response.headers.set('X-Profile', profile.save(f"graph_{affinity}", {
+            "endpoint": request.path,
+            "arguments": request.args.to_dict(),
+            "n_features": len(request_content['features']),
+        }))
     
     return response
     
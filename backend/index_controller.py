@@ -0,0 +1,55 @@
+from flask import Blueprint, request, make_response, jsonify
+from . import index_service
+from .dendogram_controller import extract_features
+from .runtime_config import runtime_overrides_from_args
+from .onnx_inference import DEFAULT_INFERENCE_BACKEND
+from . import metrics
+
+
+bp = Blueprint('index', __name__, url_prefix='/index')
+
+
+@bp.route('/info', methods=['GET'])
+def index_info():
+    file_path = request.args.get('file')
+    if not file_path:
+        return make_response({"error": "Missing 'file' query parameter"}, 400)
+
+    try:
+        return jsonify(index_service.artifact_index(file_path, request.args.get('mode', 'auto')).info()), 200
+    except FileNotFoundError as e:
+        return make_response({"error": str(e)}, 404)
+    except ValueError as e:
+        return make_response({"error": str(e)}, 400)
+    except Exception as e:
+        return make_response({"error": "An unexpected error occurred", "details": str(e)}, 500)
+
+
+@bp.route('/assign', methods=['POST'])
+def assign_features():
+    file_path = request.args.get('file')
+    if not file_path:
+        return make_response({"error": "Missing 'file' query parameter"}, 400)
+    mode = request.args.get('mode', 'auto')
+    inference_backend = request.args.get('inference', DEFAULT_INFERENCE_BACKEND)
+    runtime_overrides = runtime_overrides_from_args(request.args)
+
+    request_body = request.get_json(silent=True)
+    if request_body and 'features' in request_body:
+        features = request_body['features']
+    elif request_body and 'analyzed_reviews' in request_body:
+        features = extract_features(request_body['analyzed_reviews'])
+    else:
+        return make_response({"error": "Invalid or missing 'features' or 'analyzed_reviews' in JSON payload"}, 400)
+
+    try:
+        k = int(request.args.get('k', index_service.DEFAULT_NEIGHBOURS))
+        response = index_service.assign_features(file_path, features, k, mode, runtime_overrides, inference_backend)
+        response["timings"] = metrics.timing_breakdown()
+        return jsonify(response), 200
+    except FileNotFoundError as e:
+        return make_response({"error": str(e)}, 404)
+    except ValueError as e:
+        return make_response({"error": str(e)}, 400)
+    except Exception as e:
+        return make_response({"error": "An unexpected error occurred", "details": str(e)}, 500)
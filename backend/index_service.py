@@ -0,0 +1,213 @@
+import os
+import copy
+from functools import lru_cache
+import joblib
+import numpy as np
+from .utils import Utils
+from .tile_service import resolve_artifact
+from .vector_index import VectorIndex, check_index_mode
+from .dendogram_service import create_strategy
+from .runtime_config import load_runtime_config, runtime_scope
+from .onnx_inference import DEFAULT_INFERENCE_BACKEND
+from . import metrics
+
+DEFAULT_NEIGHBOURS = int(os.getenv('DG_INDEX_NEIGHBOURS', 5))
+# Embedding strategy that produced the artifacts of each model name
+MODEL_EMBEDDINGS = {'Bert': 'bert', 'MiniLM': 'paraphrase'}
+# Cluster label of features too far from every cluster to have joined one
+UNASSIGNED = -1
+
+
+class ArtifactIndex:
+    """
+    Vector index over the clustered embeddings of a Stage 2 artifact.
+    A new feature is assigned to the cluster it would join under the artifact's linkage:
+    the cluster whose linkage distance to it is the smallest, provided it is within the
+    distance threshold.
+    """
+
+    def __init__(self, file_path, mode='auto'):
+        model_info = joblib.load(file_path)
+        self.file_path = file_path
+        self.application_name = model_info['application_name']
+        self.model_name = model_info['model_name']
+        self.metric, self.linkage = model_info['affinity'].split()[-2:]
+        self.distance_threshold = model_info['distance_threshold']
+        self.verb_weight = model_info['verb_weight']
+        self.object_weight = model_info['object_weight']
+        self.reducer = model_info.get('reduction', {}).get('reducer')
+        self.labels = list(model_info['labels'])
+        self.cluster_labels = np.asarray(model_info['model'].labels_)
+        self.n_clusters = int(self.cluster_labels.max()) + 1
+        self.cluster_sizes = np.bincount(self.cluster_labels, minlength=self.n_clusters)
+
+        data_points = np.asarray(Utils.clustered_data_points(model_info), dtype=np.float32)
+        self.index = VectorIndex(data_points, self.metric, mode)
+        if self.linkage == 'ward':
+            sums = np.zeros((self.n_clusters, data_points.shape[1]), dtype=np.float64)
+            np.add.at(sums, self.cluster_labels, data_points)
+            self.centroids = VectorIndex(sums / self.cluster_sizes[:, np.newaxis], 'euclidean', 'exact')
+
+    def info(self):
+        return {
+            'application_name': self.application_name,
+            'model_name': self.model_name,
+            'metric': self.metric,
+            'linkage': self.linkage,
+            'distance_threshold': self.distance_threshold,
+            'mode': self.index.mode,
+            'n_features': len(self.index),
+            'n_clusters': self.n_clusters,
+        }
+
+    def project(self, dense_data_array):
+        """Embeddings of new features in the space the artifact was clustered in."""
+        if self.reducer is None:
+            return dense_data_array
+        return self.reducer.transform(dense_data_array)
+
+    def cluster_distances(self, queries):
+        """
+        Linkage distance from every prepared query to every cluster, shape (n_queries, n_clusters).
+        Clusters an IVF index does not reach through the probed lists are left at infinity.
+        """
+        if self.linkage == 'ward':
+            # Merging a singleton into C costs sqrt(2|C| / (|C| + 1)) * ||x - centroid(C)||
+            scale = np.sqrt(2 * self.cluster_sizes / (self.cluster_sizes + 1))
+            return scale * self.centroids.distances(queries)
+
+        if self.index.mode == 'exact':
+            return self._aggregate(queries, np.arange(len(self.index)))
+
+        result = np.full((len(queries), self.n_clusters), np.inf)
+        for i, query in enumerate(queries):
+            reached = np.unique(self.cluster_labels[self.index.candidate_rows(query)])
+            rows = np.flatnonzero(np.isin(self.cluster_labels, reached))
+            result[i] = self._aggregate(query[np.newaxis], rows)[0]
+        return result
+
+    def _aggregate(self, queries, rows):
+        """single, complete or average linkage of queries to the clusters of rows, one block at a time."""
+        n_queries = len(queries)
+        if self.linkage == 'single':
+            aggregated = np.full((n_queries, self.n_clusters), np.inf)
+        elif self.linkage == 'complete':
+            aggregated = np.full((n_queries, self.n_clusters), -np.inf)
+        else:
+            aggregated = np.zeros((n_queries, self.n_clusters))
+        counts = np.zeros(self.n_clusters)
+
+        for start in range(0, len(rows), self.index.block_size):
+            block = rows[start:start + self.index.block_size]
+            block_labels = self.cluster_labels[block]
+            distances = self.index.distances(queries, block)
+            if self.linkage == 'single':
+                for i in range(n_queries):
+                    np.minimum.at(aggregated[i], block_labels, distances[i])
+            elif self.linkage == 'complete':
+                for i in range(n_queries):
+                    np.maximum.at(aggregated[i], block_labels, distances[i])
+            else:
+                for i in range(n_queries):
+                    aggregated[i] += np.bincount(block_labels, weights=distances[i], minlength=self.n_clusters)
+            counts += np.bincount(block_labels, minlength=self.n_clusters)
+
+        reached = counts > 0
+        if self.linkage == 'average':
+            aggregated[:, reached] /= counts[reached]
+        aggregated[:, ~reached] = np.inf
+        return aggregated
+
+    def assign(self, dense_data_array, k=DEFAULT_NEIGHBOURS):
+        """Cluster and k nearest clustered features of every embedded feature."""
+        queries = self.index.prepare(self.project(dense_data_array))
+        with metrics.span('index_search'):
+            rows, distances = self.index.search(queries, k)
+        with metrics.span('index_assign'):
+            cluster_distances = self.cluster_distances(queries)
+
+        assignments = []
+        for i in range(len(queries)):
+            cluster = int(np.argmin(cluster_distances[i]))
+            cluster_distance = float(cluster_distances[i, cluster])
+            if cluster_distance > self.distance_threshold:
+                cluster = UNASSIGNED
+            assignments.append({
+                'cluster': cluster,
+                'cluster_distance': cluster_distance,
+                'cluster_size': int(self.cluster_sizes[cluster]) if cluster != UNASSIGNED else 0,
+                'neighbours': [{
+                    'feature': self.labels[row],
+                    'distance': float(distance),
+                    'cluster': int(self.cluster_labels[row]),
+                } for row, distance in zip(rows[i], distances[i]) if np.isfinite(distance)],
+            })
+        return assignments
+
+
+@lru_cache(maxsize=4)
+def _artifact_index(file_path, modified_time, mode):
+    with metrics.span('index_build'):
+        return ArtifactIndex(file_path, mode)
+
+
+metrics.register_cache('vector_indexes', _artifact_index)
+
+
+def artifact_index(file_path, mode='auto'):
+    """Cached index of an artifact, rebuilt when the artifact is written again."""
+    check_index_mode(mode)
+    path = resolve_artifact(file_path)
+    return _artifact_index(path, os.path.getmtime(path), mode)
+
+
+@lru_cache(maxsize=2)
+def _loaded_strategy(embedding, inference_backend):
+    return create_strategy(embedding, load_runtime_config(), inference_backend)
+
+
+def embedding_strategy(embedding, inference_backend, runtime_config, verb_weight, object_weight):
+    """
+    Strategy of one request. Requests are served on threads, so each gets its own copy
+    with its weights and runtime config, sharing only the cached models and tokenizers.
+    """
+    strategy = copy.copy(_loaded_strategy(embedding, inference_backend))
+    strategy.runtime_config = runtime_config
+    strategy.verb_weight = verb_weight
+    strategy.object_weight = object_weight
+    return strategy
+
+
+def embed_features(index, features, runtime_overrides=None, inference_backend=DEFAULT_INFERENCE_BACKEND):
+    """Embed new features the way the artifact's features were embedded."""
+    embedding = MODEL_EMBEDDINGS.get(index.model_name)
+    if embedding is None:
+        # The TF-IDF vocabulary is fitted per artifact and not stored with it
+        raise ValueError(f"Features cannot be assigned to {index.model_name} artifacts, "
+                         f"only to {', '.join(MODEL_EMBEDDINGS)} ones")
+
+    runtime_config = load_runtime_config(runtime_overrides)
+    with runtime_scope(runtime_config):
+        strategy = embedding_strategy(embedding, inference_backend, runtime_config,
+                                      index.verb_weight, index.object_weight)
+        with metrics.span('embed'):
+            dense_data_array, _ = strategy.compute_embeddings(features)
+    return dense_data_array
+
+
+def assign_features(file_path, features, k=DEFAULT_NEIGHBOURS, mode='auto', runtime_overrides=None,
+                    inference_backend=DEFAULT_INFERENCE_BACKEND):
+    """Assign new features to the clusters of an artifact without re-clustering it."""
+    if k < 1:
+        raise ValueError(f"Invalid k: {k}, expected a positive number of neighbours")
+    features = [feature for feature in features if feature]
+    if not features:
+        raise ValueError("No features to assign")
+
+    index = artifact_index(file_path, mode)
+    dense_data_array = embed_features(index, features, runtime_overrides, inference_backend)
+    assignments = index.assign(dense_data_array, k)
+    for feature, assignment in zip(features, assignments):
+        assignment['feature'] = feature
+    metrics.count('features_assigned', len(features))
+    return {**index.info(), 'assignments': assignments}
@@ -0,0 +1,222 @@
+import sys
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+METRIC_PREFIX = 'dg'
+# Upper bounds, in seconds, of the stage and request duration histograms
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+DESCRIPTIONS = {
+    'stage_seconds': 'Wall time of a pipeline stage',
+    'request_seconds': 'Wall time of an HTTP request',
+    'requests': 'HTTP requests by endpoint and status',
+    'features_in': 'Features received, before preprocessing and deduplication',
+    'features_deduplicated': 'Features left after deduplication',
+    'features_embedded': 'Features embedded and passed to clustering',
+    'zero_vectors_dropped': 'Features dropped for having an all-zero TF-IDF vector',
+    'clusters_out': 'Flat clusters produced at the requested distance threshold',
+    'features_assigned': 'New features assigned to the clusters of an existing artifact',
+    'cache_requests': 'Cache lookups by cache and result',
+    'cache_hit_ratio': 'Share of cache lookups that were hits',
+    'process_peak_rss_bytes': 'Peak resident set size of the process',
+}
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_caches = {}
+# Stages and counters of the request being served, None outside of a request
+_breakdown = ContextVar('breakdown', default=None)
+
+
+def peak_rss_bytes():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def count(name, value=1, **labels):
+    """Add value to a counter, and to the breakdown of the current request."""
+    with _lock:
+        key = _key(name, labels)
+        _counters[key] = _counters.get(key, 0) + value
+    breakdown = _breakdown.get()
+    if breakdown is not None and not labels:
+        breakdown['counters'][name] = breakdown['counters'].get(name, 0) + value
+
+
+def observe(name, seconds, **labels):
+    with _lock:
+        key = _key(name, labels)
+        histogram = _histograms.setdefault(key, {'buckets': [0] * len(DURATION_BUCKETS), 'sum': 0.0, 'count': 0})
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if seconds <= bound:
+                histogram['buckets'][i] += 1
+        histogram['sum'] += seconds
+        histogram['count'] += 1
+
+
+@contextmanager
+def span(stage):
+    """
+    Time a pipeline stage. Stages nested in another one also count in their parent,
+    whose self_seconds in the request breakdown excludes them.
+    """
+    breakdown = _breakdown.get()
+    if breakdown is not None:
+        breakdown['stack'].append(0.0)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        observe('stage_seconds', elapsed, stage=stage)
+        if breakdown is not None:
+            child_seconds = breakdown['stack'].pop()
+            if breakdown['stack']:
+                breakdown['stack'][-1] += elapsed
+            record = breakdown['stages'].setdefault(stage, {'seconds': 0.0, 'self_seconds': 0.0, 'calls': 0})
+            record['seconds'] += elapsed
+            record['self_seconds'] += elapsed - child_seconds
+            record['calls'] += 1
+
+
+def timed(stage):
+    """Decorator recording every call of a function as a span."""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def cache_lookup(cache, hit):
+    count('cache_requests', cache=cache, result='hit' if hit else 'miss')
+
+
+def register_cache(cache, function):
+    """Export the hits and misses of an lru_cache decorated function."""
+    _caches[cache] = function
+    return function
+
+
+def start_request():
+    """Collect the stages of the current request, returns the token to pass to end_request."""
+    return _breakdown.set({'started': time.perf_counter(), 'stages': {}, 'counters': {}, 'stack': []})
+
+
+def end_request(token, endpoint, method, status):
+    breakdown = _breakdown.get()
+    _breakdown.reset(token)
+    if breakdown is not None:
+        observe('request_seconds', time.perf_counter() - breakdown['started'], endpoint=endpoint)
+    count('requests', endpoint=endpoint, method=method, status=str(status))
+
+
+def timing_breakdown():
+    """Stages, counters and peak RSS of the current request, None outside of a request."""
+    breakdown = _breakdown.get()
+    if breakdown is None:
+        return None
+    peak = peak_rss_bytes()
+    return {
+        'total_seconds': round(time.perf_counter() - breakdown['started'], 6),
+        'stages': {stage: {field: round(value, 6) for field, value in record.items()}
+                   for stage, record in breakdown['stages'].items()},
+        'counters': dict(breakdown['counters']),
+        'peak_rss_mb': round(peak / (1024 * 1024), 1) if peak is not None else None,
+    }
+
+
+def server_timing():
+    """Server-Timing header value of the current request, one entry per stage."""
+    breakdown = _breakdown.get()
+    if breakdown is None:
+        return ''
+    return ', '.join(f"{stage};dur={record['seconds'] * 1000:.1f}"
+                     for stage, record in breakdown['stages'].items())
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _header(lines, name, metric_type, suffix=''):
+    if name in DESCRIPTIONS:
+        lines.append(f"# HELP {METRIC_PREFIX}_{name}{suffix} {DESCRIPTIONS[name]}")
+    lines.append(f"# TYPE {METRIC_PREFIX}_{name}{suffix} {metric_type}")
+
+
+def render_prometheus():
+    """
+    Every metric in the Prometheus text format. Metrics live in the memory of each process,
+    with several DG_WORKERS processes every one of them has to be scraped.
+    """
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: {'buckets': list(value['buckets']), 'sum': value['sum'], 'count': value['count']}
+                      for key, value in _histograms.items()}
+
+    # lru_cache statistics are read at scrape time rather than counted on every call
+    ratios = {}
+    for cache, function in _caches.items():
+        info = function.cache_info()
+        counters[_key('cache_requests', {'cache': cache, 'result': 'hit'})] = info.hits
+        counters[_key('cache_requests', {'cache': cache, 'result': 'miss'})] = info.misses
+    for (name, labels), value in counters.items():
+        if name == 'cache_requests':
+            cache = dict(labels)['cache']
+            hits, total = ratios.get(cache, (0, 0))
+            ratios[cache] = (hits + (value if dict(labels)['result'] == 'hit' else 0), total + value)
+
+    lines = []
+    for name in sorted({name for name, _ in counters}):
+        _header(lines, name, 'counter', suffix='_total')
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{METRIC_PREFIX}_{name}_total{_labels(labels)} {value}")
+
+    for name in sorted({name for name, _ in histograms}):
+        _header(lines, name, 'histogram')
+        for (metric, labels), histogram in sorted(histograms.items()):
+            if metric != name:
+                continue
+            for bound, observations in zip(DURATION_BUCKETS, histogram['buckets']):
+                lines.append(f"{METRIC_PREFIX}_{name}_bucket{_labels(labels, le=bound)} {observations}")
+            lines.append(f"{METRIC_PREFIX}_{name}_bucket{_labels(labels, le='+Inf')} {histogram['count']}")
+            lines.append(f"{METRIC_PREFIX}_{name}_sum{_labels(labels)} {histogram['sum']}")
+            lines.append(f"{METRIC_PREFIX}_{name}_count{_labels(labels)} {histogram['count']}")
+
+    if ratios:
+        _header(lines, 'cache_hit_ratio', 'gauge')
+        for cache, (hits, total) in sorted(ratios.items()):
+            lines.append(f"{METRIC_PREFIX}_cache_hit_ratio{_labels([('cache', cache)])} {hits / total if total else 0.0}")
+
+    peak = peak_rss_bytes()
+    if peak is not None:
+        _header(lines, 'process_peak_rss_bytes', 'gauge')
+        lines.append(f"{METRIC_PREFIX}_process_peak_rss_bytes {peak}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,37 @@
+from flask import Blueprint, request, make_response, g
+from . import metrics
+
+
+bp = Blueprint('metrics', __name__)
+
+
+@bp.before_app_request
+def start_request_metrics():
+    g.metrics_token = metrics.start_request()
+
+
+@bp.after_app_request
+def attach_server_timing(response):
+    g.response_status = response.status_code
+    timing = metrics.server_timing()
+    if timing:
+        response.headers.set('Server-Timing', timing)
+    return response
+
+
+@bp.teardown_app_request
+def end_request_metrics(error=None):
+    token = g.pop('metrics_token', None)
+    if token is None:
+        return
+    # Unhandled exceptions skip the after_request hooks
+    status = 500 if error is not None else g.get('response_status', 200)
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.end_request(token, endpoint, request.method, status)
+
+
+@bp.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    response = make_response(metrics.render_prometheus())
+    response.headers.set('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+    return response
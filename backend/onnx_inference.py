@@ -0,0 +1,186 @@
+import os
+import time
+import inspect
+import logging
+import numpy as np
+from transformers import AutoTokenizer, AutoModel
+
+try:
+    import onnxruntime
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+except ImportError:
+    onnxruntime = None
+
+from .runtime_config import load_runtime_config
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+ONNX_MODEL_DIRECTORY_PATH = os.path.join(BASE_DIR, 'data', 'models', 'onnx')
+
+INFERENCE_BACKENDS = ('torch', 'onnx', 'onnx-int8')
+DEFAULT_INFERENCE_BACKEND = os.getenv('DG_INFERENCE_BACKEND', 'torch')
+
+# Embedding key -> (Hugging Face model id, max sequence length)
+ONNX_MODELS = {
+    'bert': ('bert-base-uncased', 512),
+    'paraphrase': ('sentence-transformers/paraphrase-MiniLM-L6-v2', 128),
+}
+ONNX_OPSET_VERSION = 14
+# Bumped when exports change, so models exported by an older version are not reused
+ONNX_EXPORT_REVISION = 2
+# Sentences the exported graph is checked on against the PyTorch model
+EXPORT_CHECK_TEXTS = ["export sample feature", "send message", "share photos with friends in a group chat"]
+EXPORT_CHECK_TOLERANCE = 1e-3
+
+
+def check_inference_backend(inference_backend):
+    if inference_backend not in INFERENCE_BACKENDS:
+        raise ValueError(f"Unsupported inference backend: {inference_backend}")
+    if inference_backend != 'torch' and onnxruntime is None:
+        raise ValueError(f"Inference backend {inference_backend} requires the onnxruntime package")
+    return inference_backend
+
+
+def onnx_model_path(model_key, quantize=False):
+    suffix = '-int8' if quantize else ''
+    return os.path.join(ONNX_MODEL_DIRECTORY_PATH, f"{model_key}-r{ONNX_EXPORT_REVISION}{suffix}.onnx")
+
+
+def export_model(model_key, quantize=False):
+    import torch
+
+    model_id, max_length = ONNX_MODELS[model_key]
+    fp32_path = onnx_model_path(model_key)
+    os.makedirs(ONNX_MODEL_DIRECTORY_PATH, exist_ok=True)
+
+    if not os.path.exists(fp32_path):
+        logging.info(f"Exporting {model_id} to {fp32_path}...")
+        tokenizer = AutoTokenizer.from_pretrained(model_id)
+        model = AutoModel.from_pretrained(model_id)
+        model.eval()
+        inputs = tokenizer(["export sample feature"], return_tensors='pt', padding=True,
+                           truncation=True, max_length=max_length)
+        # Graph inputs follow the forward signature, not the order of the tokenizer outputs
+        # (BertModel takes attention_mask before token_type_ids)
+        input_names = [name for name in inspect.signature(model.forward).parameters if name in inputs]
+        dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+        dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+        with torch.no_grad():
+            torch.onnx.export(model,
+                              ({name: inputs[name] for name in input_names},),
+                              fp32_path,
+                              input_names=input_names,
+                              output_names=['last_hidden_state'],
+                              dynamic_axes=dynamic_axes,
+                              opset_version=ONNX_OPSET_VERSION)
+        try:
+            check_export(fp32_path, tokenizer, model, max_length)
+        except Exception:
+            os.remove(fp32_path)
+            raise
+
+    if not quantize:
+        return fp32_path
+
+    int8_path = onnx_model_path(model_key, quantize=True)
+    if not os.path.exists(int8_path):
+        logging.info(f"Quantizing {fp32_path} to {int8_path}...")
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    return int8_path
+
+
+def check_export(onnx_path, tokenizer, model, max_length):
+    """Raise when the exported graph does not reproduce the PyTorch hidden states."""
+    import torch
+
+    if onnxruntime is None:
+        raise ValueError("Checking an ONNX export requires the onnxruntime package")
+
+    inputs = tokenizer(EXPORT_CHECK_TEXTS, return_tensors='pt', padding=True, truncation=True,
+                       max_length=max_length)
+    with torch.no_grad():
+        expected = model(**inputs).last_hidden_state.numpy()
+
+    session = onnxruntime.InferenceSession(onnx_path, providers=['CPUExecutionProvider'])
+    feed = {model_input.name: inputs[model_input.name].numpy().astype(np.int64)
+            for model_input in session.get_inputs()}
+    actual = session.run(['last_hidden_state'], feed)[0]
+    error = float(np.max(np.abs(actual - expected)))
+    if error > EXPORT_CHECK_TOLERANCE:
+        raise RuntimeError(f"ONNX export of {onnx_path} differs from the PyTorch model "
+                           f"(max absolute error {error:.2e})")
+
+
+class OnnxEncoder:
+    def __init__(self, model_key, quantize=False, runtime_config=None):
+        if onnxruntime is None:
+            raise ValueError("ONNX inference requires the onnxruntime package")
+        runtime_config = runtime_config or load_runtime_config()
+        model_id, self.max_length = ONNX_MODELS[model_key]
+        self.tokenizer = AutoTokenizer.from_pretrained(model_id)
+
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = runtime_config['torch_threads']
+        session_options.inter_op_num_threads = runtime_config['torch_interop_threads']
+        session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(export_model(model_key, quantize),
+                                                    session_options,
+                                                    providers=['CPUExecutionProvider'])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def last_hidden_state(self, texts):
+        inputs = self.tokenizer(texts, return_tensors='np', padding=True, truncation=True,
+                                max_length=self.max_length)
+        feed = {name: value.astype(np.int64) for name, value in inputs.items() if name in self.input_names}
+        return self.session.run(['last_hidden_state'], feed)[0], inputs['attention_mask']
+
+    def encode(self, texts):
+        """Mean of the hidden states over the attention mask, so padding does not count."""
+        hidden_state, attention_mask = self.last_hidden_state(texts)
+        mask = attention_mask[:, :, np.newaxis].astype(hidden_state.dtype)
+        return (hidden_state * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+
+def cosine_agreement_report(model_key, texts, quantize=False, batch_size=32, threshold=0.99):
+    """Compare ONNX Runtime sentence embeddings against the PyTorch ones for the same texts."""
+    import torch
+
+    model_id, max_length = ONNX_MODELS[model_key]
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    model = AutoModel.from_pretrained(model_id)
+    model.eval()
+    encoder = OnnxEncoder(model_key, quantize=quantize)
+
+    torch_embeddings = []
+    started = time.perf_counter()
+    for i in range(0, len(texts), batch_size):
+        inputs = tokenizer(texts[i:i + batch_size], return_tensors='pt', padding=True, truncation=True,
+                           max_length=max_length)
+        with torch.no_grad():
+            hidden_state = model(**inputs).last_hidden_state
+        mask = inputs['attention_mask'].unsqueeze(-1).float()
+        torch_embeddings.append(((hidden_state * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)).numpy())
+    torch_seconds = time.perf_counter() - started
+
+    onnx_embeddings = []
+    started = time.perf_counter()
+    for i in range(0, len(texts), batch_size):
+        onnx_embeddings.append(encoder.encode(texts[i:i + batch_size]))
+    onnx_seconds = time.perf_counter() - started
+
+    torch_embeddings = np.concatenate(torch_embeddings)
+    onnx_embeddings = np.concatenate(onnx_embeddings)
+    similarities = np.sum(torch_embeddings * onnx_embeddings, axis=1) / (
+        np.linalg.norm(torch_embeddings, axis=1) * np.linalg.norm(onnx_embeddings, axis=1))
+
+    return {
+        'model': model_id,
+        'backend': 'onnx-int8' if quantize else 'onnx',
+        'n_texts': len(texts),
+        'mean_cosine': float(np.mean(similarities)),
+        'min_cosine': float(np.min(similarities)),
+        'p05_cosine': float(np.percentile(similarities, 5)),
+        f'fraction_above_{threshold}': float(np.mean(similarities >= threshold)),
+        'torch_seconds': torch_seconds,
+        'onnx_seconds': onnx_seconds,
+        'speedup': torch_seconds / onnx_seconds if onnx_seconds else None,
+    }
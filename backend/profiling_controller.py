@@ -0,0 +1,27 @@
+import os
+from flask import Blueprint, make_response, jsonify, send_from_directory
+from . import profiling_service
+
+
+bp = Blueprint('profiles', __name__, url_prefix='/profiles')
+
+
+@bp.before_request
+def require_profiling():
+    if not profiling_service.PROFILING_ENABLED:
+        return make_response({"error": "Profiling is disabled, set DG_PROFILING_ENABLED=true to enable it"}, 403)
+
+
+@bp.route('', methods=['GET'])
+def list_profiles():
+    return jsonify({"profiles": profiling_service.list_profiles()}), 200
+
+
+@bp.route('/<name>', methods=['GET'])
+def download_profile(name):
+    try:
+        file_name = profiling_service.profile_file(name)
+    except FileNotFoundError as e:
+        return make_response({"error": str(e)}, 404)
+    return send_from_directory(os.path.abspath(profiling_service.PROFILE_DIRECTORY_PATH), file_name,
+                               as_attachment=True)
@@ -0,0 +1,170 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from .utils import STAGE_2_OUTPUT_PATH
+
+# Profiling is off unless the deployment opts in, a profiled request runs noticeably slower
+PROFILING_ENABLED = os.getenv('DG_PROFILING_ENABLED', 'false').lower() == 'true'
+DEFAULT_PROFILER = os.getenv('DG_PROFILER', 'sampling')
+SAMPLING_INTERVAL = float(os.getenv('DG_PROFILING_INTERVAL', 0.005))
+PROFILE_DIRECTORY_PATH = os.path.join(STAGE_2_OUTPUT_PATH, 'profiles')
+
+# Profiler -> extension of the file it writes
+PROFILERS = {
+    'sampling': 'collapsed',
+    'cprofile': 'pstats',
+}
+
+
+def check_profiler(profiler):
+    if profiler not in PROFILERS:
+        raise ValueError(f"Unsupported profiler: {profiler}, expected one of {', '.join(PROFILERS)}")
+    return profiler
+
+
+def profile_requested(args):
+    """
+    Profiler named by the profile/profiler query parameters, None when profiling was not asked for.
+    Raises PermissionError when it was asked for but DG_PROFILING_ENABLED is off.
+    """
+    if args.get('profile', 'false').lower() != 'true':
+        return None
+    if not PROFILING_ENABLED:
+        raise PermissionError("Profiling is disabled, set DG_PROFILING_ENABLED=true to enable it")
+    return check_profiler(args.get('profiler', DEFAULT_PROFILER))
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stack of one thread every interval seconds from a background thread.
+    Stacks are written in the collapsed format read by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval=SAMPLING_INTERVAL, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name='dg-profiler', daemon=True)
+
+    def start(self):
+        self._sampler.start()
+
+    def stop(self):
+        self._stop.set()
+        self._sampler.join()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if frames:
+                self.stacks[';'.join(reversed(frames))] += 1
+
+    def write(self, file_path):
+        with open(file_path, 'w', encoding='utf-8') as file:
+            for stack, samples in self.stacks.most_common():
+                file.write(f"{stack} {samples}\n")
+        return sum(self.stacks.values())
+
+
+class DeterministicProfiler:
+    """cProfile of the calling thread, written as pstats for snakeviz or pstats.Stats."""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def write(self, file_path):
+        self.profile.dump_stats(file_path)
+        return None
+
+
+class ProfileSession:
+    def __init__(self, profiler):
+        self.profiler = profiler
+        self.started = None
+        self.seconds = None
+        self.name = None
+        self._profiler = SamplingProfiler() if profiler == 'sampling' else DeterministicProfiler()
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._profiler.start()
+
+    def stop(self):
+        self._profiler.stop()
+        self.seconds = time.perf_counter() - self.started
+
+    def save(self, name, metadata=None):
+        """
+        Write the profile as <name>-<timestamp>.<collapsed|pstats> with a JSON sidecar
+        describing the request, returns the profile name.
+        """
+        os.makedirs(PROFILE_DIRECTORY_PATH, exist_ok=True)
+        self.name = f"{name}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}"
+        profile_file = f"{self.name}.{PROFILERS[self.profiler]}"
+        samples = self._profiler.write(os.path.join(PROFILE_DIRECTORY_PATH, profile_file))
+
+        with open(os.path.join(PROFILE_DIRECTORY_PATH, f"{self.name}.json"), 'w') as sidecar:
+            json.dump({
+                'name': self.name,
+                'profiler': self.profiler,
+                'file': profile_file,
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'seconds': self.seconds,
+                'samples': samples,
+                **(metadata or {}),
+            }, sidecar, indent=4)
+        return self.name
+
+
+@contextmanager
+def profile_request(profiler):
+    """Profile the block with the given profiler, yields None and does nothing when profiler is None."""
+    if profiler is None:
+        yield None
+        return
+
+    session = ProfileSession(profiler)
+    session.start()
+    try:
+        yield session
+    finally:
+        session.stop()
+
+
+def list_profiles():
+    """Metadata of every saved profile, newest first."""
+    if not os.path.isdir(PROFILE_DIRECTORY_PATH):
+        return []
+    profiles = []
+    for file_name in os.listdir(PROFILE_DIRECTORY_PATH):
+        if file_name.endswith('.json'):
+            with open(os.path.join(PROFILE_DIRECTORY_PATH, file_name)) as sidecar:
+                profiles.append(json.load(sidecar))
+    return sorted(profiles, key=lambda profile: profile['created'], reverse=True)
+
+
+def profile_file(name):
+    """File name of a saved profile, inside PROFILE_DIRECTORY_PATH."""
+    sidecar_path = os.path.join(PROFILE_DIRECTORY_PATH, f"{os.path.basename(name)}.json")
+    if not os.path.isfile(sidecar_path):
+        raise FileNotFoundError(f"Profile {name} not found")
+    with open(sidecar_path) as sidecar:
+        return json.load(sidecar)['file']
@@ -0,0 +1,118 @@
+import os
+import logging
+from contextlib import contextmanager
+
+CPU_COUNT = os.cpu_count() or 1
+
+# Runtime setting -> environment variable holding its process-wide default
+ENV_VARIABLES = {
+    'workers': 'DG_WORKERS',
+    'torch_threads': 'DG_TORCH_THREADS',
+    'torch_interop_threads': 'DG_TORCH_INTEROP_THREADS',
+    'blas_threads': 'DG_BLAS_THREADS',
+    'spacy_n_process': 'DG_SPACY_N_PROCESS',
+    'sklearn_n_jobs': 'DG_SKLEARN_N_JOBS',
+}
+
+# Runtime setting -> query parameter that overrides it for a single request
+REQUEST_ARGUMENTS = {
+    'torch_threads': 'torch-threads',
+    'torch_interop_threads': 'torch-interop-threads',
+    'blas_threads': 'blas-threads',
+    'spacy_n_process': 'spacy-processes',
+    'sklearn_n_jobs': 'n-jobs',
+}
+
+BLAS_ENV_VARIABLES = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                      'VECLIB_MAXIMUM_FRAMEWORK_THREADS', 'NUMEXPR_NUM_THREADS')
+
+
+def _read_int(value, name):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid value for {name}: {value!r}, expected a positive integer")
+    if value < 1:
+        raise ValueError(f"Invalid value for {name}: {value}, expected a positive integer")
+    return value
+
+
+def default_runtime_config():
+    """Split the machine between DG_WORKERS concurrent requests."""
+    workers = _read_int(os.getenv(ENV_VARIABLES['workers'], 1), ENV_VARIABLES['workers'])
+    threads = max(1, CPU_COUNT // workers)
+    return {
+        'workers': workers,
+        'torch_threads': threads,
+        'torch_interop_threads': 1,
+        'blas_threads': threads,
+        'spacy_n_process': 1,
+        'sklearn_n_jobs': threads,
+    }
+
+
+def load_runtime_config(overrides=None):
+    config = default_runtime_config()
+
+    for key, env_variable in ENV_VARIABLES.items():
+        value = os.getenv(env_variable)
+        if value:
+            config[key] = _read_int(value, env_variable)
+
+    for key, value in (overrides or {}).items():
+        if key not in config:
+            raise ValueError(f"Unknown runtime setting: {key}")
+        if value is not None:
+            config[key] = _read_int(value, key)
+
+    return config
+
+
+def runtime_overrides_from_args(args):
+    return {key: args.get(argument) for key, argument in REQUEST_ARGUMENTS.items() if args.get(argument)}
+
+
+def configure_environment(config=None):
+    """
+    Export BLAS/OpenMP thread counts. Native libraries only read these on load,
+    so this must run before numpy, torch or sklearn are first imported.
+    """
+    config = config or load_runtime_config()
+    for env_variable in BLAS_ENV_VARIABLES:
+        os.environ.setdefault(env_variable, str(config['blas_threads']))
+    return config
+
+
+def apply_runtime_config(config):
+    import torch
+    from threadpoolctl import threadpool_limits
+
+    torch.set_num_threads(config['torch_threads'])
+    if torch.get_num_interop_threads() != config['torch_interop_threads']:
+        try:
+            torch.set_num_interop_threads(config['torch_interop_threads'])
+        except RuntimeError:
+            # Inter-op threads can only be set once, before any parallel work starts
+            logging.debug("Torch inter-op thread count already fixed, keeping %s",
+                          torch.get_num_interop_threads())
+
+    return threadpool_limits(limits=config['blas_threads'], user_api='blas')
+
+
+@contextmanager
+def runtime_scope(config):
+    """
+    Apply the thread settings of ``config`` and restore the previous ones afterwards.
+    Thread pools are process-wide, so concurrent requests should be spread over
+    DG_WORKERS processes rather than over threads of a single process.
+    """
+    import torch
+
+    previous_threads = torch.get_num_threads()
+    limits = apply_runtime_config(config)
+    logging.info(f"Runtime config: {config}")
+    try:
+        yield config
+    finally:
+        limits.restore_original_limits()
+        torch.set_num_threads(previous_threads)
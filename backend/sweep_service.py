@@ -0,0 +1,85 @@
+import os
+import json
+import logging
+from joblib import Parallel, delayed
+from .batch_service import cluster_app
+from .dendogram_service import prepare_features, create_strategy
+from .onnx_inference import DEFAULT_INFERENCE_BACKEND
+from .runtime_config import load_runtime_config, runtime_scope
+from .utils import STAGE_2_MODEL_DIRECTORY_PATH
+from . import metrics
+
+
+def sweep_directory_name(model_name, metric, linkage, app_name):
+    return f"sweep_{model_name.lower()}_{metric}_{linkage}-{app_name}"
+
+
+def save_sweep_index(subdirectory, index):
+    index_path = os.path.join(os.getcwd(), STAGE_2_MODEL_DIRECTORY_PATH, subdirectory, 'sweep_index.json')
+    with open(index_path, 'w') as index_file:
+        json.dump(index, index_file, indent=4)
+    return index_path
+
+
+def run_sweep(preprocessing,
+              embedding,
+              metric,
+              linkage,
+              app_name,
+              features,
+              weight_pairs,
+              thresholds,
+              runtime_overrides=None,
+              inference_backend=DEFAULT_INFERENCE_BACKEND,
+              dedupe=None):
+    """
+    Cluster one app for every (verb_weight, object_weight) pair and threshold.
+    Embeddings, token vectors and POS tags are computed once; each weight pair is a
+    vectorised reweighting of them.
+    """
+    runtime_config = load_runtime_config(runtime_overrides)
+    features, duplicates = prepare_features(app_name, features, preprocessing, dedupe)
+
+    with runtime_scope(runtime_config):
+        strategy = create_strategy(embedding, runtime_config, inference_backend)
+        with metrics.span('embed'):
+            sweep_state = strategy.prepare_sweep(features)
+        subdirectory = sweep_directory_name(strategy.model_name, metric, linkage, app_name)
+
+        tasks = []
+        for verb_weight, object_weight in weight_pairs:
+            with metrics.span('reweight'):
+                dense_data_array, labels = strategy.reweight(sweep_state, verb_weight, object_weight)
+            if len(dense_data_array) < 2:
+                raise ValueError(f"Not enough features to cluster for {app_name}")
+            for threshold in thresholds:
+                tasks.append((dense_data_array, labels, {
+                    'distance_threshold': threshold,
+                    'verb_weight': verb_weight,
+                    'object_weight': object_weight,
+                }))
+
+        logging.info(f"Clustering {len(tasks)} sweep combinations with {runtime_config['sklearn_n_jobs']} workers")
+        # One span for the whole weight x threshold grid, see cluster_app for the per-task stages
+        with metrics.span('cluster_batch'):
+            paths = Parallel(n_jobs=runtime_config['sklearn_n_jobs'])(
+                delayed(cluster_app)(app_name, strategy.model_name, dense_data_array, labels,
+                                     linkage, metric, parameters, subdirectory, duplicates=duplicates)
+                for dense_data_array, labels, parameters in tasks
+            )
+
+    index = {
+        'application_name': app_name,
+        'model_name': strategy.model_name,
+        'metric': metric,
+        'linkage': linkage,
+        'n_features': len(sweep_state['labels']),
+        'results': [{
+            'threshold': parameters['distance_threshold'],
+            'verb_weight': parameters['verb_weight'],
+            'object_weight': parameters['object_weight'],
+            'dendrogram_path': path,
+        } for (_, _, parameters), path in zip(tasks, paths)],
+    }
+    index['index_path'] = save_sweep_index(subdirectory, index)
+    return index
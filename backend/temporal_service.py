@@ -0,0 +1,133 @@
+import logging
+import numpy as np
+from sklearn.metrics import pairwise_distances
+from .Affinity_strategy import cluster_embeddings, uses_precomputed_distances
+from .batch_service import embed_apps
+from .dendogram_service import prepare_features, create_strategy
+from .onnx_inference import DEFAULT_INFERENCE_BACKEND
+from .runtime_config import load_runtime_config, runtime_scope
+from .utils import Utils
+
+
+def series_file_name(model_name, metric, linkage, distance_threshold, verb_weight, object_weight, app_name):
+    return (f"series_{model_name.lower()}_"
+            f"{metric}_"
+            f"{linkage}_"
+            f"thr_{distance_threshold}_"
+            f"vw_{verb_weight}_"
+            f"ow_{object_weight}"
+            f"-{app_name}.pkl")
+
+
+class IncrementalDistances:
+    """
+    Square distance matrix of the current window. Distances between features already
+    present in the previous window are copied, only rows of new features are computed.
+    """
+
+    def __init__(self, metric, n_jobs=None):
+        self.metric = metric
+        self.n_jobs = n_jobs
+        self.index = {}
+        self.matrix = None
+
+    def reset(self):
+        self.index = {}
+        self.matrix = None
+
+    def update(self, labels, dense_data_array):
+        kept = [row for row, label in enumerate(labels) if label in self.index]
+        new = [row for row, label in enumerate(labels) if label not in self.index]
+
+        matrix = np.empty((len(labels), len(labels)), dtype=dense_data_array.dtype)
+        if kept:
+            previous_rows = np.array([self.index[labels[row]] for row in kept], dtype=np.intp)
+            matrix[np.ix_(kept, kept)] = self.matrix[np.ix_(previous_rows, previous_rows)]
+        if new:
+            new_distances = pairwise_distances(dense_data_array[new], dense_data_array,
+                                               metric=self.metric, n_jobs=self.n_jobs)
+            matrix[new, :] = new_distances
+            matrix[:, new] = new_distances.T
+
+        self.index = {label: row for row, label in enumerate(labels)}
+        self.matrix = matrix
+        return matrix, len(new)
+
+
+def generate_series(preprocessing,
+                    embedding,
+                    metric,
+                    linkage,
+                    distance_threshold,
+                    object_weight,
+                    verb_weight,
+                    app_name,
+                    windows,
+                    runtime_overrides=None,
+                    inference_backend=DEFAULT_INFERENCE_BACKEND):
+    """
+    Cluster every date window of an app into a single series artifact.
+    Embeddings of features shared across windows are computed once, distances of features
+    already in the previous window are reused and an unchanged feature set reuses the previous tree.
+    Each frame stores its linkage matrix so the slider does not rebuild it.
+    """
+    runtime_config = load_runtime_config(runtime_overrides)
+    windows = [{'app_name': window['date'],
+                'features': prepare_features(f"{app_name}-{window['date']}", window['features'], preprocessing)[0]}
+               for window in sorted(windows, key=lambda window: window['date'])]
+
+    frames = []
+    with runtime_scope(runtime_config):
+        strategy = create_strategy(embedding, runtime_config, inference_backend)
+        strategy.verb_weight = verb_weight
+        strategy.object_weight = object_weight
+        distances = IncrementalDistances(metric, runtime_config['sklearn_n_jobs'])
+        previous = None
+
+        for window, dense_data_array, labels in embed_apps(strategy, windows):
+            if len(dense_data_array) < 2:
+                logging.warning(f"Skipping window {window['app_name']}: not enough features to cluster")
+                continue
+
+            if previous is not None and set(labels) == set(previous['labels']):
+                # Same features as the previous window, its tree is still valid
+                frames.append({**previous, 'date': window['app_name'], 'new_features': 0, 'reused': True})
+                continue
+
+            # Embeddings that depend on the window corpus cannot share distances across windows
+            if uses_precomputed_distances(linkage, len(labels)) and strategy.shared_embeddings:
+                distance_matrix, new_features = distances.update(labels, dense_data_array)
+            else:
+                distances.reset()
+                distance_matrix, new_features = None, len(labels)
+
+            clustering_model = cluster_embeddings(dense_data_array, linkage, distance_threshold, metric,
+                                                  n_jobs=runtime_config['sklearn_n_jobs'],
+                                                  distance_matrix=distance_matrix)
+            logging.info(f"Window {window['app_name']}: {len(labels)} features, {new_features} new")
+            previous = {
+                'date': window['app_name'],
+                'labels': labels,
+                'linkage_matrix': Utils.linkage_matrix(clustering_model),
+                'cluster_labels': clustering_model.labels_,
+                'n_clusters': int(clustering_model.n_clusters_),
+                'new_features': new_features,
+                'reused': False,
+            }
+            frames.append(previous)
+
+    if not frames:
+        raise ValueError(f"Not enough features to cluster any window of {app_name}")
+
+    model_info = {
+        'affinity': f'{strategy.model_name} {metric} {linkage}',
+        'model_name': strategy.model_name,
+        'application_name': app_name,
+        'distance_threshold': distance_threshold,
+        'verb_weight': verb_weight,
+        'object_weight': object_weight,
+        'frames': frames,
+    }
+    file_name = series_file_name(strategy.model_name, metric, linkage, distance_threshold,
+                                 verb_weight, object_weight, app_name)
+    return Utils.save_to_pkl(model_info, file_name), frames
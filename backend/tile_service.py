@@ -0,0 +1,218 @@
+import io
+import os
+import json
+import math
+from functools import lru_cache
+import joblib
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection, PolyCollection
+from client.dendrogram_layout import DendrogramLayout, cluster_membership
+from .utils import Utils, STAGE_2_OUTPUT_PATH, STAGE_3_INPUT_PATH
+from .visualization_service import generate_infinite_colors
+from . import metrics
+
+# Level of detail: at zoom z the leaf axis is split into 2**z tiles and the last
+# TILE_LEAVES * 2**z merges are drawn, so every tile shows about TILE_LEAVES leaves
+TILE_LEAVES = int(os.getenv('DG_TILE_LEAVES', 64))
+TILE_SIZE = int(os.getenv('DG_TILE_SIZE', 512))
+TILE_FORMATS = ('png', 'json')
+TILE_CACHE_PATH = os.path.join('data', 'Stage 3 - Topic Modelling', 'output', 'tiles')
+ABOVE_THRESHOLD_COLOR = 'grey'
+
+
+def resolve_artifact(file_path):
+    """Absolute path of a Stage 2/3 artifact, refusing paths outside the data folders."""
+    path = os.path.realpath(file_path)
+    allowed = [os.path.realpath(folder) for folder in (STAGE_2_OUTPUT_PATH, STAGE_3_INPUT_PATH)]
+    if not any(os.path.commonpath([path, folder]) == folder for folder in allowed):
+        raise ValueError(f"{file_path} is not a dendrogram artifact")
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"Dendrogram file {file_path} not found")
+    return path
+
+
+class TileSource:
+    """Layout of one artifact at every zoom level, each level computed on its first request."""
+
+    def __init__(self, file_path):
+        model_info = joblib.load(file_path)
+        self.file_path = file_path
+        self.labels = list(model_info['labels'])
+        self.application_name = model_info['application_name']
+        self.linkage_matrix, self.threshold = Utils.visualization_linkage(model_info)
+        self.layout = DendrogramLayout(self.linkage_matrix, distance_sort='descending')
+        self.n_leaves = self.layout.n
+        self.max_distance = float(self.linkage_matrix[:, 2].max())
+        self.max_zoom = max(0, math.ceil(math.log2(self.n_leaves / TILE_LEAVES)))
+        self.levels = {}
+
+    def info(self):
+        return {
+            'application_name': self.application_name,
+            'n_leaves': self.n_leaves,
+            'max_zoom': self.max_zoom,
+            'tile_leaves': TILE_LEAVES,
+            'tile_size': TILE_SIZE,
+            'max_distance': self.max_distance,
+            'threshold': self.threshold,
+        }
+
+    def level(self, zoom, threshold):
+        """Links and leaves drawn at a zoom level, with the flat cluster of each for colouring."""
+        key = (zoom, threshold)
+        if key not in self.levels:
+            tree = self.layout.tree
+            p = min(self.n_leaves, TILE_LEAVES * 2 ** zoom)
+            layout = self.layout.compute(truncate_mode='lastp', p=p, span_leaves=True)
+
+            # Links and leaves under the threshold take the flat cluster containing them, numbered
+            # like the cluster folders so a cluster has the same colour in tiles and outputs
+            cluster_ids, _ = cluster_membership(self.linkage_matrix, threshold)
+            roots = tree.cut_roots(height=threshold)
+            roots = roots[roots >= self.n_leaves]
+            root_clusters = cluster_ids[tree.leaf_order[tree.start[roots]]]
+            for kind in ('links', 'leaves'):
+                nodes = layout[kind]
+                owner = np.searchsorted(tree.start[roots], tree.start[nodes], side='right') - 1
+                inside = (owner >= 0) & tree.is_ancestor(roots[np.maximum(owner, 0)], nodes)
+                layout[f'{kind}_cluster'] = np.where(inside, root_clusters[np.maximum(owner, 0)], -1)
+            layout['n_clusters'] = len(roots)
+
+            lo = layout['icoord'].min(axis=1)
+            hi = layout['icoord'].max(axis=1)
+            layout['extent'] = (lo, hi)
+            self.levels[key] = layout
+        return self.levels[key]
+
+    def tile_range(self, zoom, tile):
+        """Leaf axis range covered by a tile, in dendrogram units (10 per original observation)."""
+        if not 0 <= zoom <= self.max_zoom or not 0 <= tile < 2 ** zoom:
+            raise ValueError(f"Tile {zoom}/{tile} out of range, max zoom is {self.max_zoom}")
+        width = 10.0 * self.n_leaves / 2 ** zoom
+        return tile * width, (tile + 1) * width
+
+    def fragment(self, zoom, tile, threshold):
+        """Links and leaves intersecting a tile, with coordinates in dendrogram units."""
+        layout = self.level(zoom, threshold)
+        x0, x1 = self.tile_range(zoom, tile)
+        tree = self.layout.tree
+
+        lo, hi = layout['extent']
+        links = np.nonzero((hi >= x0) & (lo <= x1))[0]
+        positions = layout['leaf_positions']
+        starts = 10.0 * tree.start[layout['leaves']]
+        ends = starts + 10.0 * tree.count[layout['leaves']]
+        leaves = np.nonzero((ends >= x0) & (starts <= x1))[0]
+
+        return {
+            'zoom': zoom,
+            'tile': tile,
+            'range': [x0, x1],
+            'threshold': threshold,
+            'n_clusters': layout['n_clusters'],
+            'links': [{
+                'node': int(layout['links'][i]),
+                'icoord': layout['icoord'][i].tolist(),
+                'dcoord': layout['dcoord'][i].tolist(),
+                'cluster': int(layout['links_cluster'][i]),
+            } for i in links],
+            'leaves': [{
+                'node': int(layout['leaves'][i]),
+                'position': float(positions[i]),
+                'span': [float(starts[i]), float(ends[i])],
+                'count': int(tree.count[layout['leaves'][i]]),
+                'label': self.leaf_label(int(layout['leaves'][i])),
+                'cluster': int(layout['leaves_cluster'][i]),
+            } for i in leaves],
+        }
+
+    def leaf_label(self, node):
+        if node < self.n_leaves:
+            return self.labels[node]
+        return f"({int(self.layout.tree.count[node])})"
+
+    def render(self, zoom, tile, threshold):
+        """PNG of a tile: links as lines, collapsed clusters as triangles over the leaves they hold."""
+        fragment = self.fragment(zoom, tile, threshold)
+        x0, x1 = fragment['range']
+        cluster_colors = generate_infinite_colors(fragment['n_clusters'])
+
+        def color(cluster):
+            return ABOVE_THRESHOLD_COLOR if cluster < 0 else cluster_colors[cluster]
+
+        fig = Figure(figsize=(TILE_SIZE / 100, TILE_SIZE / 100), dpi=100)
+        FigureCanvasAgg(fig)
+        ax = fig.add_axes([0, 0.2, 1, 0.8])
+        ax.add_collection(LineCollection(
+            [np.column_stack([link['icoord'], link['dcoord']]) for link in fragment['links']],
+            colors=[color(link['cluster']) for link in fragment['links']], linewidths=1))
+
+        collapsed = [leaf for leaf in fragment['leaves'] if leaf['count'] > 1]
+        tree = self.layout.tree
+        ax.add_collection(PolyCollection(
+            [[(leaf['span'][0], 0), (leaf['position'], float(tree.dist[leaf['node']])), (leaf['span'][1], 0)]
+             for leaf in collapsed],
+            facecolors=[color(leaf['cluster']) for leaf in collapsed], alpha=0.3, edgecolors='none'))
+
+        ax.axhline(y=threshold, color='red', linestyle='--', linewidth=1)
+        ax.set_xlim(x0, x1)
+        ax.set_ylim(0, self.max_distance * 1.05)
+        ax.set_xticks([leaf['position'] for leaf in fragment['leaves']])
+        ax.set_xticklabels([leaf['label'] for leaf in fragment['leaves']], rotation=90, fontsize=6)
+        ax.tick_params(axis='y', labelsize=6)
+
+        stream = io.BytesIO()
+        fig.savefig(stream, format='png')
+        return stream.getvalue()
+
+
+@lru_cache(maxsize=8)
+def _tile_source(file_path, modified_time):
+    with metrics.span('tile_layout'):
+        return TileSource(file_path)
+
+
+metrics.register_cache('tile_layouts', _tile_source)
+
+
+def tile_source(file_path):
+    """Cached layouts of an artifact, dropped when the artifact is written again."""
+    path = resolve_artifact(file_path)
+    return _tile_source(path, os.path.getmtime(path))
+
+
+def tile_cache_path(source, zoom, tile, threshold, tile_format):
+    artifact_name = os.path.splitext(os.path.basename(source.file_path))[0]
+    return os.path.join(TILE_CACHE_PATH, artifact_name, f"thr_{threshold}", str(zoom), f"{tile}.{tile_format}")
+
+
+def get_tile(file_path, zoom, tile, tile_format='png', threshold=None):
+    """
+    Bytes of one tile, rendered on the first request and then served from the tile cache
+    until the artifact changes.
+    """
+    if tile_format not in TILE_FORMATS:
+        raise ValueError(f"Unknown tile format {tile_format}, expected one of {', '.join(TILE_FORMATS)}")
+    source = tile_source(file_path)
+    threshold = source.threshold if threshold is None else threshold
+    source.tile_range(zoom, tile)
+
+    cache_path = tile_cache_path(source, zoom, tile, threshold, tile_format)
+    hit = os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(source.file_path)
+    metrics.cache_lookup('tiles', hit)
+    if hit:
+        with open(cache_path, 'rb') as cached:
+            return cached.read()
+
+    with metrics.span('render_tile'):
+        if tile_format == 'png':
+            content = source.render(zoom, tile, threshold)
+        else:
+            content = json.dumps(source.fragment(zoom, tile, threshold)).encode('utf-8')
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    with open(cache_path, 'wb') as cached:
+        cached.write(content)
+    return content
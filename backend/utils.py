@@ -1,9 +1,22 @@
 import os
+from functools import lru_cache
 import joblib
 import pandas as pd
 import torch
 import numpy as np
 import spacy
+from scipy.cluster.hierarchy import linkage
+from scipy.spatial.distance import squareform
+from sklearn.metrics import pairwise_distances
+from . import metrics
+
+# Embeddings and distances are computed in EMBEDDING_DTYPE and persisted in STORAGE_DTYPE
+EMBEDDING_DTYPE = np.dtype(os.getenv('DG_EMBEDDING_DTYPE', 'float32'))
+STORAGE_DTYPE = np.dtype(os.getenv('DG_STORAGE_DTYPE', 'float32'))
+if EMBEDDING_DTYPE not in (np.float32, np.float64):
+    raise ValueError(f"DG_EMBEDDING_DTYPE must be float32 or float64, got {EMBEDDING_DTYPE}")
+
+OBJECT_DEPENDENCIES = ('dobj', 'nsubj', 'attr', 'prep', 'pobj')
 
 STAGE_2_OUTPUT_PATH = os.path.join('data', 'Stage 2 - Hierarchical Clustering', 'output')
 STAGE_3_INPUT_PATH = os.path.join('data', 'Stage 3 - Topic Modelling', 'input')
@@ -15,6 +28,28 @@ MODEL_DIRECTORY_CSV_PATH = os.path.join(STAGE_2_OUTPUT_PATH, 'csv')
 MODEL_DIRECTORY_CSV_EMBEDDINGS_PATH = os.path.join('static', 'csv', 'embeddings')
 
 class Utils:
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def load_spacy_model(name="en_core_web_sm"):
+        return spacy.load(name)
+
+    @staticmethod
+    @metrics.timed('tag')
+    def tag_features(features, n_process=1, batch_size=256):
+        nlp = Utils.load_spacy_model()
+        return list(nlp.pipe(features, n_process=n_process, batch_size=batch_size))
+
+    @staticmethod
+    def to_embedding_dtype(dense_data_array, dtype=None):
+        return np.asarray(dense_data_array).astype(dtype or EMBEDDING_DTYPE, copy=False)
+
+    @staticmethod
+    @metrics.timed('distance_matrix')
+    def condensed_distances(dense_data_array, metric='euclidean', n_jobs=None, dtype=None):
+        # float16 is only a storage format, distances are always computed in EMBEDDING_DTYPE
+        data = Utils.to_embedding_dtype(dense_data_array, dtype)
+        return squareform(pairwise_distances(data, metric=metric, n_jobs=n_jobs), checks=False)
+
     @staticmethod
     def process_batch(self, batch_data, batch_index, data_size):
         print(f"Processing batch {batch_index + 1}/{(data_size + len(batch_data) - 1) // len(batch_data)}...")
@@ -48,18 +83,49 @@ class Utils:
         return csv_file_path
 
     @staticmethod
-    def save_to_pkl(model_info: dict, pkl_filename: str):
-        if not os.path.exists(STAGE_2_MODEL_DIRECTORY_PATH):
-            os.makedirs(STAGE_2_MODEL_DIRECTORY_PATH)
-        pkl_file_path = os.path.join(os.getcwd(), STAGE_2_MODEL_DIRECTORY_PATH, pkl_filename)
+    @metrics.timed('save_artifact')
+    def save_to_pkl(model_info: dict, pkl_filename: str, subdirectory: str = ''):
+        stage_2_directory = os.path.join(STAGE_2_MODEL_DIRECTORY_PATH, subdirectory)
+        if not os.path.exists(stage_2_directory):
+            os.makedirs(stage_2_directory)
+        pkl_file_path = os.path.join(os.getcwd(), stage_2_directory, pkl_filename)
         print(f"Saving model to {pkl_file_path}...")
         joblib.dump(model_info, pkl_file_path)
 
-        pkl_file_path = os.path.join(os.getcwd(), STAGE_3_INPUT_PATH, pkl_filename)
+        stage_3_directory = os.path.join(STAGE_3_INPUT_PATH, subdirectory)
+        os.makedirs(stage_3_directory, exist_ok=True)
+        pkl_file_path = os.path.join(os.getcwd(), stage_3_directory, pkl_filename)
         print(f"Saving model to {pkl_file_path}...")
         joblib.dump(model_info, pkl_file_path)
         return pkl_file_path
 
+    @staticmethod
+    def linkage_matrix(clustering_model):
+        """scipy linkage matrix (children, distance, leaf count) of a fitted AgglomerativeClustering."""
+        children = clustering_model.children_
+        n_samples = len(clustering_model.labels_)
+        counts = np.zeros(children.shape[0])
+        for i, (left, right) in enumerate(children):
+            counts[i] = ((1 if left < n_samples else counts[left - n_samples])
+                         + (1 if right < n_samples else counts[right - n_samples]))
+        return np.column_stack([children, clustering_model.distances_, counts]).astype(float)
+
+    @staticmethod
+    def clustered_data_points(model_info):
+        """Embeddings the artifact was clustered on, reduced when a reduction was applied."""
+        return model_info.get('reduced_data_points', model_info['data_points'])
+
+    @staticmethod
+    def visualization_linkage(model_info):
+        """
+        Linkage matrix and cut threshold of the tree shown for an artifact: average euclidean linkage
+        of its clustered embeddings, cut at ten times its distance threshold. The cluster folders and
+        the dendrogram tiles both use it, so they show the same clusters.
+        """
+        data_points = Utils.clustered_data_points(model_info)
+        linkage_matrix = linkage(Utils.condensed_distances(data_points, 'euclidean'), method='average')
+        return linkage_matrix, model_info['distance_threshold'] * 10
+
     @staticmethod
     def generate_pkl(application_name,
                      clustering_model,
@@ -70,43 +136,112 @@ class Utils:
                      linkage,
                      metric,
                      verb_weight,
-                     object_weight):
+                     object_weight,
+                     subdirectory='',
+                     reduced_data_array=None,
+                     reduction=None,
+                     duplicates=None):
         print("Saving clustering metadata for plotting...")
         model_info = {
             'affinity': f'{model_name} {metric} {linkage}',
             'labels': labels,
             'model_name': model_name,
             'model': clustering_model,
-            'data_points': dense_data_array,
+            'data_points': np.asarray(dense_data_array).astype(STORAGE_DTYPE, copy=False),
             'application_name': application_name,
             'distance_threshold': distance_threshold,
             'verb_weight': verb_weight,
-            'object_weight': object_weight
+            'object_weight': object_weight,
+            'storage_dtype': STORAGE_DTYPE.name
         }
 
         if hasattr(clustering_model, 'cluster_centers_'):
             model_info['cluster_centers'] = clustering_model.cluster_centers_
 
+        # Each clustered feature stands for every occurrence and spelling collapsed into it
+        if duplicates is not None:
+            kept = [duplicates.get(label, {'count': 1, 'members': [label]}) for label in labels]
+            model_info['feature_counts'] = np.array([duplicate['count'] for duplicate in kept])
+            model_info['feature_members'] = [duplicate['members'] for duplicate in kept]
+
+        # The model was fitted on the reduced embeddings, the full ones are kept for re-clustering
+        reduction_suffix = ''
+        if reduction is not None:
+            model_info['reduced_data_points'] = np.asarray(reduced_data_array).astype(STORAGE_DTYPE, copy=False)
+            model_info['reduction'] = reduction
+            reduction_suffix = f"_{reduction['method']}_{reduction['n_components']}"
+
         pkl_file_name = (f"{model_name.lower()}_"
                          f"{metric}_"
                          f"{linkage}_"
                          f"thr_{distance_threshold}_"
                          f"vw_{verb_weight}_"
                          f"ow_{object_weight}"
+                         f"{reduction_suffix}"
                          f"-{application_name}.pkl")
-        return Utils.save_to_pkl(model_info, pkl_file_name)
+        return Utils.save_to_pkl(model_info, pkl_file_name, subdirectory)
+
+    @staticmethod
+    def pos_masks(tagged_data):
+        """Flatten the verb and object tokens of every tagged feature into parallel arrays."""
+        sentences, texts, is_verb, is_object = [], [], [], []
+        for i, doc in enumerate(tagged_data):
+            for token in doc:
+                verb = token.pos_ == 'VERB'
+                obj = token.dep_ in OBJECT_DEPENDENCIES
+                if verb or obj:
+                    sentences.append(i)
+                    texts.append(token.text)
+                    is_verb.append(verb)
+                    is_object.append(obj)
+
+        return {
+            'n_sentences': len(tagged_data),
+            'sentence': np.array(sentences, dtype=np.intp),
+            'text': texts,
+            'is_verb': np.array(is_verb, dtype=bool),
+            'is_object': np.array(is_object, dtype=bool),
+        }
+
+    @staticmethod
+    def token_weight_masks(pos_masks, verb_weight, object_weight):
+        """
+        Vectorised version of the token selection in ponderate_embeddings_with_weights:
+        a token counts as a verb when verb_weight is non-zero, otherwise as an object
+        when its dependency matches and object_weight is non-zero.
+        """
+        as_verb = pos_masks['is_verb'] & (verb_weight != 0)
+        as_object = ~as_verb & pos_masks['is_object'] & (object_weight != 0)
+        return as_verb, as_object
+
+    @staticmethod
+    def positional_token_weights(pos_masks, verb_weight, object_weight):
+        """
+        Weights of the selected tokens as ponderate_embeddings_with_weights assigns them:
+        the first n_verbs selected tokens of a feature get verb_weight, the rest object_weight.
+        """
+        as_verb, as_object = Utils.token_weight_masks(pos_masks, verb_weight, object_weight)
+        included = as_verb | as_object
+        n_sentences = pos_masks['n_sentences']
+        sentence = pos_masks['sentence'][included]
+
+        n_tokens = np.bincount(sentence, minlength=n_sentences)
+        n_verbs = np.bincount(pos_masks['sentence'][as_verb], minlength=n_sentences)
+        rank = np.arange(len(sentence)) - (np.cumsum(n_tokens) - n_tokens)[sentence]
+        weights = np.where(rank < n_verbs[sentence], verb_weight, object_weight)
+        return included, sentence, weights, n_tokens, n_verbs
 
     @staticmethod
     def ponderate_tfidf_with_weights(batch_data,
                                      tfidf_matrix,
                                      tfidf_vectorizer,
                                      verb_weight,
-                                     object_weight):
-        nlp = spacy.load("en_core_web_sm")
-
+                                     object_weight,
+                                     tagged_data=None):
         feature_names = np.array(tfidf_vectorizer.get_feature_names_out())
 
-        tagged_data = [nlp(sent) for sent in batch_data]
+        if tagged_data is None:
+            tagged_data = Utils.tag_features(batch_data)
 
         for i, doc in enumerate(tagged_data):
             tfidf_vector = tfidf_matrix[i]
@@ -125,7 +260,7 @@ class Utils:
                         weighted_tfidf_vector[token_index] *= verb_weight
 
                     # Apply object weight (e.g., for direct objects, subjects, etc.)
-                    elif token.dep_ in ('dobj', 'nsubj', 'attr', 'prep', 'pobj') and object_weight != 0:
+                    elif token.dep_ in OBJECT_DEPENDENCIES and object_weight != 0:
                         weighted_tfidf_vector[token_index] *= object_weight
 
             # Replace the original TF-IDF vector with the weighted version
@@ -139,10 +274,11 @@ class Utils:
                                           verb_weight,
                                           object_weight,
                                           tokenizer=None,
-                                          model=None):
-        nlp = spacy.load("en_core_web_sm")
-
-        tagged_data = [nlp(sent) for sent in batch_data]
+                                          model=None,
+                                          tagged_data=None,
+                                          token_encoder=None):
+        if tagged_data is None:
+            tagged_data = Utils.tag_features(batch_data)
 
         for i, doc in enumerate(tagged_data):
             verb_weights = []
@@ -154,14 +290,16 @@ class Utils:
                 if token.pos_ == 'VERB' and verb_weight != 0:
                     verb_weights.append(verb_weight)
                     tokens.append(token.text)
-                elif token.dep_ in ('dobj', 'nsubj', 'attr', 'prep', 'pobj') and object_weight != 0:
+                elif token.dep_ in OBJECT_DEPENDENCIES and object_weight != 0:
                     obj_weights.append(object_weight)
                     tokens.append(token.text)
 
             if not tokens:
                 continue
 
-            if tokenizer is not None and model is not None:
+            if token_encoder is not None:
+                token_embeddings = list(token_encoder(tokens))
+            elif tokenizer is not None and model is not None:
                 for token in tokens:
                     inputs = tokenizer(token, return_tensors='pt')
                     with torch.no_grad():
@@ -177,4 +315,6 @@ class Utils:
             weighted_embeddings = token_embeddings * weights[:, np.newaxis]
             sentence_embedding = np.mean(weighted_embeddings, axis=0)
 
-            embeddings[i] = torch.tensor(sentence_embedding)
\ No newline at end of file
+            embeddings[i] = torch.tensor(sentence_embedding)
+
+metrics.register_cache('spacy_models', Utils.load_spacy_model)
@@ -0,0 +1,122 @@
+import os
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.metrics import pairwise_distances
+
+INDEX_MODES = ('auto', 'exact', 'ivf')
+# Up to this many vectors auto mode searches exhaustively, above it an IVF index is built
+EXACT_MAX_VECTORS = int(os.getenv('DG_INDEX_EXACT_MAX', 20000))
+# Index rows compared per matrix product, bounds the (queries, block) distance matrix
+BLOCK_SIZE = int(os.getenv('DG_INDEX_BLOCK_SIZE', 4096))
+# Inverted lists scanned per query in IVF mode
+IVF_PROBES = int(os.getenv('DG_INDEX_PROBES', 8))
+RANDOM_STATE = 0
+
+
+def check_index_mode(mode):
+    if mode not in INDEX_MODES:
+        raise ValueError(f"Unsupported index mode: {mode}, expected one of {', '.join(INDEX_MODES)}")
+    return mode
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class VectorIndex:
+    """
+    Nearest neighbour search over the embeddings of an artifact.
+    exact compares every query with every vector, one block of block_size rows per matrix product.
+    ivf clusters the vectors into about sqrt(n) inverted lists with k-means and only scans the
+    n_probe lists whose centroids are closest to the query.
+    cosine and euclidean distances are computed from dot products, other metrics use pairwise_distances.
+    """
+
+    def __init__(self, vectors, metric='cosine', mode='auto', n_probe=IVF_PROBES, block_size=BLOCK_SIZE):
+        check_index_mode(mode)
+        self.metric = metric
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if metric == 'cosine':
+            self.vectors = _normalize(self.vectors)
+        self.squared_norms = np.einsum('ij,ij->i', self.vectors, self.vectors)
+        self.mode = ('exact' if len(self.vectors) <= EXACT_MAX_VECTORS else 'ivf') if mode == 'auto' else mode
+        self.n_probe = n_probe
+        self.block_size = block_size
+
+        if self.mode == 'ivf':
+            n_lists = max(1, int(round(np.sqrt(len(self.vectors)))))
+            quantizer = MiniBatchKMeans(n_clusters=n_lists, random_state=RANDOM_STATE, n_init=3,
+                                        batch_size=max(1024, 4 * n_lists)).fit(self.vectors)
+            self.centroids = quantizer.cluster_centers_.astype(np.float32)
+            if metric == 'cosine':
+                self.centroids = _normalize(self.centroids)
+            assignments = quantizer.labels_
+            order = np.argsort(assignments, kind='stable')
+            self.list_rows = np.split(order, np.cumsum(np.bincount(assignments, minlength=n_lists))[:-1])
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def prepare(self, queries):
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        return _normalize(queries) if self.metric == 'cosine' else queries
+
+    def distances(self, queries, rows=None):
+        """Distances from prepared queries to the index vectors of rows (all of them when None)."""
+        vectors = self.vectors if rows is None else self.vectors[rows]
+        if self.metric == 'cosine':
+            return np.clip(1 - queries @ vectors.T, 0, 2)
+        if self.metric == 'euclidean':
+            norms = self.squared_norms if rows is None else self.squared_norms[rows]
+            squared = np.einsum('ij,ij->i', queries, queries)[:, np.newaxis] - 2 * queries @ vectors.T + norms
+            return np.sqrt(np.maximum(squared, 0))
+        return pairwise_distances(queries, vectors, metric=self.metric)
+
+    def candidate_rows(self, query):
+        """Rows scanned for one prepared query, every row in exact mode."""
+        if self.mode == 'exact':
+            return None
+        list_distances = self.distances_to_centroids(query[np.newaxis])[0]
+        probed = np.argsort(list_distances)[:self.n_probe]
+        return np.concatenate([self.list_rows[i] for i in probed])
+
+    def distances_to_centroids(self, queries):
+        if self.metric == 'cosine':
+            return 1 - queries @ self.centroids.T
+        return pairwise_distances(queries, self.centroids, metric='euclidean')
+
+    def search(self, queries, k=5):
+        """(rows, distances) of the k nearest vectors of every query, both of shape (n_queries, k)."""
+        queries = self.prepare(queries)
+        k = min(k, len(self.vectors))
+        if self.mode == 'exact':
+            return self._search_exact(queries, k)
+
+        rows = np.zeros((len(queries), k), dtype=np.intp)
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        for i, query in enumerate(queries):
+            candidates = self.candidate_rows(query)
+            candidate_distances = self.distances(query[np.newaxis], candidates)[0]
+            nearest = np.argsort(candidate_distances)[:k]
+            rows[i, :len(nearest)] = candidates[nearest]
+            distances[i, :len(nearest)] = candidate_distances[nearest]
+        return rows, distances
+
+    def _search_exact(self, queries, k):
+        best_rows = np.zeros((len(queries), 0), dtype=np.intp)
+        best_distances = np.zeros((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(self.vectors), self.block_size):
+            block = np.arange(start, min(start + self.block_size, len(self.vectors)))
+            block_distances = self.distances(queries, block if len(block) < len(self.vectors) else None)
+
+            # Merge the block into the running top k
+            merged_distances = np.concatenate([best_distances, block_distances], axis=1)
+            merged_rows = np.concatenate([best_rows, np.broadcast_to(block, block_distances.shape)], axis=1)
+            keep = np.argpartition(merged_distances, k - 1, axis=1)[:, :k] if merged_distances.shape[1] > k \
+                else np.broadcast_to(np.arange(merged_distances.shape[1]), merged_distances.shape)
+            best_distances = np.take_along_axis(merged_distances, keep, axis=1)
+            best_rows = np.take_along_axis(merged_rows, keep, axis=1)
+
+        order = np.argsort(best_distances, axis=1)
+        return np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best_distances, order, axis=1)
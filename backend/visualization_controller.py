@@ -0,0 +1,47 @@
+from flask import Blueprint, request, make_response, jsonify
+from . import tile_service
+
+
+bp = Blueprint('visualization', __name__, url_prefix='/visualization')
+
+
+@bp.route('/info', methods=['GET'])
+def dendrogram_info():
+    file_path = request.args.get('file')
+    if not file_path:
+        return make_response({"error": "Missing 'file' query parameter"}, 400)
+
+    try:
+        return jsonify(tile_service.tile_source(file_path).info()), 200
+    except FileNotFoundError as e:
+        return make_response({"error": str(e)}, 404)
+    except ValueError as e:
+        return make_response({"error": str(e)}, 400)
+    except Exception as e:
+        return make_response({"error": "An unexpected error occurred", "details": str(e)}, 500)
+
+
+@bp.route('/tiles/<int:zoom>/<int:tile>.<tile_format>', methods=['GET'])
+def dendrogram_tile(zoom, tile, tile_format):
+    file_path = request.args.get('file')
+    if not file_path:
+        return make_response({"error": "Missing 'file' query parameter"}, 400)
+    threshold = request.args.get('threshold')
+
+    try:
+        content = tile_service.get_tile(file_path, zoom, tile, tile_format,
+                                        float(threshold) if threshold is not None else None)
+    except FileNotFoundError as e:
+        return make_response({"error": str(e)}, 404)
+    except ValueError as e:
+        return make_response({"error": str(e)}, 400)
+    except Exception as e:
+        return make_response({"error": "An unexpected error occurred", "details": str(e)}, 500)
+
+    response = make_response(content)
+    if tile_format == 'png':
+        response.headers.set('Content-Type', 'image/png')
+    else:
+        response.headers.set('Content-Type', 'application/json')
+    response.headers.set('Cache-Control', 'max-age=3600')
+    return response
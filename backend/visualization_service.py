@@ -1,5 +1,7 @@
 import joblib
 import os
+from functools import lru_cache
+from urllib.parse import urlencode
 import matplotlib.pyplot as plt
 from scipy.cluster.hierarchy import dendrogram, linkage
 import shutil
@@ -9,6 +11,10 @@ from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
 import torch
 import matplotlib.colors as mcolors
 import numpy as np
+from client.dendrogram_layout import cluster_membership, cluster_members, link_cluster_ids
+from .runtime_config import load_runtime_config, runtime_scope
+from .utils import Utils
+from . import metrics
 
 # Define base directories
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
@@ -18,19 +24,28 @@ STAGE_3_OUTPUT_PATH = os.path.join(BASE_DIR, 'data', 'Stage 3 - Topic Modelling'
 os.makedirs(STAGE_3_INPUT_PATH, exist_ok=True)
 os.makedirs(STAGE_3_OUTPUT_PATH, exist_ok=True)
 
-# Load model and tokenizer
-model_name = "meta-llama/Llama-3.2-3B"
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch.bfloat16).to(
-    'cuda' if torch.cuda.is_available() else 'cpu'
-)
+# Label generation model, a local path can replace the Hugging Face id (e.g. the benchmark stand-in)
+LABEL_MODEL_NAME = os.getenv('DG_LABEL_MODEL', "meta-llama/Llama-3.2-3B")
+
+
+@lru_cache(maxsize=None)
+def load_label_pipeline(model_name=LABEL_MODEL_NAME):
+    # Loaded on the first label request instead of on import
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch.bfloat16).to(
+        'cuda' if torch.cuda.is_available() else 'cpu'
+    )
+
+    return pipeline(
+        "text-generation",
+        model=model,
+        tokenizer=tokenizer,
+        device=0 if torch.cuda.is_available() else -1
+    )
+
+
+metrics.register_cache('label_pipeline', load_label_pipeline)
 
-pipe = pipeline(
-    "text-generation",
-    model=model,
-    tokenizer=tokenizer,
-    device=0 if torch.cuda.is_available() else -1
-)
 
 def reset_folder(folder_path):
     if os.path.exists(folder_path):
@@ -38,6 +53,7 @@ def reset_folder(folder_path):
     os.makedirs(folder_path, exist_ok=True)
 
 
+@metrics.timed('label_generation')
 def generate_dynamic_label(cluster_labels):
     unique_labels = list(set(cluster_labels))
     few_shot_input_text = (
@@ -51,40 +67,69 @@ def generate_dynamic_label(cluster_labels):
         "Label: Secure Video Conferencing\n\n"
         + ", ".join(unique_labels) + "\nLabel:"
     )
-    response = pipe(few_shot_input_text, max_new_tokens=10, do_sample=True)
+    response = load_label_pipeline()(few_shot_input_text, max_new_tokens=10, do_sample=True)
     label = response[0]['generated_text'].replace(few_shot_input_text, "").strip()
     return label.split('\n')[0]
 
 
 def build_hierarchical_json(linkage_matrix, labels):
+    """
+    Nested {"id", "label"} leaves and {"id", "distance", "children"} merges of the tree.
+    Built bottom-up over the linkage rows, each row only refers to nodes formed before it,
+    so chained average-linkage trees thousands of levels deep need no recursion.
+    """
     n_samples = len(labels)
+    nodes = [{"id": i, "label": labels[i]} for i in range(n_samples)]
+    for i, (left, right, distance) in enumerate(linkage_matrix[:, :3].tolist()):
+        nodes.append({
+            "id": n_samples + i,
+            "distance": float(distance),
+            "children": [nodes[int(left)], nodes[int(right)]],
+        })
+    return nodes[-1]
 
-    def traverse_node(node_id):
-        if node_id < n_samples:
-            return {"id": int(node_id), "label": labels[node_id]}
-        else:
-            left_child = int(linkage_matrix[node_id - n_samples, 0])
-            right_child = int(linkage_matrix[node_id - n_samples, 1])
-            distance = float(linkage_matrix[node_id - n_samples, 2])
 
-            return {
-                "id": int(node_id),
-                "distance": distance,
-                "children": [traverse_node(left_child), traverse_node(right_child)],
-            }
+class _JsonToken(str):
+    """Already encoded JSON text in the stack of iter_json."""
 
-    return traverse_node(len(linkage_matrix) + n_samples - 1)
+
+def iter_json(data, indent=4):
+    """
+    Chunks of json.dumps(data, indent=indent). The json encoder recurses once per nesting
+    level, this walks the nesting with an explicit stack instead.
+    """
+    stack = [(data, 0)]
+    while stack:
+        item, level = stack.pop()
+        if isinstance(item, _JsonToken):
+            yield item
+            continue
+        if isinstance(item, (dict, list)) and item:
+            opening, closing = ('{', '}') if isinstance(item, dict) else ('[', ']')
+            entries = list(item.items()) if isinstance(item, dict) else list(enumerate(item))
+            padding = '\n' + ' ' * (indent * (level + 1))
+            stack.append((_JsonToken('\n' + ' ' * (indent * level) + closing), level))
+            for position in range(len(entries) - 1, -1, -1):
+                key, value = entries[position]
+                stack.append((value, level + 1))
+                prefix = (',' if position else '') + padding
+                if isinstance(item, dict):
+                    prefix += json.dumps(str(key)) + ': '
+                stack.append((_JsonToken(prefix), level))
+            stack.append((_JsonToken(opening), level))
+            continue
+        yield json.dumps(item)
 
 
 def save_json(data, file_path):
     with open(file_path, 'w') as json_file:
-        json.dump(data, json_file, indent=4)
+        json_file.writelines(iter_json(data))
     print(f"JSON saved at: {file_path}")
 
 
 def extract_sub_linkage_matrix_from_parent(original_data, cluster_indices):
     sub_data = original_data[cluster_indices]
-    sub_linkage_matrix = linkage(sub_data, method='average', metric='euclidean')
+    sub_linkage_matrix = linkage(Utils.condensed_distances(sub_data, 'euclidean'), method='average')
     return sub_linkage_matrix
 
 
@@ -93,58 +138,15 @@ def generate_infinite_colors(num_colors):
     saturation = 0.9
     value = 0.9
     colors = [mcolors.hsv_to_rgb((hue, saturation, value)) for hue in hues]
-    return list(set([mcolors.rgb2hex(color) for color in colors]))
-
+    return [mcolors.rgb2hex(color) for color in colors]
 
-def reassign_dendrogram_colors(dendrogram_result, num_colors):
-    infinite_colors = generate_infinite_colors(num_colors)
-    new_color_list = []
-    new_leaves_color_list = []
 
-    current_color = None
-    current_cluster_id = 0
-    cluster_color_map = {}
-
-    for i, color in enumerate(dendrogram_result['color_list']):
-        if color == 'grey':
-            new_color_list.append('grey')
-            continue
-
-        if color != current_color:
-            cluster_color_map = {}
-            current_color = color
-            cluster_color_map[color] = infinite_colors[current_cluster_id]
-            current_cluster_id += 1
-            new_color_list.append(cluster_color_map[current_color])
-        else:
-            new_color_list.append(cluster_color_map[current_color])
-
-    current_color = None
-    cluster_color_map = {}
-    current_cluster_id = 0
-    for color in dendrogram_result['leaves_color_list']:
-        if color == 'grey':
-            new_leaves_color_list.append('grey')
-            continue
-
-        if color != current_color:
-            cluster_color_map = {}
-            current_color = color
-            cluster_color_map[color] = infinite_colors[current_cluster_id]
-            current_cluster_id += 1
-
-        new_leaves_color_list.append(cluster_color_map[current_color])
-
-    dendrogram_result['color_list'] = new_color_list
-    dendrogram_result['leaves_color_list'] = new_leaves_color_list
-
-    return dendrogram_result
-
-
-def process_and_save_clusters(cluster_map, application_name, app_folder, original_data, color_threshold):
+@metrics.timed('cluster_outputs')
+def process_and_save_clusters(clusters, application_name, app_folder, original_data, color_threshold):
     final_csv_data = []
 
-    for cluster_id, (color, cluster_data) in enumerate(cluster_map.items(), start=1):
+    for cluster_id, cluster_data in enumerate(clusters, start=1):
+        color = cluster_data['color']
         cluster_labels = cluster_data['labels']
         cluster_indices = cluster_data['indices']
 
@@ -211,11 +213,17 @@ def process_and_save_clusters(cluster_map, application_name, app_folder, origina
     print(f"Final summary CSV saved at: {final_csv_path}")
 
 
-def generate_dendrogram_visualization(dendogram_file):
+def generate_dendrogram_visualization(dendogram_file, runtime_config=None, render=False):
+    with runtime_scope(runtime_config or load_runtime_config()), metrics.span('visualization'):
+        return _generate_dendrogram_visualization(dendogram_file, render)
+
+
+def _generate_dendrogram_visualization(dendogram_file, render=False):
     model_info = joblib.load(dendogram_file)
-    distance_threshold = model_info['distance_threshold'] * 10
+    with metrics.span('linkage'):
+        linkage_matrix, distance_threshold = Utils.visualization_linkage(model_info)
     labels = model_info['labels']
-    original_data = model_info['data_points']
+    original_data = Utils.clustered_data_points(model_info)
 
     application_name = model_info['application_name']
     affinity = model_info['affinity']
@@ -228,46 +236,49 @@ def generate_dendrogram_visualization(dendogram_file):
     )
     reset_folder(app_folder)
 
-    linkage_matrix = linkage(original_data, method='average', metric='euclidean')
-
-    fig, ax = plt.subplots(figsize=(30, 30))
-    dendrogram_result = dendrogram(
-        linkage_matrix,
-        labels=labels,
-        color_threshold=distance_threshold,
-        leaf_font_size=10,
-        orientation='right',
-        distance_sort='descending',
-        above_threshold_color='grey',
-        ax=ax,
-        no_plot=True
-    )
-
-    reassign_dendrogram_colors(dendrogram_result, len(labels))
-    ax.axvline(x=distance_threshold, color='red', linestyle='--', linewidth=2)
-    plt.tight_layout()
-
-    final_dendrogram_path = os.path.join(app_folder, f"{application_name}_final_dendrogram.png")
-    plt.savefig(final_dendrogram_path)
-    plt.close(fig)
-
-    cluster_map = {}
-    for leaf, color in zip(dendrogram_result['leaves'], dendrogram_result['leaves_color_list']):
-        if color == 'grey':
-            continue
-        if color not in cluster_map:
-            cluster_map[color] = {'labels': [], 'indices': []}
-        cluster_map[color]['labels'].append(labels[leaf])
-        cluster_map[color]['indices'].append(leaf)
-
-    process_and_save_clusters(cluster_map, application_name, app_folder, original_data, distance_threshold)
-
-    general_json = build_hierarchical_json(linkage_matrix, labels)
-    general_json_path = os.path.join(app_folder, f"{application_name}_general_hierarchy.json")
-    save_json(general_json, general_json_path)
+    # Cluster membership comes from the cut itself, colours are only needed to draw it
+    cluster_ids, leaf_order = cluster_membership(linkage_matrix, distance_threshold)
+    members = cluster_members(cluster_ids, leaf_order)
+    colors = generate_infinite_colors(len(members))
+
+    # The full tree is unreadable past a few hundred features, clients browse it through the tile endpoints
+    final_dendrogram_path = None
+    if render:
+        node_clusters = link_cluster_ids(linkage_matrix, cluster_ids)
+        with metrics.span('plot_dendrogram'):
+            fig, ax = plt.subplots(figsize=(30, 30))
+            dendrogram(
+                linkage_matrix,
+                labels=labels,
+                leaf_font_size=10,
+                orientation='right',
+                distance_sort='descending',
+                link_color_func=lambda node: colors[node_clusters[node]] if node_clusters[node] >= 0 else 'grey',
+                ax=ax
+            )
+            ax.axvline(x=distance_threshold, color='red', linestyle='--', linewidth=2)
+            plt.tight_layout()
+
+            final_dendrogram_path = os.path.join(app_folder, f"{application_name}_final_dendrogram.png")
+            plt.savefig(final_dendrogram_path)
+            plt.close(fig)
+
+    clusters = [{
+        'color': colors[cluster_id],
+        'labels': [labels[leaf] for leaf in indices],
+        'indices': indices.tolist(),
+    } for cluster_id, indices in enumerate(members)]
+
+    process_and_save_clusters(clusters, application_name, app_folder, original_data, distance_threshold)
+
+    with metrics.span('hierarchy_json'):
+        general_json = build_hierarchical_json(linkage_matrix, labels)
+        general_json_path = os.path.join(app_folder, f"{application_name}_general_hierarchy.json")
+        save_json(general_json, general_json_path)
 
     return {
         "dendrogram_path": final_dendrogram_path,
+        "tiles": f"/visualization/info?{urlencode({'file': dendogram_file})}",
         "json_path": general_json_path,
         "clusters_summary_csv": os.path.join(app_folder, f"{application_name}_clusters_summary.csv"),
     }
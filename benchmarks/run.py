@@ -0,0 +1,327 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+from datetime import datetime
+from functools import wraps
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from workloads import workload_names, load_workload, SYNTHETIC_SIZES
+
+RESULTS_DIRECTORY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+EMBEDDINGS = ('tf-idf', 'bert', 'paraphrase')
+LINKAGE = 'average'
+METRIC = 'cosine'
+DISTANCE_THRESHOLD = 0.2
+VERB_WEIGHT = 0.75
+OBJECT_WEIGHT = 0.25
+
+# Largest number of unique features each stage is run with, larger workloads skip it:
+# preprocessing loads spaCy once per feature and clustering holds a square distance matrix
+DEFAULT_LIMITS = {
+    'preprocessing': 2000,
+    'clustering': 20000,
+    'visualization': 5000,
+}
+
+
+def peak_rss_mb():
+    """High-water mark of the process resident memory, it never goes down between stages."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class StageRecorder:
+    """
+    Wall time and peak traced memory of named stages. A stage entered several times accumulates,
+    stages nested in another one are also counted in their parent, whose self_seconds excludes them.
+    """
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self.stack = []
+
+    @contextmanager
+    def stage(self, name):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self.stack and self.trace_memory:
+            # The parent keeps the peak reached before this stage resets it
+            self.stack[-1]['peak'] = max(self.stack[-1]['peak'], tracemalloc.get_traced_memory()[1])
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        frame = {'peak': 0, 'child_seconds': 0.0}
+        self.stack.append(frame)
+
+        error = None
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.stack.pop()
+            peak = max(frame['peak'], tracemalloc.get_traced_memory()[1]) if self.trace_memory else 0
+            if self.stack:
+                self.stack[-1]['child_seconds'] += elapsed
+                self.stack[-1]['peak'] = max(self.stack[-1]['peak'], peak)
+
+            record = self.stages.setdefault(name, {'seconds': 0.0, 'self_seconds': 0.0, 'calls': 0})
+            record['seconds'] += elapsed
+            record['self_seconds'] += elapsed - frame['child_seconds']
+            record['calls'] += 1
+            if self.trace_memory:
+                record['peak_traced_mb'] = max(record.get('peak_traced_mb', 0.0), peak / (1024 * 1024))
+            record['peak_rss_mb'] = peak_rss_mb()
+            if error:
+                record['error'] = error
+
+    def skip(self, name, reason):
+        self.stages[name] = {'skipped': reason}
+
+    def timed(self, name, function):
+        """Wrap a function so every call is recorded as the stage name."""
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with self.stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+
+
+@contextmanager
+def patched(module, name, value):
+    original = getattr(module, name)
+    setattr(module, name, value)
+    try:
+        yield
+    finally:
+        setattr(module, name, original)
+
+
+def run_visualization(recorder, artifact_path, runtime_config, work_directory):
+    from backend import visualization_service
+
+    # Label generation and JSON export run inside the visualization, they are recorded as their own stages
+    with patched(visualization_service, 'STAGE_3_OUTPUT_PATH', os.path.join(work_directory, 'Stage 3')), \
+            patched(visualization_service, 'generate_dynamic_label',
+                    recorder.timed('label_generation', visualization_service.generate_dynamic_label)), \
+            patched(visualization_service, 'build_hierarchical_json',
+                    recorder.timed('json_export', visualization_service.build_hierarchical_json)), \
+            patched(visualization_service, 'save_json',
+                    recorder.timed('json_export', visualization_service.save_json)):
+        with recorder.stage('visualization'):
+            visualization_service.generate_dendrogram_visualization(artifact_path, runtime_config)
+
+
+def run_workload(name, features, embeddings, limits, runtime_config, work_directory, trace_memory):
+    from backend import dendogram_service
+    from backend.preprocessing_service import preprocess_features
+    from backend.utils import Utils
+    import standins
+
+    recorder = StageRecorder(trace_memory)
+    app_name = f"benchmark-{name}"
+
+    def attempt(stage, function, *args):
+        # A failing stage is recorded with its error, the following stages still run
+        try:
+            return function(*args)
+        except Exception as e:
+            print(f"  {stage} failed: {type(e).__name__}: {e}")
+            return None
+
+    with recorder.stage('prepare_features'):
+        features, _ = dendogram_service.prepare_features(app_name, features, False)
+
+    if len(features) <= limits['preprocessing']:
+        attempt('preprocessing', recorder.timed('preprocessing', preprocess_features), features)
+    else:
+        recorder.skip('preprocessing', f"{len(features)} features > {limits['preprocessing']}")
+
+    with recorder.stage('spacy_tagging'):
+        Utils.tag_features(features, n_process=runtime_config['spacy_n_process'])
+
+    artifact_path = None
+    for embedding in embeddings:
+        strategy = standins.standin_strategy(embedding, runtime_config)
+        strategy.verb_weight = VERB_WEIGHT
+        strategy.object_weight = OBJECT_WEIGHT
+
+        # compute_affinity split into its embedding, clustering and artifact steps
+        with recorder.stage(f'embedding:{embedding}'):
+            dense_data_array, labels = strategy.compute_embeddings(features)
+        if len(labels) > limits['clustering']:
+            recorder.skip(f'clustering:{embedding}', f"{len(labels)} features > {limits['clustering']}")
+            continue
+
+        with recorder.stage(f'clustering:{embedding}'):
+            clustering_model = strategy.cluster(dense_data_array, LINKAGE, DISTANCE_THRESHOLD, METRIC)
+        with recorder.stage(f'artifact:{embedding}'):
+            path = Utils.generate_pkl(app_name, clustering_model, strategy.model_name, dense_data_array, labels,
+                                      DISTANCE_THRESHOLD, LINKAGE, METRIC, VERB_WEIGHT, OBJECT_WEIGHT,
+                                      subdirectory='benchmarks')
+        artifact_path = artifact_path or path
+
+    if artifact_path is None:
+        recorder.skip('visualization', "no clustered artifact")
+    elif len(features) > limits['visualization']:
+        recorder.skip('visualization', f"{len(features)} features > {limits['visualization']}")
+    else:
+        attempt('visualization', run_visualization, recorder, artifact_path, runtime_config, work_directory)
+
+    return {'n_features': len(features), 'stages': recorder.stages}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    import standins
+    standins.install()
+
+    from backend.runtime_config import load_runtime_config, apply_runtime_config
+    runtime_config = load_runtime_config()
+    apply_runtime_config(runtime_config)
+    limits = {**DEFAULT_LIMITS, **{stage: value for stage, value in
+                                   (('preprocessing', args.max_preprocessing), ('clustering', args.max_clustering),
+                                    ('visualization', args.max_visualization)) if value is not None}}
+
+    results = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'runtime_config': runtime_config,
+        'limits': limits,
+        'workloads': {},
+    }
+
+    # Artifacts and renders go to a scratch folder instead of the data folders
+    work_directory = args.work_dir or tempfile.mkdtemp(prefix='dendogram-benchmark-')
+    os.makedirs(work_directory, exist_ok=True)
+    current_directory = os.getcwd()
+    os.chdir(work_directory)
+    try:
+        for name in args.workload:
+            print(f"Workload {name}...")
+            try:
+                features = load_workload(name, args.seed)
+            except FileNotFoundError as e:
+                print(f"  skipped: {e}")
+                results['workloads'][name] = {'skipped': str(e)}
+                continue
+            results['workloads'][name] = run_workload(name, features, args.embedding, limits, runtime_config,
+                                                      work_directory, not args.no_memory)
+            for stage, record in results['workloads'][name]['stages'].items():
+                if 'skipped' in record:
+                    print(f"  {stage:<24} skipped ({record['skipped']})")
+                else:
+                    print(f"  {stage:<24} {record['seconds']:>9.3f} s  {record.get('peak_traced_mb', 0):>9.1f} MB")
+    finally:
+        os.chdir(current_directory)
+
+    output_path = args.output or os.path.join(RESULTS_DIRECTORY_PATH, f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as output_file:
+        json.dump(results, output_file, indent=4)
+    print(f"Results saved to {output_path}")
+
+
+def compare_results(baseline, candidate, threshold, min_seconds):
+    """Rows (workload, stage, metric, baseline, candidate, ratio, regression) for stages measured in both runs"""
+    rows = []
+    for workload, baseline_workload in baseline['workloads'].items():
+        candidate_stages = candidate['workloads'].get(workload, {}).get('stages', {})
+        for stage, baseline_record in baseline_workload.get('stages', {}).items():
+            candidate_record = candidate_stages.get(stage, {})
+            for metric, floor in (('self_seconds', min_seconds), ('peak_traced_mb', 1.0)):
+                if metric not in baseline_record or metric not in candidate_record:
+                    continue
+                before, after = baseline_record[metric], candidate_record[metric]
+                ratio = after / before if before else None
+                # Stages too short or too small to measure reliably are reported but never flagged
+                regression = ratio is not None and before >= floor and ratio > 1 + threshold
+                rows.append((workload, stage, metric, before, after, ratio, regression))
+    return rows
+
+
+def compare(args):
+    with open(args.baseline, 'r', encoding='utf-8') as baseline_file:
+        baseline = json.load(baseline_file)
+    with open(args.candidate, 'r', encoding='utf-8') as candidate_file:
+        candidate = json.load(candidate_file)
+
+    rows = compare_results(baseline, candidate, args.threshold, args.min_seconds)
+    print(f"{'workload':<16} {'stage':<24} {'metric':<15} {'baseline':>10} {'candidate':>10} {'ratio':>7}")
+    for workload, stage, metric, before, after, ratio, regression in rows:
+        ratio_text = f"{ratio:>7.2f}" if ratio is not None else f"{'-':>7}"
+        print(f"{workload:<16} {stage:<24} {metric:<15} {before:>10.3f} {after:>10.3f} {ratio_text}"
+              f"{'  REGRESSION' if regression else ''}")
+
+    regressions = sum(row[-1] for row in rows)
+    print(f"\n{regressions} regressions above {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline stage with offline stand-in models.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Run the benchmarks and save the results as JSON")
+    run_parser.add_argument("--workload", choices=workload_names(), action='append',
+                            help=f"Workload to run (default: {', '.join(SYNTHETIC_SIZES)} and the corpora)")
+    run_parser.add_argument("--embedding", choices=EMBEDDINGS, action='append',
+                            help="Affinity strategy to run (default: all)")
+    run_parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic feature generator")
+    run_parser.add_argument("--max-preprocessing", type=int, help="Largest workload preprocessed")
+    run_parser.add_argument("--max-clustering", type=int, help="Largest workload clustered")
+    run_parser.add_argument("--max-visualization", type=int, help="Largest workload visualized")
+    run_parser.add_argument("--no-memory", action='store_true',
+                            help="Do not trace allocations, tracing slows down Python-heavy stages")
+    run_parser.add_argument("--work-dir", help="Folder for the artifacts written by the stages (default: temporary)")
+    run_parser.add_argument("--output", help="Path of the results JSON (default: benchmarks/results/<timestamp>.json)")
+
+    compare_parser = subparsers.add_parser('compare', help="Compare two result files")
+    compare_parser.add_argument("baseline", help="Results JSON of the reference run")
+    compare_parser.add_argument("candidate", help="Results JSON of the run to check")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="Relative increase reported as a regression")
+    compare_parser.add_argument("--min-seconds", type=float, default=0.05,
+                                help="Stages faster than this in the baseline are never flagged")
+
+    args = parser.parse_args()
+    if args.command == 'compare':
+        sys.exit(compare(args))
+
+    args.workload = args.workload or workload_names()
+    args.embedding = args.embedding or list(EMBEDDINGS)
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
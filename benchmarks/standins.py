@@ -0,0 +1,122 @@
+import os
+import string
+from functools import lru_cache
+from workloads import vocabulary
+
+# Small randomly initialised models so the benchmarks run offline. They keep the shapes of the
+# pipeline (tokenisation, transformer layers, pooling, generation) at a fraction of the cost, so
+# timings are comparable between runs, not with production models.
+STANDIN_DIRECTORY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.models')
+HIDDEN_SIZE = 64
+SPECIAL_TOKENS = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]']
+
+
+def standin_vocabulary():
+    # Single characters and word pieces let any word tokenise into several pieces like a real vocabulary
+    characters = list(string.ascii_lowercase + string.digits + string.punctuation)
+    tokens = SPECIAL_TOKENS + vocabulary() + characters + [f"##{character}" for character in characters]
+    return list(dict.fromkeys(tokens))
+
+
+def _save_bert(path, is_decoder):
+    import torch
+    from transformers import BertConfig, BertModel, BertLMHeadModel, BertTokenizer
+
+    os.makedirs(path, exist_ok=True)
+    vocab_file = os.path.join(path, 'vocab.txt')
+    with open(vocab_file, 'w', encoding='utf-8') as file:
+        file.write('\n'.join(standin_vocabulary()) + '\n')
+
+    torch.manual_seed(0)
+    config = BertConfig(vocab_size=len(standin_vocabulary()), hidden_size=HIDDEN_SIZE, num_hidden_layers=2,
+                        num_attention_heads=2, intermediate_size=2 * HIDDEN_SIZE, max_position_embeddings=512,
+                        is_decoder=is_decoder)
+    model = BertLMHeadModel(config) if is_decoder else BertModel(config)
+    model.save_pretrained(path)
+    BertTokenizer(vocab_file).save_pretrained(path)
+    return path
+
+
+def tiny_bert_path():
+    """Encoder standing in for bert-base-uncased and the MiniLM sentence transformer"""
+    path = os.path.join(STANDIN_DIRECTORY_PATH, 'tiny-bert')
+    if not os.path.exists(os.path.join(path, 'config.json')):
+        _save_bert(path, is_decoder=False)
+    return path
+
+
+def tiny_causal_lm_path():
+    """Decoder standing in for the Llama label generation model"""
+    path = os.path.join(STANDIN_DIRECTORY_PATH, 'tiny-causal-lm')
+    if not os.path.exists(os.path.join(path, 'config.json')):
+        _save_bert(path, is_decoder=True)
+    return path
+
+
+@lru_cache(maxsize=None)
+def standin_nlp():
+    """en_core_web_sm when it is installed, otherwise a blank pipeline tagging the synthetic verbs and objects"""
+    import spacy
+    from workloads import VERBS, OBJECTS
+
+    try:
+        return spacy.load('en_core_web_sm')
+    except OSError:
+        pass
+
+    nlp = spacy.blank('en')
+    ruler = nlp.add_pipe('attribute_ruler')
+    verbs = sorted({word for phrase in VERBS for word in phrase.split()})
+    objects = sorted({word for phrase in OBJECTS for word in phrase.split()} - set(verbs))
+    ruler.add(patterns=[[{'LOWER': {'IN': verbs}}]], attrs={'POS': 'VERB'})
+    ruler.add(patterns=[[{'LOWER': {'IN': objects}}]], attrs={'POS': 'NOUN'})
+    return nlp
+
+
+def install():
+    """
+    Point the backend at the stand-in models. Must run before the backend modules are imported,
+    the label model is read from DG_LABEL_MODEL on import.
+    """
+    import spacy
+
+    os.environ['DG_LABEL_MODEL'] = tiny_causal_lm_path()
+    tiny_bert_path()
+
+    nlp = standin_nlp()
+    if nlp.meta.get('name') != 'core_web_sm':
+        # preprocessing_service loads en_core_web_sm directly
+        spacy.load = lambda name, **kwargs: nlp
+
+    from backend.utils import Utils
+    Utils.load_spacy_model = staticmethod(lambda name='en_core_web_sm': nlp)
+
+
+def standin_strategy(embedding, runtime_config):
+    """AffinityStrategy for an embedding, with the stand-in encoder in place of the Hugging Face model"""
+    from transformers import BertModel, BertTokenizer
+    from sentence_transformers import SentenceTransformer, models
+    from backend import Affinity_strategy
+    from backend.utils import Utils
+
+    if embedding == 'tf-idf':
+        return Affinity_strategy.TfidfEmbeddingService(runtime_config=runtime_config)
+
+    if embedding == 'bert':
+        strategy = Affinity_strategy.BertEmbeddingAffinity.__new__(Affinity_strategy.BertEmbeddingAffinity)
+        strategy.tokenizer = BertTokenizer.from_pretrained(tiny_bert_path())
+        strategy.model = BertModel.from_pretrained(tiny_bert_path())
+    elif embedding == 'paraphrase':
+        strategy = Affinity_strategy.MiniLMEmbeddingService.__new__(Affinity_strategy.MiniLMEmbeddingService)
+        strategy.model = SentenceTransformer(modules=[models.Transformer(tiny_bert_path()),
+                                                      models.Pooling(HIDDEN_SIZE)])
+    else:
+        raise ValueError(f"Unsupported embedding method: {embedding}")
+
+    strategy.inference_backend = 'torch'
+    strategy.encoder = None
+    strategy.runtime_config = runtime_config
+    strategy.nlp = Utils.load_spacy_model()
+    strategy.verb_weight = 1.0
+    strategy.object_weight = 1.0
+    return strategy
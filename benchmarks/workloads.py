@@ -0,0 +1,118 @@
+import os
+import json
+import glob
+import numpy as np
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Workload name -> number of synthetic features
+SYNTHETIC_SIZES = {
+    'synthetic-1k': 1000,
+    'synthetic-10k': 10000,
+    'synthetic-100k': 100000,
+}
+
+# Workload name -> folder of csv_to_json feature lists or a TransFeatEx JSON file
+CORPORA = {
+    'communication': os.path.join(BASE_DIR, 'data', 'COMMUNICATION', 'all'),
+    'discord': os.path.join(BASE_DIR, 'JSON_Files', 'Discord.json'),
+}
+
+LFS_POINTER_PREFIX = b'version https://git-lfs'
+
+VERBS = ['send', 'share', 'delete', 'edit', 'block', 'mute', 'record', 'join', 'leave', 'create',
+         'invite', 'search', 'download', 'upload', 'forward', 'pin', 'archive', 'report', 'schedule', 'translate',
+         'sync', 'backup', 'restore', 'scan', 'stream', 'call', 'video call', 'text', 'react', 'reply',
+         'customize', 'enable', 'disable', 'update', 'install', 'log in', 'sign up', 'verify', 'reset', 'export']
+OBJECTS = ['message', 'photo', 'video', 'voice message', 'file', 'contact', 'group', 'channel', 'server', 'chat',
+           'status', 'story', 'sticker', 'emoji', 'gif', 'notification', 'password', 'account', 'profile', 'theme',
+           'wallpaper', 'ringtone', 'location', 'link', 'bookmark', 'tab', 'page', 'download', 'history', 'cookie',
+           'screen', 'camera', 'microphone', 'call', 'conference', 'meeting', 'invitation', 'role', 'permission',
+           'bot', 'playlist', 'podcast', 'document', 'spreadsheet', 'calendar', 'reminder', 'note', 'draft',
+           'signature', 'attachment', 'folder', 'label', 'filter', 'email', 'inbox', 'number', 'subscription',
+           'payment', 'wallet', 'card']
+MODIFIERS = ['', '', '', 'new', 'old', 'private', 'public', 'encrypted', 'shared', 'recent', 'favorite',
+             'large', 'multiple', 'unread', 'blocked', 'deleted', 'hidden', 'custom', 'default', 'offline',
+             'secure', 'group', 'live', 'scheduled', 'temporary', 'high quality', 'voice', 'video', 'dark',
+             'animated', 'pinned']
+CONTEXTS = ['', '', '', '', 'in chat', 'in group', 'on call', 'from gallery', 'to cloud', 'with friends',
+            'on desktop', 'in background', 'without internet', 'at once']
+
+
+def vocabulary():
+    """Every word the synthetic generator can produce"""
+    words = set()
+    for phrase in VERBS + OBJECTS + MODIFIERS + CONTEXTS:
+        words.update(phrase.split())
+    return sorted(words)
+
+
+def _zipf_weights(size, exponent=0.8):
+    # A few verbs and objects are mentioned far more often, as in real reviews
+    weights = 1.0 / np.arange(1, size + 1) ** exponent
+    return weights / weights.sum()
+
+
+def synthetic_features(n_features, seed=0):
+    """
+    n_features distinct feature strings shaped like TransFeatEx output,
+    '<verb> [<modifier>] <object> [<context>]' with skewed word frequencies.
+    """
+    rng = np.random.default_rng(seed)
+    slots = [VERBS, MODIFIERS, OBJECTS, CONTEXTS]
+    weights = [_zipf_weights(len(words)) for words in slots]
+
+    features = {}
+    while len(features) < n_features:
+        batch = 2 * (n_features - len(features))
+        columns = [rng.choice(len(words), size=batch, p=p) for words, p in zip(slots, weights)]
+        for indices in zip(*columns):
+            feature = ' '.join(filter(None, (words[i] for words, i in zip(slots, indices))))
+            features.setdefault(feature, None)
+            if len(features) == n_features:
+                break
+    return list(features)
+
+
+def is_lfs_pointer(file_path):
+    with open(file_path, 'rb') as file:
+        return file.read(len(LFS_POINTER_PREFIX)) == LFS_POINTER_PREFIX
+
+
+def read_feature_file(file_path):
+    with open(file_path, 'r', encoding='utf-8') as file:
+        data = json.load(file)
+
+    # Accept both a plain feature list and a TransFeatEx 'analyzed_reviews' payload
+    if isinstance(data, dict):
+        data = [sentence.get('featureData', {}).get('feature')
+                for review in data.get('analyzed_reviews', [])
+                for sentence in review.get('sentences', [])]
+    return [feature for feature in data if feature]
+
+
+def corpus_features(name):
+    path = CORPORA[name]
+    files = sorted(glob.glob(os.path.join(path, 'features_*.json'))) if os.path.isdir(path) else [path]
+    files = [file_path for file_path in files if os.path.isfile(file_path)]
+    if not files:
+        raise FileNotFoundError(f"Corpus {name} not found at {path}")
+    if any(is_lfs_pointer(file_path) for file_path in files):
+        raise FileNotFoundError(f"Corpus {name} is a Git LFS pointer, run 'git lfs pull' to benchmark it")
+
+    features = []
+    for file_path in files:
+        features.extend(read_feature_file(file_path))
+    return features
+
+
+def workload_names():
+    return list(SYNTHETIC_SIZES) + list(CORPORA)
+
+
+def load_workload(name, seed=0):
+    if name in SYNTHETIC_SIZES:
+        return synthetic_features(SYNTHETIC_SIZES[name], seed)
+    if name in CORPORA:
+        return corpus_features(name)
+    raise ValueError(f"Unknown workload {name}, expected one of {', '.join(workload_names())}")
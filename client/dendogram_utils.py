@@ -136,13 +136,14 @@ from . import _hierarchy, _optimal_leaf_ordering
 import scipy.spatial.distance as distance
 from scipy._lib._array_api import array_namespace, _asarray, copy
 from scipy._lib._disjoint_set import DisjointSet
+from .dendrogram_layout import ClusterTree as _ArrayClusterTree, DendrogramLayout
 
 
 _LINKAGE_METHODS = {'single': 0, 'complete': 1, 'average': 2, 'centroid': 3,
                     'median': 4, 'ward': 5, 'weighted': 6}
 _EUCLIDEAN_METHODS = ('centroid', 'median', 'ward')
 
-__all__ = ['ClusterNode', 'DisjointSet', 'average', 'centroid', 'complete',
+__all__ = ['ClusterNode', 'ClusterTree', 'DendrogramLayout', 'DisjointSet', 'average', 'centroid', 'complete',
            'cophenet', 'correspond', 'cut_tree', 'dendrogram', 'fcluster',
            'fclusterdata', 'from_mlab_linkage', 'inconsistent',
            'is_isomorphic', 'is_monotonic', 'is_valid_im', 'is_valid_linkage',
@@ -1049,6 +1050,24 @@ def linkage(y, method='single', metric='euclidean', optimal_ordering=False):
         return result
 
 
+def _node_id(node):
+    return node.id
+
+
+class ClusterTree(_ArrayClusterTree):
+    """
+    `dendrogram_layout.ClusterTree` with `ClusterNode` views of its nodes.
+
+    See Also
+    --------
+    to_tree, ClusterNode
+    """
+
+    def node(self, id):
+        """Return a `ClusterNode` view of node ``id``."""
+        return ClusterNode._view(self, id)
+
+
 class ClusterNode:
     """
     A tree node class for representing a cluster.
@@ -1057,7 +1076,8 @@ class ClusterNode:
     correspond to non-singleton clusters.
 
     The `to_tree` function converts a matrix returned by the linkage
-    function into an easy-to-use tree representation.
+    function into an easy-to-use tree representation. The nodes it returns
+    are thin views over a `ClusterTree`; their children are created on access.
 
     All parameter names are also attributes.
 
@@ -1077,9 +1097,12 @@ class ClusterNode:
     See Also
     --------
     to_tree : for converting a linkage matrix ``Z`` into a tree object.
+    ClusterTree : the array representation backing the nodes of `to_tree`.
 
     """
 
+    _tree = None
+
     def __init__(self, id, left=None, right=None, dist=0, count=1):
         if id < 0:
             raise ValueError('The id must be non-negative.')
@@ -1093,13 +1116,48 @@ class ClusterNode:
             raise ValueError('A cluster must contain at least one original '
                              'observation.')
         self.id = id
-        self.left = left
-        self.right = right
-        self.dist = dist
-        if self.left is None:
-            self.count = count
+        self._left = left
+        self._right = right
+        self._dist = dist
+        if left is None:
+            self._count = count
         else:
-            self.count = left.count + right.count
+            self._count = left.count + right.count
+
+    @classmethod
+    def _view(cls, tree, id):
+        node = cls.__new__(cls)
+        node._tree = tree
+        node.id = int(id)
+        return node
+
+    def _child(self, children):
+        child = children[self.id]
+        return None if child < 0 else ClusterNode._view(self._tree, child)
+
+    @property
+    def left(self):
+        if self._tree is None:
+            return self._left
+        return self._child(self._tree.left)
+
+    @property
+    def right(self):
+        if self._tree is None:
+            return self._right
+        return self._child(self._tree.right)
+
+    @property
+    def dist(self):
+        if self._tree is None:
+            return self._dist
+        return float(self._tree.dist[self.id])
+
+    @property
+    def count(self):
+        if self._tree is None:
+            return self._count
+        return int(self._tree.count[self.id])
 
     def __lt__(self, node):
         if not isinstance(node, ClusterNode):
@@ -1185,9 +1243,11 @@ class ClusterNode:
             True if the target node is a leaf node.
 
         """
-        return self.left is None
+        if self._tree is not None:
+            return bool(self._tree.left[self.id] < 0)
+        return self._left is None
 
-    def pre_order(self, func=(lambda x: x.id)):
+    def pre_order(self, func=_node_id):
         """
         Perform pre-order traversal without recursive function calls.
 
@@ -1217,6 +1277,13 @@ class ClusterNode:
             The pre-order traversal.
 
         """
+        if self._tree is not None:
+            # The leaves of a subtree are a contiguous range of the leaf order
+            leaves = self._tree.subtree_leaves(self.id).tolist()
+            if func is _node_id:
+                return leaves
+            return [func(ClusterNode._view(self._tree, leaf)) for leaf in leaves]
+
         # Do a preorder traversal, caching the result. To avoid having to do
         # recursion, we'll store the previous index we've visited in a vector.
         n = self.count
@@ -1374,6 +1441,7 @@ def to_tree(Z, rd=False):
     Convert a linkage matrix into an easy-to-use tree object.
 
     The reference to the root `ClusterNode` object is returned (by default).
+    The nodes are views over a `ClusterTree`, which holds the tree as arrays.
 
     Each `ClusterNode` object has a ``left``, ``right``, ``dist``, ``id``,
     and ``count`` attribute. The left and right attributes point to
@@ -1411,7 +1479,7 @@ def to_tree(Z, rd=False):
 
     See Also
     --------
-    linkage, is_valid_linkage, ClusterNode
+    linkage, is_valid_linkage, ClusterNode, ClusterTree
 
     Examples
     --------
@@ -1431,45 +1499,13 @@ def to_tree(Z, rd=False):
     """
     xp = array_namespace(Z)
     Z = _asarray(Z, order='c', xp=xp)
-    is_valid_linkage(Z, throw=True, name='Z')
-
-    # Number of original objects is equal to the number of rows plus 1.
-    n = Z.shape[0] + 1
-
-    # Create a list full of None's to store the node objects
-    d = [None] * (n * 2 - 1)
-
-    # Create the nodes corresponding to the n original objects.
-    for i in range(0, n):
-        d[i] = ClusterNode(i)
-
-    nd = None
-
-    for i in range(Z.shape[0]):
-        row = Z[i, :]
-
-        fi = int_floor(row[0], xp)
-        fj = int_floor(row[1], xp)
-        if fi > i + n:
-            raise ValueError(('Corrupt matrix Z. Index to derivative cluster '
-                              'is used before it is formed. See row %d, '
-                              'column 0') % fi)
-        if fj > i + n:
-            raise ValueError(('Corrupt matrix Z. Index to derivative cluster '
-                              'is used before it is formed. See row %d, '
-                              'column 1') % fj)
-
-        nd = ClusterNode(i + n, d[fi], d[fj], row[2])
-        #                ^ id   ^ left ^ right ^ dist
-        if row[3] != nd.count:
-            raise ValueError(('Corrupt matrix Z. The count Z[%d,3] is '
-                              'incorrect.') % i)
-        d[n + i] = nd
+    tree = ClusterTree.from_linkage(np.asarray(Z))
 
+    root = tree.node(tree.root)
     if rd:
-        return (nd, d)
+        return (root, [tree.node(i) for i in range(tree.n_nodes)])
     else:
-        return nd
+        return root
 
 
 def optimal_leaf_ordering(Z, y, metric='euclidean'):
@@ -3307,52 +3343,28 @@ def dendrogram(Z, p=30, truncate_mode=None, color_threshold=None,
         if p <= 0:
             p = np.inf
 
-    if get_leaves:
-        lvs = []
-    else:
-        lvs = None
-
-    icoord_list = []
-    dcoord_list = []
-    color_list = []
-    current_color = [0]
-    currently_below_threshold = [False]
-    ivl = []  # list of leaves
-
     if color_threshold is None or (isinstance(color_threshold, str) and
                                    color_threshold == 'default'):
         color_threshold = max(Z[:, 2]) * 0.7
 
-    R = {'icoord': icoord_list, 'dcoord': dcoord_list, 'ivl': ivl,
-         'leaves': lvs, 'color_list': color_list}
-
     # Empty list will be filled in _dendrogram_calculate_info
     contraction_marks = [] if show_contracted else None
 
-    _dendrogram_calculate_info(
-        Z=Z, p=p,
+    R = _dendrogram_calculate_info(
+        Z=np.asarray(Z), p=p,
         truncate_mode=truncate_mode,
         color_threshold=color_threshold,
         get_leaves=get_leaves,
-        orientation=orientation,
         labels=labels,
         count_sort=count_sort,
         distance_sort=distance_sort,
         show_leaf_counts=show_leaf_counts,
-        i=2*n - 2,
-        iv=0.0,
-        ivl=ivl,
-        n=n,
-        icoord_list=icoord_list,
-        dcoord_list=dcoord_list,
-        lvs=lvs,
-        current_color=current_color,
-        color_list=color_list,
-        currently_below_threshold=currently_below_threshold,
         leaf_label_func=leaf_label_func,
         contraction_marks=contraction_marks,
         link_color_func=link_color_func,
         above_threshold_color=above_threshold_color)
+    icoord_list, dcoord_list = R['icoord'], R['dcoord']
+    ivl, color_list = R['ivl'], R['color_list']
 
     if not no_plot:
         mh = max(Z[:, 2])
@@ -3430,250 +3442,73 @@ def _append_nonsingleton_leaf_node(Z, p, n, level, lvs, ivl, leaf_label_func,
                 ivl.append("")
 
 
-def _append_contraction_marks(Z, iv, i, n, contraction_marks, xp):
-    _append_contraction_marks_sub(Z, iv, int_floor(Z[i - n, 0], xp),
-                                  n, contraction_marks, xp)
-    _append_contraction_marks_sub(Z, iv, int_floor(Z[i - n, 1], xp),
-                                  n, contraction_marks, xp)
+def _dendrogram_link_colors(layout, color_threshold, above_threshold_color):
+    """
+    Colour of every link of a layout, as assigned left to right by the
+    recursive layout: links below the threshold take the current palette
+    colour, which moves on after each run of links above the threshold.
+    """
+    in_order = np.empty_like(layout['in_order'])
+    in_order[layout['in_order']] = np.arange(in_order.shape[0])
+    heights = layout['dcoord'][in_order, 1]
 
+    above = (heights >= color_threshold) | (color_threshold <= 0)
+    below_before = np.concatenate([[False], ~above[:-1]])
+    palette_index = np.cumsum(above & below_before) % len(_link_line_colors)
 
-def _append_contraction_marks_sub(Z, iv, i, n, contraction_marks, xp):
-    if i >= n:
-        contraction_marks.append((iv, Z[i - n, 2]))
-        _append_contraction_marks_sub(Z, iv, int_floor(Z[i - n, 0], xp),
-                                      n, contraction_marks, xp)
-        _append_contraction_marks_sub(Z, iv, int_floor(Z[i - n, 1], xp),
-                                      n, contraction_marks, xp)
+    colors = np.asarray(_link_line_colors, dtype=object)[palette_index]
+    colors[above] = above_threshold_color
+    return colors[layout['in_order']].tolist()
 
 
 def _dendrogram_calculate_info(Z, p, truncate_mode,
                                color_threshold=np.inf, get_leaves=True,
-                               orientation='top', labels=None,
-                               count_sort=False, distance_sort=False,
-                               show_leaf_counts=False, i=-1, iv=0.0,
-                               ivl=[], n=0, icoord_list=[], dcoord_list=[],
-                               lvs=None, mhr=False,
-                               current_color=[], color_list=[],
-                               currently_below_threshold=[],
-                               leaf_label_func=None, level=0,
-                               contraction_marks=None,
+                               labels=None, count_sort=False,
+                               distance_sort=False, show_leaf_counts=False,
+                               leaf_label_func=None, contraction_marks=None,
                                link_color_func=None,
                                above_threshold_color='C0'):
     """
     Calculate the endpoints of the links as well as the labels for the
-    the dendrogram rooted at the node with index i. iv is the independent
-    variable value to plot the left-most leaf node below the root node i
-    (if orientation='top', this would be the left-most x value where the
-    plotting of this root node i and its descendents should begin).
-
-    ivl is a list to store the labels of the leaf nodes. The leaf_label_func
-    is called whenever ivl != None, labels == None, and
-    leaf_label_func != None. When ivl != None and labels != None, the
-    labels list is used only for labeling the leaf nodes. When
-    ivl == None, no labels are generated for leaf nodes.
-
-    When get_leaves==True, a list of leaves is built as they are visited
-    in the dendrogram.
-
-    Returns a tuple with l being the independent variable coordinate that
-    corresponds to the midpoint of cluster to the left of cluster i if
-    i is non-singleton, otherwise the independent coordinate of the leaf
-    node if i is a leaf node.
-
-    Returns
-    -------
-    A tuple (left, w, h, md), where:
-        * left is the independent variable coordinate of the center of the
-          the U of the subtree
-
-        * w is the amount of space used for the subtree (in independent
-          variable units)
-
-        * h is the height of the subtree in dependent variable units
-
-        * md is the ``max(Z[*,2]``) for all nodes ``*`` below and including
-          the target node.
+    dendrogram, without recursion (see `DendrogramLayout`).
 
+    Returns the ``R`` dictionary of `dendrogram`, with ``contraction_marks``
+    extended in place when it is a list.
     """
-    xp = array_namespace(Z)
-    if n == 0:
-        raise ValueError("Invalid singleton cluster count n.")
-
-    if i == -1:
-        raise ValueError("Invalid root cluster index i.")
-
-    if truncate_mode == 'lastp':
-        # If the node is a leaf node but corresponds to a non-singleton
-        # cluster, its label is either the empty string or the number of
-        # original observations belonging to cluster i.
-        if 2*n - p > i >= n:
-            d = Z[i - n, 2]
-            _append_nonsingleton_leaf_node(Z, p, n, level, lvs, ivl,
-                                           leaf_label_func, i, labels,
-                                           show_leaf_counts)
-            if contraction_marks is not None:
-                _append_contraction_marks(Z, iv + 5.0, i, n, contraction_marks, xp)
-            return (iv + 5.0, 10.0, 0.0, d)
-        elif i < n:
-            _append_singleton_leaf_node(Z, p, n, level, lvs, ivl,
+    n = Z.shape[0] + 1
+    layout = DendrogramLayout(Z, count_sort, distance_sort).compute(
+        truncate_mode=truncate_mode, p=p,
+        contraction_marks=contraction_marks is not None)
+
+    lvs = [] if get_leaves else None
+    ivl = []
+    for i in layout['leaves'].tolist():
+        if i < n:
+            _append_singleton_leaf_node(Z, p, n, 0, lvs, ivl,
                                         leaf_label_func, i, labels)
-            return (iv + 5.0, 10.0, 0.0, 0.0)
-    elif truncate_mode == 'level':
-        if i > n and level > p:
-            d = Z[i - n, 2]
-            _append_nonsingleton_leaf_node(Z, p, n, level, lvs, ivl,
+        else:
+            _append_nonsingleton_leaf_node(Z, p, n, 0, lvs, ivl,
                                            leaf_label_func, i, labels,
                                            show_leaf_counts)
-            if contraction_marks is not None:
-                _append_contraction_marks(Z, iv + 5.0, i, n, contraction_marks, xp)
-            return (iv + 5.0, 10.0, 0.0, d)
-        elif i < n:
-            _append_singleton_leaf_node(Z, p, n, level, lvs, ivl,
-                                        leaf_label_func, i, labels)
-            return (iv + 5.0, 10.0, 0.0, 0.0)
 
-    # Otherwise, only truncate if we have a leaf node.
-    #
-    # Only place leaves if they correspond to original observations.
-    if i < n:
-        _append_singleton_leaf_node(Z, p, n, level, lvs, ivl,
-                                    leaf_label_func, i, labels)
-        return (iv + 5.0, 10.0, 0.0, 0.0)
-
-    # !!! Otherwise, we don't have a leaf node, so work on plotting a
-    # non-leaf node.
-    # Actual indices of a and b
-    aa = int_floor(Z[i - n, 0], xp)
-    ab = int_floor(Z[i - n, 1], xp)
-    if aa >= n:
-        # The number of singletons below cluster a
-        na = Z[aa - n, 3]
-        # The distance between a's two direct children.
-        da = Z[aa - n, 2]
-    else:
-        na = 1
-        da = 0.0
-    if ab >= n:
-        nb = Z[ab - n, 3]
-        db = Z[ab - n, 2]
-    else:
-        nb = 1
-        db = 0.0
-
-    if count_sort == 'ascending' or count_sort is True:
-        # If a has a count greater than b, it and its descendents should
-        # be drawn to the right. Otherwise, to the left.
-        if na > nb:
-            # The cluster index to draw to the left (ua) will be ab
-            # and the one to draw to the right (ub) will be aa
-            ua = ab
-            ub = aa
-        else:
-            ua = aa
-            ub = ab
-    elif count_sort == 'descending':
-        # If a has a count less than or equal to b, it and its
-        # descendents should be drawn to the left. Otherwise, to
-        # the right.
-        if na > nb:
-            ua = aa
-            ub = ab
-        else:
-            ua = ab
-            ub = aa
-    elif distance_sort == 'ascending' or distance_sort is True:
-        # If a has a distance greater than b, it and its descendents should
-        # be drawn to the right. Otherwise, to the left.
-        if da > db:
-            ua = ab
-            ub = aa
-        else:
-            ua = aa
-            ub = ab
-    elif distance_sort == 'descending':
-        # If a has a distance less than or equal to b, it and its
-        # descendents should be drawn to the left. Otherwise, to
-        # the right.
-        if da > db:
-            ua = aa
-            ub = ab
-        else:
-            ua = ab
-            ub = aa
-    else:
-        ua = aa
-        ub = ab
-
-    # Updated iv variable and the amount of space used.
-    (uiva, uwa, uah, uamd) = \
-        _dendrogram_calculate_info(
-            Z=Z, p=p,
-            truncate_mode=truncate_mode,
-            color_threshold=color_threshold,
-            get_leaves=get_leaves,
-            orientation=orientation,
-            labels=labels,
-            count_sort=count_sort,
-            distance_sort=distance_sort,
-            show_leaf_counts=show_leaf_counts,
-            i=ua, iv=iv, ivl=ivl, n=n,
-            icoord_list=icoord_list,
-            dcoord_list=dcoord_list, lvs=lvs,
-            current_color=current_color,
-            color_list=color_list,
-            currently_below_threshold=currently_below_threshold,
-            leaf_label_func=leaf_label_func,
-            level=level + 1, contraction_marks=contraction_marks,
-            link_color_func=link_color_func,
-            above_threshold_color=above_threshold_color)
-
-    h = Z[i - n, 2]
-    if h >= color_threshold or color_threshold <= 0:
-        c = above_threshold_color
-
-        if currently_below_threshold[0]:
-            current_color[0] = (current_color[0] + 1) % len(_link_line_colors)
-        currently_below_threshold[0] = False
-    else:
-        currently_below_threshold[0] = True
-        c = _link_line_colors[current_color[0]]
-
-    (uivb, uwb, ubh, ubmd) = \
-        _dendrogram_calculate_info(
-            Z=Z, p=p,
-            truncate_mode=truncate_mode,
-            color_threshold=color_threshold,
-            get_leaves=get_leaves,
-            orientation=orientation,
-            labels=labels,
-            count_sort=count_sort,
-            distance_sort=distance_sort,
-            show_leaf_counts=show_leaf_counts,
-            i=ub, iv=iv + uwa, ivl=ivl, n=n,
-            icoord_list=icoord_list,
-            dcoord_list=dcoord_list, lvs=lvs,
-            current_color=current_color,
-            color_list=color_list,
-            currently_below_threshold=currently_below_threshold,
-            leaf_label_func=leaf_label_func,
-            level=level + 1, contraction_marks=contraction_marks,
-            link_color_func=link_color_func,
-            above_threshold_color=above_threshold_color)
-
-    max_dist = max(uamd, ubmd, h)
-
-    icoord_list.append([uiva, uiva, uivb, uivb])
-    dcoord_list.append([uah, h, h, ubh])
     if link_color_func is not None:
-        v = link_color_func(int(i))
-        if not isinstance(v, str):
-            raise TypeError("link_color_func must return a matplotlib "
-                            "color string!")
-        color_list.append(v)
+        color_list = []
+        for i in layout['links'].tolist():
+            v = link_color_func(int(i))
+            if not isinstance(v, str):
+                raise TypeError("link_color_func must return a matplotlib "
+                                "color string!")
+            color_list.append(v)
     else:
-        color_list.append(c)
+        color_list = _dendrogram_link_colors(layout, color_threshold,
+                                             above_threshold_color)
+
+    if contraction_marks is not None:
+        contraction_marks.extend(map(tuple, layout['contraction_marks'].tolist()))
 
-    return (((uiva + uivb) / 2), uwa + uwb, h, max_dist)
+    return {'icoord': layout['icoord'].tolist(),
+            'dcoord': layout['dcoord'].tolist(),
+            'ivl': ivl, 'leaves': lvs, 'color_list': color_list}
 
 
 def is_isomorphic(T1, T2):
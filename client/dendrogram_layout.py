@@ -0,0 +1,410 @@
+import numpy as np
+from scipy.cluster.hierarchy import is_valid_linkage, fcluster, leaves_list
+
+# Array-backed tree, iterative layout and flat cut of a linkage matrix, shared by the backend and the client.
+# It only needs numpy and scipy, so it can be imported without loading the backend package.
+
+
+class ClusterTree:
+    """
+    Array-backed binary tree of a linkage matrix.
+
+    Nodes use the ids of the linkage matrix: ``0 <= i < n`` are the original
+    observations and ``n + i`` is the cluster formed at row ``i``. Every
+    attribute is a NumPy array indexed by node id, so the tree costs a few
+    arrays of ``2n - 1`` entries instead of one Python object per node.
+
+    Parameters
+    ----------
+    left, right : ndarray
+        Children of every node, ``-1`` for leaves.
+    dist : ndarray
+        Merge distance of every node, ``0`` for leaves.
+    count : ndarray
+        Number of original observations below every node.
+
+    Attributes
+    ----------
+    parent : ndarray
+        Parent of every node, ``-1`` for the root.
+    depth : ndarray
+        Number of edges between every node and the root.
+    leaf_order : ndarray
+        Leaf ids from left to right, as in `leaves_list`.
+    start : ndarray
+        Position in `leaf_order` of the leftmost leaf of every node, so the
+        leaves of node ``i`` are ``leaf_order[start[i]:start[i] + count[i]]``.
+
+    """
+
+    def __init__(self, left, right, dist, count):
+        self.left = np.asarray(left, dtype=np.int64)
+        self.right = np.asarray(right, dtype=np.int64)
+        self.dist = np.asarray(dist, dtype=np.float64)
+        self.count = np.asarray(count, dtype=np.int64)
+        self.n_nodes = self.left.shape[0]
+        self.n_leaves = (self.n_nodes + 1) // 2
+        self.root = self.n_nodes - 1
+
+        n = self.n_leaves
+        self.parent = np.full(self.n_nodes, -1, dtype=np.int64)
+        self.parent[self.left[n:]] = np.arange(n, self.n_nodes)
+        self.parent[self.right[n:]] = np.arange(n, self.n_nodes)
+
+        # Parents always have larger ids than their children, so walking the
+        # merges from the root down visits every parent before its children.
+        left_list = self.left.tolist()
+        right_list = self.right.tolist()
+        count_list = self.count.tolist()
+        start = [0] * self.n_nodes
+        depth = [0] * self.n_nodes
+        for node in range(self.root, n - 1, -1):
+            fi, fj = left_list[node], right_list[node]
+            start[fi] = start[node]
+            start[fj] = start[node] + count_list[fi]
+            depth[fi] = depth[fj] = depth[node] + 1
+        self.start = np.asarray(start, dtype=np.int64)
+        self.depth = np.asarray(depth, dtype=np.int64)
+        self.leaf_order = np.empty(n, dtype=np.int64)
+        self.leaf_order[self.start[:n]] = np.arange(n)
+
+    @classmethod
+    def from_linkage(cls, Z):
+        """
+        Build the tree of a linkage matrix.
+
+        Parameters
+        ----------
+        Z : ndarray
+            The linkage matrix in proper form (see the `linkage`
+            function documentation).
+
+        Returns
+        -------
+        tree : ClusterTree
+
+        """
+        Z = np.asarray(Z, order='c')
+        is_valid_linkage(Z, throw=True, name='Z')
+        n = Z.shape[0] + 1
+
+        left = np.full(2 * n - 1, -1, dtype=np.int64)
+        right = np.full(2 * n - 1, -1, dtype=np.int64)
+        dist = np.zeros(2 * n - 1)
+        count = np.ones(2 * n - 1, dtype=np.int64)
+        left[n:] = Z[:, 0].astype(np.int64)
+        right[n:] = Z[:, 1].astype(np.int64)
+        dist[n:] = Z[:, 2]
+        count[n:] = Z[:, 3].astype(np.int64)
+
+        corrupt = np.nonzero(count[n:] != count[left[n:]] + count[right[n:]])[0]
+        if corrupt.size:
+            raise ValueError(('Corrupt matrix Z. The count Z[%d,3] is '
+                              'incorrect.') % corrupt[0])
+        return cls(left, right, dist, count)
+
+    def is_leaf(self, nodes):
+        return self.left[nodes] < 0
+
+    def subtree_leaves(self, node):
+        """Leaf ids below ``node`` from left to right, as a view of `leaf_order`."""
+        return self.leaf_order[self.start[node]:self.start[node] + self.count[node]]
+
+    def is_ancestor(self, ancestors, nodes):
+        """
+        Whether each of ``ancestors`` contains the matching entry of ``nodes``.
+        A node is its own ancestor.
+        """
+        ancestors = np.asarray(ancestors)
+        nodes = np.asarray(nodes)
+        return ((self.start[ancestors] <= self.start[nodes])
+                & (self.start[nodes] + self.count[nodes]
+                   <= self.start[ancestors] + self.count[ancestors]))
+
+    def lca(self, a, b):
+        """
+        Lowest common ancestor of every pair ``(a[i], b[i])``.
+
+        The smaller id of a pair can never be an ancestor of the larger one,
+        so it is replaced by its parent until both ids meet. All pairs are
+        advanced together.
+        """
+        a, b = np.broadcast_arrays(np.asarray(a, dtype=np.int64),
+                                   np.asarray(b, dtype=np.int64))
+        a = a.copy()
+        b = b.copy()
+        pending = np.nonzero(a != b)[0]
+        while pending.size:
+            lower_a = a[pending] < b[pending]
+            a[pending[lower_a]] = self.parent[a[pending[lower_a]]]
+            b[pending[~lower_a]] = self.parent[b[pending[~lower_a]]]
+            pending = pending[a[pending] != b[pending]]
+        return a
+
+    def cut_roots(self, height=None, n_clusters=None):
+        """
+        Roots of the flat clusters obtained by cutting the tree, from left to right.
+
+        Parameters
+        ----------
+        height : float, optional
+            Merges at a distance greater than ``height`` are undone, as in
+            ``fcluster(Z, height, criterion='distance')``. Requires a
+            monotonic linkage.
+        n_clusters : int, optional
+            Undo the last ``n_clusters - 1`` merges, as in `cut_tree`.
+
+        Returns
+        -------
+        roots : ndarray
+            The node ids of the cluster roots.
+
+        """
+        if (height is None) == (n_clusters is None):
+            raise ValueError("Exactly one of height or n_clusters must be given")
+
+        nodes = np.arange(self.n_nodes)
+        has_parent = self.parent >= 0
+        if height is not None:
+            inside = self.dist <= height
+            parent_inside = np.zeros(self.n_nodes, dtype=bool)
+            parent_inside[has_parent] = self.dist[self.parent[has_parent]] <= height
+        else:
+            if not 1 <= n_clusters <= self.n_leaves:
+                raise ValueError("n_clusters must be between 1 and the number of observations")
+            first_undone = 2 * self.n_leaves - n_clusters
+            inside = nodes < first_undone
+            parent_inside = has_parent & (self.parent < first_undone)
+
+        roots = nodes[inside & ~parent_inside]
+        return roots[np.argsort(self.start[roots], kind='stable')]
+
+    def cut(self, height=None, n_clusters=None):
+        """
+        Flat cluster label of every original observation.
+
+        Labels are numbered from ``0`` in the left-to-right order of the
+        clusters in the dendrogram. See `cut_roots` for the parameters.
+        """
+        roots = self.cut_roots(height, n_clusters)
+        labels = np.empty(self.n_leaves, dtype=np.int64)
+        labels[self.leaf_order] = np.repeat(np.arange(roots.shape[0]), self.count[roots])
+        return labels
+
+
+class DendrogramLayout:
+    """
+    Iterative dendrogram layout of a linkage matrix.
+
+    The children order given by ``count_sort``/``distance_sort`` and the leaf
+    range of every subtree are computed once. `compute` then lays out the
+    whole tree, its top levels or the subtree below any node without
+    recursion, so a viewer can zoom in and out without laying out the full
+    tree again.
+
+    Parameters
+    ----------
+    Z : ndarray
+        The linkage matrix in proper form (see the `linkage`
+        function documentation).
+    count_sort, distance_sort : str or bool, optional
+        Order of the children of every link, as in `dendrogram`.
+
+    Attributes
+    ----------
+    tree : ClusterTree
+        The tree with the children of every node in drawing order.
+
+    """
+
+    def __init__(self, Z, count_sort=False, distance_sort=False):
+        Z = np.asarray(Z, order='c')
+        is_valid_linkage(Z, throw=True, name='Z')
+        n = Z.shape[0] + 1
+
+        tree = ClusterTree.from_linkage(Z)
+        left = tree.left[n:]
+        right = tree.right[n:]
+        # Leaves have a count of 1 and a distance of 0, as in the recursive layout
+        na, nb = tree.count[left], tree.count[right]
+        da, db = tree.dist[left], tree.dist[right]
+
+        if count_sort == 'ascending' or count_sort is True:
+            swap = na > nb
+        elif count_sort == 'descending':
+            swap = na <= nb
+        elif distance_sort == 'ascending' or distance_sort is True:
+            swap = da > db
+        elif distance_sort == 'descending':
+            swap = da <= db
+        else:
+            swap = np.zeros(n - 1, dtype=bool)
+
+        ordered_left = tree.left.copy()
+        ordered_right = tree.right.copy()
+        ordered_left[n:] = np.where(swap, right, left)
+        ordered_right[n:] = np.where(swap, left, right)
+        self.tree = ClusterTree(ordered_left, ordered_right, tree.dist, tree.count)
+        self.n = n
+
+    def visible_nodes(self, root=None, truncate_mode=None, p=30):
+        """
+        Nodes drawn by `compute` and which of them are drawn as leaves.
+
+        Returns
+        -------
+        visible : ndarray
+            Boolean mask over node ids of the links and leaves drawn.
+        displayed_leaves : ndarray
+            Boolean mask over node ids of the nodes drawn as leaves, either
+            original observations or contracted clusters.
+
+        """
+        tree = self.tree
+        n = self.n
+        root = tree.root if root is None else int(root)
+        nodes = np.arange(tree.n_nodes)
+        level = tree.depth - tree.depth[root]
+        parent = tree.parent
+        in_window = tree.is_ancestor(root, nodes)
+
+        if truncate_mode == 'lastp':
+            # Only the last p merges of the whole tree are drawn
+            truncated = (nodes >= n) & (nodes < 2*n - p)
+            visible = (nodes >= 2*n - p) | (parent >= 2*n - p) | (nodes == root)
+        elif truncate_mode == 'level':
+            # Node n is never contracted, its children are always original observations
+            truncated = (nodes > n) & (level > p)
+            visible = (level <= p + 1) | ((parent == n) & (level == p + 2))
+        else:
+            truncated = np.zeros(tree.n_nodes, dtype=bool)
+            visible = np.ones(tree.n_nodes, dtype=bool)
+
+        visible &= in_window
+        return visible, visible & ((nodes < n) | truncated)
+
+    def compute(self, root=None, truncate_mode=None, p=30, contraction_marks=False,
+                span_leaves=False):
+        """
+        Lay out the links below ``root``.
+
+        Parameters
+        ----------
+        root : int, optional
+            Node id of the subtree to lay out, the root of the tree by
+            default. Leaf positions start at 5 for any subtree.
+        truncate_mode : str, optional
+            ``'lastp'`` or ``'level'``, as in `dendrogram`. Levels are counted
+            from ``root``, the last ``p`` merges are those of the whole tree.
+        p : int, optional
+            The ``p`` parameter for ``truncate_mode``, already normalised by
+            `dendrogram`.
+        contraction_marks : bool, optional
+            Also compute the marks drawn on contracted clusters.
+        span_leaves : bool, optional
+            Place every leaf at the middle of the original observations it
+            contains instead of next to the previous leaf, so a node has the
+            same coordinates at every truncation level and in every subtree.
+
+        Returns
+        -------
+        layout : dict
+            ``icoord``, ``dcoord`` : ndarray of shape ``(m, 4)`` with the
+            coordinates of the ``m`` links, in the order of the recursive
+            layout (children before parents, left before right).
+            ``links`` : ndarray of the node id of every link.
+            ``in_order`` : ndarray of the rank of every link from left to right.
+            ``leaves`` : ndarray of the node ids drawn as leaves, from left to right.
+            ``leaf_positions`` : ndarray of the independent coordinate of every leaf.
+            ``contraction_marks`` : ndarray of shape ``(k, 2)``, if requested.
+
+        """
+        tree = self.tree
+        root = tree.root if root is None else int(root)
+        visible, displayed = self.visible_nodes(root, truncate_mode, p)
+
+        leaves = np.nonzero(displayed)[0]
+        leaves = leaves[np.argsort(tree.start[leaves], kind='stable')]
+        if span_leaves:
+            leaf_positions = 10.0 * tree.start[leaves] + 5.0 * tree.count[leaves]
+        else:
+            leaf_positions = 5.0 + 10.0 * np.arange(leaves.shape[0])
+
+        # Children have smaller ids than their parents, so increasing ids place
+        # both children of every link before the link itself
+        links = np.nonzero(visible & ~displayed)[0]
+        centers = np.zeros(tree.n_nodes)
+        centers[leaves] = leaf_positions
+        center_list = centers.tolist()
+        left_list = tree.left.tolist()
+        right_list = tree.right.tolist()
+        for node in links.tolist():
+            center_list[node] = (center_list[left_list[node]] + center_list[right_list[node]]) / 2
+        centers = np.asarray(center_list)
+
+        heights = np.zeros(tree.n_nodes)
+        heights[links] = tree.dist[links]
+
+        # Post-order: a link follows every link whose range ends before its own,
+        # links sharing the end of their range are drawn from the deepest up
+        end = tree.start[links] + tree.count[links]
+        links = links[np.lexsort((-tree.depth[links], end))]
+        a = tree.left[links]
+        b = tree.right[links]
+        h = tree.dist[links]
+        layout = {
+            'icoord': np.stack([centers[a], centers[a], centers[b], centers[b]], axis=1),
+            'dcoord': np.stack([heights[a], h, h, heights[b]], axis=1),
+            'links': links,
+            # A link is visited between its left and right subtrees
+            'in_order': np.argsort(np.argsort(tree.start[b], kind='stable'), kind='stable'),
+            'leaves': leaves,
+            'leaf_positions': leaf_positions,
+        }
+
+        if contraction_marks:
+            # Every hidden merge is marked on the contracted leaf whose range contains it
+            hidden = np.nonzero(~visible & (np.arange(tree.n_nodes) >= self.n)
+                                & tree.is_ancestor(root, np.arange(tree.n_nodes)))[0]
+            owner = np.searchsorted(tree.start[leaves], tree.start[hidden], side='right') - 1
+            order = np.lexsort((-hidden, owner))
+            layout['contraction_marks'] = np.stack([leaf_positions[owner[order]],
+                                                    tree.dist[hidden[order]]], axis=1)
+        return layout
+
+
+def cluster_membership(linkage_matrix, threshold):
+    """
+    Flat clusters of the tree cut at threshold, as integer ids numbered from 0 by their first leaf.
+    Features left on their own by the cut are not a cluster and get -1.
+    """
+    flat = fcluster(linkage_matrix, t=threshold, criterion='distance')
+    leaf_order = leaves_list(linkage_matrix)
+    sizes = np.bincount(flat)
+
+    ordered = flat[leaf_order]
+    clustered = ordered[sizes[ordered] > 1]
+    unique, first = np.unique(clustered, return_index=True)
+    ranks = np.full(sizes.shape[0], -1)
+    ranks[unique[np.argsort(first)]] = np.arange(unique.shape[0])
+    return ranks[flat], leaf_order
+
+
+def cluster_members(cluster_ids, leaf_order):
+    """Leaf indices of every cluster, in leaf order"""
+    leaves = leaf_order[cluster_ids[leaf_order] >= 0]
+    if leaves.shape[0] == 0:
+        return []
+    leaves = leaves[np.argsort(cluster_ids[leaves], kind='stable')]
+    return np.split(leaves, np.cumsum(np.bincount(cluster_ids[leaves]))[:-1])
+
+
+def link_cluster_ids(linkage_matrix, cluster_ids):
+    """Cluster of every node of the tree, -1 for the merges above the cut"""
+    n_samples = len(cluster_ids)
+    node_clusters = list(cluster_ids) + [-1] * (n_samples - 1)
+    for i, (left, right) in enumerate(linkage_matrix[:, :2].astype(int).tolist()):
+        # Below the cut both children belong to the same cluster, two singletons never merge there
+        if node_clusters[left] == node_clusters[right]:
+            node_clusters[n_samples + i] = node_clusters[left]
+    return node_clusters
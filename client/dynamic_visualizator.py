@@ -16,7 +16,7 @@ logger = logging.getLogger(__name__)
 def add_line_breaks(labels):
     return [label.replace(' ', '\n') for label in labels]
 
-def plot_dendrogram(ax, model, labels, **kwargs):
+def compute_linkage_matrix(model):
     counts = np.zeros(model.children_.shape[0])
     n_samples = len(model.labels_)
     for i, merge in enumerate(model.children_):
@@ -28,9 +28,11 @@ def plot_dendrogram(ax, model, labels, **kwargs):
                 current_count += counts[child_idx - n_samples]
         counts[i] = current_count
 
-    linkage_matrix = np.column_stack(
+    return np.column_stack(
         [model.children_, model.distances_, counts]
     ).astype(float)
+
+def plot_dendrogram(ax, linkage_matrix, labels, **kwargs):
     labels = add_line_breaks(labels=labels)
     dendrogram(linkage_matrix, ax=ax, labels=labels, **kwargs)
     ax.set_xticks(ax.get_xticks())
@@ -45,22 +47,32 @@ def load_dendrograms(folder_path):
             file_path = os.path.join(folder_path, filename)
             logger.debug(f"Loading file: {file_path}")
             file = joblib.load(file_path)
+            # Build the linkage matrix once instead of on every slider move
+            file['linkage_matrix'] = compute_linkage_matrix(file['model'])
             dendrograms.append((date, file))
     logger.info(f"Loaded {len(dendrograms)} dendrograms")
     return sorted(dendrograms, key=lambda x: x[0])
 
+def load_series(file_path):
+    # Series artifact from /dendogram/generate_series, frames already hold their linkage matrices
+    logger.info(f"Loading dendrogram series from {file_path}")
+    series = joblib.load(file_path)
+    metadata = {key: value for key, value in series.items() if key != 'frames'}
+    dendrograms = [(datetime.strptime(frame['date'], '%Y-%m-%d'), {**metadata, **frame}) for frame in series['frames']]
+    logger.info(f"Loaded {len(dendrograms)} dendrograms")
+    return sorted(dendrograms, key=lambda x: x[0])
+
 def update(val):
     idx = int(slider.val)
     logger.debug(f"Updating plot for index {idx}")
     ax.clear()
     date, file = dendrograms[idx]
-    model = file['model']
     labels = file['labels']
     affinity = file['affinity']
     verb_weight = file.get('verb_weight', 'N/A')
     object_weight = file.get('object_weight', 'N/A')
     
-    plot_dendrogram(ax, model, labels)
+    plot_dendrogram(ax, file['linkage_matrix'], labels)
     ax.set_title(f"{date.strftime('%Y-%m-%d')} | {affinity} | Verb Weight: {verb_weight} | Object weight: {object_weight}")
     ax.set_xlabel('Features', fontsize=12)
     ax.set_ylabel('Distance', fontsize=12)
@@ -72,12 +84,13 @@ def animate(frame):
 
 
 parser = argparse.ArgumentParser(description='Visualize dendrograms dynamically.')
-parser.add_argument('-i', '--input', type=str, required=True, help='Input folder containing dendrogram pkl files')
+parser.add_argument('-i', '--input', type=str, required=True,
+                    help='Input folder containing dendrogram pkl files, or a series pkl file')
 args = parser.parse_args()
 
 folder_path = args.input
 logger.info(f"Starting visualization for folder: {folder_path}")
-dendrograms = load_dendrograms(folder_path)
+dendrograms = load_series(folder_path) if os.path.isfile(folder_path) else load_dendrograms(folder_path)
 
 fig, ax = plt.subplots(figsize=(15, 8))
 plt.subplots_adjust(bottom=0.2)
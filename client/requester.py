@@ -1,10 +1,13 @@
 import requests
 import json
+import argparse
 import subprocess
 
 base_url = "http://127.0.0.1"
 port = "3008"
 endpoint = "dendogram/generate"
+batch_endpoint = "dendogram/generate_batch"
+sweep_endpoint = "dendogram/sweep"
 
 thresholds = [0.1, 0.2, 0.3, 0.4, 0.5]
 verb_weights = [0.1, 0.25, 0.331, 0.5, 0.75, 0.9]
@@ -23,6 +26,54 @@ def construct_url(base_url, port, endpoint, params):
     return (f"{full_url}?preprocessing=true&affinity={params['affinity']}&metric=cosine&threshold={params['threshold']}"
             f"&linkage=average&verb-weight={params['verb_weight']}&obj-weight={params['obj_weight']}")
 
+def run_visualizator():
+    try:
+        subprocess.run(['python', 'visualizator.py'], check=True)
+        print("Visualizator script executed successfully.")
+    except subprocess.CalledProcessError as e:
+        print(f"Error executing visualizator.py: {e}")
+    except FileNotFoundError:
+        print("visualizator.py not found. Make sure it's in the same directory as this script.")
+
+def main_batch():
+    # One request per affinity model covering every threshold and weight combination
+    parameters = [{"threshold": threshold, "verb-weight": verb_weight, "obj-weight": obj_weight}
+                  for threshold in thresholds
+                  for verb_weight, obj_weight in zip(verb_weights, obj_weights)]
+    body = {"apps": [{"app_name": "unknown", **json_data}], "parameters": parameters}
+
+    for affinity_model in affinity_models:
+        full_url = f"{base_url}:{port}/{batch_endpoint}" if port else f"{base_url}/{batch_endpoint}"
+        url = f"{full_url}?preprocessing=true&affinity={affinity_model}&metric=cosine&linkage=average&visualize=true"
+
+        try:
+            response = requests.post(url, json=body)
+            if response.status_code == 200:
+                print(f"Success: {response.status_code} - {url} ({len(response.json()['results'])} dendrograms)")
+            else:
+                print(f"Error: {response.status_code} - {url}")
+        except requests.exceptions.RequestException as e:
+            print(f"Request failed: {e}")
+
+    run_visualizator()
+
+def main_sweep():
+    # Embeddings are computed once per affinity model and reweighted for every combination
+    body = {**json_data, "verb_weights": verb_weights, "obj_weights": obj_weights, "thresholds": thresholds}
+
+    for affinity_model in affinity_models:
+        full_url = f"{base_url}:{port}/{sweep_endpoint}" if port else f"{base_url}/{sweep_endpoint}"
+        url = f"{full_url}?preprocessing=true&affinity={affinity_model}&metric=cosine&linkage=average"
+
+        try:
+            response = requests.post(url, json=body)
+            if response.status_code == 200:
+                print(f"Success: {response.status_code} - {url} -> {response.json()['index_path']}")
+            else:
+                print(f"Error: {response.status_code} - {url}")
+        except requests.exceptions.RequestException as e:
+            print(f"Request failed: {e}")
+
 def main():
     for affinity_model in affinity_models:
         for threshold in thresholds:
@@ -45,13 +96,17 @@ def main():
                 except requests.exceptions.RequestException as e:
                     print(f"Request failed: {e}")
 
-    try:
-        subprocess.run(['python', 'visualizator.py'], check=True)
-        print("Visualizator script executed successfully.")
-    except subprocess.CalledProcessError as e:
-        print(f"Error executing visualizator.py: {e}")
-    except FileNotFoundError:
-        print("visualizator.py not found. Make sure it's in the same directory as this script.")
+    run_visualizator()
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Generate dendrograms for every parameter combination.")
+    parser.add_argument("--batch", action="store_true", help="Send all combinations in one batch request per affinity")
+    parser.add_argument("--sweep", action="store_true", help="Reuse embeddings across weight combinations")
+    args = parser.parse_args()
+
+    if args.sweep:
+        main_sweep()
+    elif args.batch:
+        main_batch()
+    else:
+        main()
@@ -9,6 +9,7 @@ from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
 import torch
 import matplotlib.colors as mcolors
 import numpy as np
+from dendrogram_layout import cluster_membership, cluster_members, link_cluster_ids
 
 model_name = "meta-llama/Llama-3.2-3B"
 tokenizer = AutoTokenizer.from_pretrained(model_name)
@@ -85,56 +86,10 @@ def generate_infinite_colors(num_colors):
     saturation = 0.9  # Fixed saturation for vivid colors
     value = 0.9  # Fixed value for brightness
 
-    # Create colors by varying hue, saturation, and value
+    # Create colors by varying hue, saturation, and value, one per cluster in order
     colors = [mcolors.hsv_to_rgb((hue, saturation, value)) for hue in hues]
-    return list(set([mcolors.rgb2hex(color) for color in colors]))
-def reassign_dendrogram_colors(dendrogram_result, num_colors):
-    infinite_colors = generate_infinite_colors(num_colors)
-    new_color_list = []
-    new_leaves_color_list = []
-
-    # Track clusters by analyzing color blocks in `color_list`
-    current_color = None
-    current_cluster_id = 0
-    cluster_color_map = {}
-
-    for i, color in enumerate(dendrogram_result['color_list']):
-        if color == 'grey':
-            new_color_list.append('grey')
-            continue
-
-        # Detect new clusters when the color changes
-        if color != current_color:
-            cluster_color_map = {}
-            current_color = color
-            cluster_color_map[color] = infinite_colors[current_cluster_id]
-            current_cluster_id += 1
-            new_color_list.append(cluster_color_map[current_color])
-        else:
-            new_color_list.append(cluster_color_map[current_color])
-
-    current_color = None
-    cluster_color_map = {}  # Reset cluster mapping for leaves
-    current_cluster_id = 0  # Reset cluster ID for leaves
-    for color in dendrogram_result['leaves_color_list']:
-        if color == 'grey':
-            # Preserve grey for leaves associated with grey branches
-            new_leaves_color_list.append('grey')
-            continue
-
-        # Detect new clusters when the color changes
-        if color != current_color:
-            cluster_color_map = {}
-            current_color = color
-            cluster_color_map[color] = infinite_colors[current_cluster_id]
-            current_cluster_id += 1
-
-        new_leaves_color_list.append(cluster_color_map[current_color])
-
-    dendrogram_result['color_list'] = new_color_list
-    dendrogram_result['leaves_color_list'] = new_leaves_color_list
-
-    return dendrogram_result
+    return [mcolors.rgb2hex(color) for color in colors]
+
 def render_dendrogram_and_process_clusters(model_info, labels, color_threshold, original_data):
     application_name = model_info['application_name']
     affinity = model_info['affinity']
@@ -150,16 +105,21 @@ def render_dendrogram_and_process_clusters(model_info, labels, color_threshold,
 
     linkage_matrix = linkage(original_data, method='average', metric='euclidean')
 
+    # Cluster membership comes from the cut itself, colours are only needed to draw it
+    cluster_ids, leaf_order = cluster_membership(linkage_matrix, color_threshold)
+    members = cluster_members(cluster_ids, leaf_order)
+    colors = generate_infinite_colors(len(members))
+    node_clusters = link_cluster_ids(linkage_matrix, cluster_ids)
+
     fig, ax = plt.subplots(figsize=(30, 30))
 
     dendrogram(
         linkage_matrix,
         labels=labels,
-        color_threshold=color_threshold,
         leaf_font_size=10,
         orientation='right',
         distance_sort='descending',
-        above_threshold_color='grey',
+        link_color_func=lambda node: colors[node_clusters[node]] if node_clusters[node] >= 0 else 'grey',
         ax=ax,
     )
 
@@ -175,44 +135,27 @@ def render_dendrogram_and_process_clusters(model_info, labels, color_threshold,
     plt.close(fig)
     print(f"Final dendrogram saved at: {final_dendrogram_path}")
 
-    cluster_map = {}
-    dendrogram_result = dendrogram(
-        linkage_matrix,
-        labels=labels,
-        color_threshold=color_threshold,
-        leaf_font_size=10,
-        orientation='right',
-        distance_sort='descending',
-        above_threshold_color='grey',
-        ax=ax,
-        no_plot=True
-    )
-    num_colors = len(labels)
-    reassign_dendrogram_colors(dendrogram_result, num_colors)
-
-    for leaf, color in zip(dendrogram_result['leaves'], dendrogram_result['leaves_color_list']):
-        if color == 'grey':
-            continue
-        if color not in cluster_map:
-            cluster_map[color] = {'labels': [], 'indices': []}
-        label = labels[leaf]
-        cluster_map[color]['labels'].append(label)
-        cluster_map[color]['indices'].append(leaf)
+    clusters = [{
+        'color': colors[cluster_id],
+        'labels': [labels[leaf] for leaf in indices],
+        'indices': indices.tolist(),
+    } for cluster_id, indices in enumerate(members)]
 
-    print(f"Detected {len(cluster_map)} unique clusters for processing.")
+    print(f"Detected {len(clusters)} unique clusters for processing.")
 
     general_json = build_hierarchical_json(linkage_matrix, labels)
     general_json_path = os.path.join(app_folder, f"{application_name}_general_hierarchy.json")
     save_json(general_json, general_json_path)
 
-    process_and_save_clusters(cluster_map, application_name, app_folder, original_data, color_threshold)
+    process_and_save_clusters(clusters, application_name, app_folder, original_data, color_threshold)
 
-    return cluster_map
+    return clusters
 
-def process_and_save_clusters(cluster_map, application_name, app_folder, original_data, color_threshold):
+def process_and_save_clusters(clusters, application_name, app_folder, original_data, color_threshold):
     final_csv_data = []
 
-    for cluster_id, (color, cluster_data) in enumerate(cluster_map.items(), start=1):
+    for cluster_id, cluster_data in enumerate(clusters, start=1):
+        color = cluster_data['color']
         cluster_labels = cluster_data['labels']
         cluster_indices = cluster_data['indices']
 
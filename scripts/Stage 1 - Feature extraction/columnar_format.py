@@ -0,0 +1,31 @@
+import os
+import sys
+import argparse
+import pandas as pd
+
+# The Parquet schema, readers and writers are defined once in backend/columnar_format.py
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from backend.columnar_format import (FEATURES_COLUMN, LIST_FEATURES_COLUMN, FEATURE_COLUMN, REVIEWS_SUFFIX,
+                                     FEATURES_SUFFIX, check_columnar_support, is_reviews_file, features_path,
+                                     write_columnar, read_reviews, read_features, reviews_to_dataframe)
+
+
+def convert_folder(input_folder, output_folder):
+    check_columnar_support()
+    os.makedirs(output_folder, exist_ok=True)
+    for file_name in sorted(os.listdir(input_folder)):
+        if file_name.endswith('.csv'):
+            input_path = os.path.join(input_folder, file_name)
+            output_base = os.path.join(output_folder, os.path.splitext(file_name)[0])
+            reviews_path = write_columnar(pd.read_csv(input_path), output_base)
+            print(f"Converted {input_path} -> {reviews_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert Stage 1 CSV files into the columnar Parquet format")
+    parser.add_argument('--input_folder', required=True, help='Path to the folder containing Stage 1 CSV files')
+    parser.add_argument('--output_folder', required=True, help='Path to the folder to save the Parquet files')
+
+    args = parser.parse_args()
+    convert_folder(args.input_folder, args.output_folder)
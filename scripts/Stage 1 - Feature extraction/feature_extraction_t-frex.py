@@ -4,67 +4,112 @@ import spacy
 from transformers import pipeline
 import argparse
 import pandas as pd
+import torch
+from concurrent.futures import ProcessPoolExecutor
 
+NER_MODEL = "quim-motger/t-frex-bert-base-uncased"
+SCORE_THRESHOLD = 0.5
+SPACY_BATCH_SIZE = 256
+NER_BATCH_SIZE = 64
 
-def extract_features_from_review(review, ner_pipeline):
+# Models loaded once per worker process
+nlp = None
+ner_pipeline = None
+
+
+def load_models(torch_threads=None):
+    global nlp, ner_pipeline
+    if torch_threads:
+        torch.set_num_threads(torch_threads)
+    # Only the parser is needed for sentence boundaries
+    nlp = spacy.load("en_core_web_sm", disable=["tagger", "attribute_ruler", "lemmatizer", "ner"])
+    ner_pipeline = pipeline("ner", model=NER_MODEL, aggregation_strategy="simple")
+
+
+def split_sentences(reviews):
+    """
+    Split every review into sentences with one spaCy pass.
+    Returns the flattened sentences and the row each of them belongs to.
+    """
+    rows = [i for i, review in enumerate(reviews) if isinstance(review, str) and review]
+    sentences = []
+    sentence_rows = []
+    for row, doc in zip(rows, nlp.pipe((reviews[i] for i in rows), batch_size=SPACY_BATCH_SIZE)):
+        for sent in doc.sents:
+            if sent.text.strip():
+                sentences.append(sent.text)
+                sentence_rows.append(row)
+    return sentences, sentence_rows
+
+
+def extract_features_from_reviews(reviews):
     """
-    Extract features from the review using the NER model.
+    Extract features from all reviews using the NER model in batches.
     """
-    nlp = spacy.load("en_core_web_sm")
-    doc = nlp(review)
-    sentences = [sent.text for sent in doc.sents]
+    sentences, sentence_rows = split_sentences(reviews)
 
-    extracted_features = []
-    for sentence in sentences:
-        ner_results = ner_pipeline(sentence)
-        for entity in ner_results:
-            if entity['score'] > 0.5:
-                extracted_features.append(entity['word'])
+    extracted_features = [[] for _ in reviews]
+    if sentences:
+        ner_results = ner_pipeline(sentences, batch_size=NER_BATCH_SIZE)
+        # Scatter the entities of each sentence back to its review
+        for row, entities in zip(sentence_rows, ner_results):
+            extracted_features[row].extend(entity['word'] for entity in entities
+                                           if entity['score'] > SCORE_THRESHOLD)
 
-    return ";".join(extracted_features)
+    return [";".join(features) for features in extracted_features]
 
 
-def process_csv(input_file, output_file, ner_pipeline):
+def extract_features_from_review(review):
+    """
+    Extract features from a single review using the NER model.
+    """
+    return extract_features_from_reviews([review])[0]
+
+
+def process_csv(input_file, output_file):
     """
     Process the input CSV file to extract features and save the updated file.
     """
     # Read the input CSV
     df = pd.read_csv(input_file)
 
-    # Extract features for each review
-    features = []
-    for index, row in df.iterrows():
-        review = row.get('review', '')
-        if pd.isna(review) or not isinstance(review, str):
-            features.append('')
-        else:
-            features.append(extract_features_from_review(review, ner_pipeline))
-
-    # Add the extracted features as a new column
-    df['extracted_features'] = features
+    # Extract features for all reviews at once
+    reviews = df['review'].tolist() if 'review' in df.columns else [''] * len(df)
+    df['extracted_features'] = extract_features_from_reviews(reviews)
 
     # Save the updated DataFrame to the output file
     df.to_csv(output_file, index=False)
     print(f"Processed file saved to {output_file}")
+    return output_file
 
 
-def process_folder(input_folder, output_folder):
+def process_folder(input_folder, output_folder, workers=1):
     """
-    Process all CSV files in the input folder.
+    Process all CSV files in the input folder, one file per worker process.
     """
-    # Load the NER pipeline
-    ner_pipeline = pipeline("ner", model="quim-motger/t-frex-bert-base-uncased", aggregation_strategy="simple")
-
     # Ensure the output folder exists
     os.makedirs(output_folder, exist_ok=True)
 
-    # Process each CSV file in the input folder
-    for file_name in os.listdir(input_folder):
+    tasks = []
+    for file_name in sorted(os.listdir(input_folder)):
         if file_name.endswith('.csv'):
             input_file = os.path.join(input_folder, file_name)
             output_file = os.path.join(output_folder, file_name)
             print(f"Processing {input_file} -> {output_file}")
-            process_csv(input_file, output_file, ner_pipeline)
+            tasks.append((input_file, output_file))
+
+    if workers <= 1:
+        load_models()
+        for input_file, output_file in tasks:
+            process_csv(input_file, output_file)
+    else:
+        # Split the cores between workers so their torch thread pools do not compete
+        torch_threads = max(1, (os.cpu_count() or 1) // workers)
+        with ProcessPoolExecutor(max_workers=workers, initializer=load_models,
+                                 initargs=(torch_threads,)) as executor:
+            futures = [executor.submit(process_csv, input_file, output_file) for input_file, output_file in tasks]
+            for future in futures:
+                future.result()
 
     print(f"All files processed. Results saved in {output_folder}")
 
@@ -73,6 +118,7 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Extract features from reviews using NER model")
     parser.add_argument('--input_folder', required=True, help='Path to the input folder containing CSV files')
     parser.add_argument('--output_folder', required=True, help='Path to the output folder to save updated CSV files')
+    parser.add_argument('--workers', type=int, default=1, help='Number of files processed in parallel')
 
     args = parser.parse_args()
-    process_folder(args.input_folder, args.output_folder)
+    process_folder(args.input_folder, args.output_folder, args.workers)
@@ -1,41 +1,188 @@
 import os
 import json
+import time
+import random
 import argparse
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-def process_reviews(input_folder, output_folder, url):
+DEFAULT_CONCURRENCY = 4
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_TIMEOUT = 300
+DEFAULT_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+thread_local = threading.local()
+
+
+class InputFileError(ValueError):
+    """The input file is not valid JSON or not a list of apps with a list of reviews."""
+
+
+class ResponseDecodeError(ValueError):
+    """The server answered with a body that is not valid JSON."""
+
+
+def get_session(concurrency):
+    # One pooled session per worker thread, sessions are not thread-safe to share
+    if not hasattr(thread_local, 'session'):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        thread_local.session = session
+    return thread_local.session
+
+
+def chunk_app_data(app_data, chunk_size):
+    """Split every app of the file into sub-requests of at most chunk_size reviews."""
+    chunks = []
+    for app in app_data:
+        reviews = app.get('reviews', [])
+        if len(reviews) <= chunk_size:
+            chunks.append([app])
+            continue
+        for i in range(0, len(reviews), chunk_size):
+            chunks.append([{**app, 'reviews': reviews[i:i + chunk_size]}])
+    return chunks
+
+
+def post_with_retry(url, payload, concurrency, timeout, retries):
+    headers = {'Content-Type': 'application/json'}
+    for attempt in range(retries + 1):
+        try:
+            response = get_session(concurrency).post(url, headers=headers, json=payload, timeout=timeout)
+            if response.status_code not in RETRY_STATUS_CODES:
+                response.raise_for_status()
+                try:
+                    return response.json()
+                except ValueError as e:
+                    raise ResponseDecodeError(f"{url} answered {response.status_code} with invalid JSON: {e}")
+            error = requests.exceptions.HTTPError(f"{response.status_code} Server Error", response=response)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            error = e
+
+        if attempt == retries:
+            raise error
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+        print(f"Request failed ({error}), retrying in {delay:.1f}s ({attempt + 1}/{retries})")
+        time.sleep(delay)
+
+
+def merge_responses(responses):
+    merged = dict(responses[0]) if isinstance(responses[0], dict) else {}
+    merged['analyzed_reviews'] = [review
+                                  for response in responses
+                                  for review in response.get('analyzed_reviews', [])]
+    return merged
+
+
+def write_json_atomically(output_file_path, data):
+    # A partially written file would be skipped as done on the next resumed run
+    tmp_path = f"{output_file_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as output_file:
+        json.dump(data, output_file, ensure_ascii=False)
+    os.replace(tmp_path, output_file_path)
+
+
+def is_processed(output_file_path):
+    return os.path.exists(output_file_path) and os.path.getsize(output_file_path) > 0
+
+
+def load_app_data(input_file_path):
+    try:
+        with open(input_file_path, 'r', encoding='utf-8') as file:
+            app_data = json.load(file)
+    except (OSError, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise InputFileError(str(e))
+    if not isinstance(app_data, list) or not all(isinstance(app, dict) for app in app_data):
+        raise InputFileError("expected a list of app objects")
+    if not all(isinstance(app.get('reviews', []), list) for app in app_data):
+        raise InputFileError("'reviews' must be a list in every app")
+    return app_data
+
+
+def process_file(input_file_path, output_file_path, url, executor, options):
+    app_data = load_app_data(input_file_path)
+
+    chunks = chunk_app_data(app_data, options['chunk_size'])
+    futures = [executor.submit(post_with_retry, url, chunk, options['concurrency'],
+                               options['timeout'], options['retries'])
+               for chunk in chunks]
+    # Keep chunk order so the merged output matches the input review order
+    responses = [future.result() for future in futures]
+    write_json_atomically(output_file_path, merge_responses(responses))
+
+    return sum(len(app.get('reviews', [])) for app in app_data), len(chunks)
+
+
+def process_reviews(input_folder, output_folder, url, concurrency=DEFAULT_CONCURRENCY,
+                    chunk_size=DEFAULT_CHUNK_SIZE, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES):
     # Ensure the output folder exists
     os.makedirs(output_folder, exist_ok=True)
+    options = {'concurrency': concurrency, 'chunk_size': chunk_size, 'timeout': timeout, 'retries': retries}
 
-    for file_name in os.listdir(input_folder):
-        if file_name.endswith(".json"):
-            input_file_path = os.path.join(input_folder, file_name)
+    pending = []
+    skipped = 0
+    for file_name in sorted(os.listdir(input_folder)):
+        if not file_name.endswith(".json"):
+            continue
+        output_file_path = os.path.join(output_folder, file_name)
+        if is_processed(output_file_path):
+            skipped += 1
+            continue
+        pending.append((file_name, os.path.join(input_folder, file_name), output_file_path))
+    print(f"{len(pending)} files to process, {skipped} already processed")
 
-            # Read the input JSON file
-            with open(input_file_path, 'r', encoding='utf-8') as file:
-                try:
-                    app_data = json.load(file)
-                except json.JSONDecodeError:
-                    print(f"Error decoding JSON in file: {file_name}")
-                    continue
-
-            # print(app_data)
-            
-            # Send POST request
-            headers = {'Content-Type': 'application/json'}
+    started = time.perf_counter()
+    total_reviews = 0
+    total_requests = 0
+    failed = 0
+    # Chunk requests run on the request pool, files are orchestrated on their own pool
+    with ThreadPoolExecutor(max_workers=concurrency) as request_executor, \
+            ThreadPoolExecutor(max_workers=concurrency) as file_executor:
+        futures = {file_executor.submit(process_file, input_file_path, output_file_path, url,
+                                        request_executor, options): file_name
+                   for file_name, input_file_path, output_file_path in pending}
+
+        for future in as_completed(futures):
+            file_name = futures[future]
             try:
-                response = requests.post(url, headers=headers, json=app_data)
-                response.raise_for_status()
+                n_reviews, n_requests = future.result()
+            except InputFileError as e:
+                print(f"Invalid input file {file_name}: {e}")
+                failed += 1
+                continue
+            except ResponseDecodeError as e:
+                print(f"Invalid response for file {file_name}: {e}")
+                failed += 1
+                continue
             except requests.exceptions.RequestException as e:
                 print(f"Error sending request for file {file_name}: {e}")
+                failed += 1
                 continue
+            except Exception as e:
+                # One broken file must not abort the remaining ones
+                print(f"Error processing file {file_name}: {e!r}")
+                failed += 1
+                continue
+
+            total_reviews += n_reviews
+            total_requests += n_requests
+            elapsed = time.perf_counter() - started
+            print(f"Processed {file_name} ({n_reviews} reviews in {n_requests} requests) - "
+                  f"{total_reviews / elapsed:.1f} reviews/s")
 
-            # Save the response
-            output_file_path = os.path.join(output_folder, file_name)
-            with open(output_file_path, 'w', encoding='utf-8') as output_file:
-                output_file.write(response.text)
+    elapsed = time.perf_counter() - started
+    print(f"Finished in {elapsed:.1f}s: {len(pending) - failed} files, {total_reviews} reviews, "
+          f"{total_requests} requests, {failed} failed")
+    if elapsed > 0:
+        print(f"Throughput: {total_reviews / elapsed:.1f} reviews/s, {total_requests / elapsed:.2f} requests/s")
 
-            print(f"Processed {file_name} and saved response to {output_file_path}")
 
 if __name__ == "__main__":
     # Argument parsing
@@ -43,8 +190,14 @@ if __name__ == "__main__":
     parser.add_argument("--input_folder", required=True, help="Path to the folder containing input JSON files.")
     parser.add_argument("--output_folder", required=True, help="Path to the folder to save the responses.")
     parser.add_argument("--url", required=True, help="URL to send the POST requests.")
-    
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Number of concurrent requests.")
+    parser.add_argument("--chunk_size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="Maximum number of reviews sent in a single request.")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="Request timeout in seconds.")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES, help="Retries per request with exponential backoff.")
+
     args = parser.parse_args()
-    
+
     # Process reviews
-    process_reviews(args.input_folder, args.output_folder, args.url)
+    process_reviews(args.input_folder, args.output_folder, args.url, args.concurrency,
+                    args.chunk_size, args.timeout, args.retries)
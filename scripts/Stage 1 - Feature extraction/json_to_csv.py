@@ -1,84 +1,151 @@
-import json
 import csv
 import os
+import shutil
 import argparse
-from collections import defaultdict
-
-
-def parse_reviews(input_file):
-    # Read the JSON file
-    with open(input_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-    # Extract reviews and add additional fields
-    reviews_data = []
-    grouped_reviews = defaultdict(list)
-
-    for app in data:
-        app_name = app.get('app_name')
-        app_package = app.get('reviews')[0].get('package') if app.get('reviews') else None
-        app_categoryId = app.get('categoryId')
-
-        for review in app.get('reviews', []):
-            review_row = {
-                'app_name': app_name,
-                'app_package': app_package,
-                'app_categoryId': app_categoryId,
-                'reviewId': review.get('reviewId'),
-                'review': review.get('review'),
-                'reply': review.get('reply'),
-                'userName': review.get('userName'),
-                'score': review.get('score'),
-                'at': review.get('at')
-            }
-            reviews_data.append(review_row)
-            grouped_reviews[app_categoryId].append(review_row)
-
-    return reviews_data, grouped_reviews
-
-
-def write_csv(output_file, data, fieldnames):
-    with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames, escapechar='\\', quoting=csv.QUOTE_MINIMAL)
-        writer.writeheader()
-        writer.writerows(data)
-
-
-def process_folder(input_folder, output_folder):
+import ijson
+from concurrent.futures import ProcessPoolExecutor
+
+FIELDNAMES = ['app_name', 'app_package', 'app_categoryId', 'reviewId', 'review', 'reply', 'userName', 'score', 'at']
+SCALAR_EVENTS = ('string', 'number', 'boolean', 'null')
+PARTS_DIRECTORY_NAME = '.category_parts'
+
+
+def iter_reviews(input_file):
+    """
+    Stream review rows from the JSON file without loading it.
+    Reviews are only buffered while the app fields they need have not been read yet.
+    """
+    with open(input_file, 'rb') as f:
+        app = None
+        pending = []
+        builder = None
+
+        for prefix, event, value in ijson.parse(f, use_float=True):
+            if builder is not None:
+                builder.event(event, value)
+                if prefix == 'item.reviews.item' and event == 'end_map':
+                    review = builder.value
+                    builder = None
+                    if not app['has_reviews']:
+                        app['app_package'] = review.get('package')
+                    app['has_reviews'] = True
+                    pending.append(review)
+                    if 'app_name' in app and 'app_categoryId' in app:
+                        yield from (review_row(app, review) for review in pending)
+                        pending = []
+            elif prefix == 'item' and event == 'start_map':
+                app = {'app_package': None, 'has_reviews': False}
+                pending = []
+            elif prefix == 'item' and event == 'end_map':
+                # Fields missing from the app are written as empty, as before
+                yield from (review_row(app, review) for review in pending)
+                pending = []
+            elif prefix == 'item.reviews.item' and event == 'start_map':
+                builder = ijson.ObjectBuilder()
+                builder.event(event, value)
+            elif prefix == 'item.app_name' and event in SCALAR_EVENTS:
+                app['app_name'] = value
+            elif prefix == 'item.categoryId' and event in SCALAR_EVENTS:
+                app['app_categoryId'] = value
+
+
+def review_row(app, review):
+    return {
+        'app_name': app.get('app_name'),
+        'app_package': app['app_package'],
+        'app_categoryId': app.get('app_categoryId'),
+        'reviewId': review.get('reviewId'),
+        'review': review.get('review'),
+        'reply': review.get('reply'),
+        'userName': review.get('userName'),
+        'score': review.get('score'),
+        'at': review.get('at')
+    }
+
+
+class LazyCsvWriter:
+    """CSV writer that only creates its file once the first row arrives."""
+
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.csvfile = None
+        self.writer = None
+
+    def writerow(self, row):
+        if self.writer is None:
+            self.csvfile = open(self.output_file, 'w', newline='', encoding='utf-8')
+            self.writer = csv.DictWriter(self.csvfile, fieldnames=FIELDNAMES, escapechar='\\', quoting=csv.QUOTE_MINIMAL)
+            self.writer.writeheader()
+        self.writer.writerow(row)
+
+    def close(self):
+        if self.csvfile is not None:
+            self.csvfile.close()
+
+
+def process_file(input_file, app_output_file, parts_folder):
+    """
+    Write the app CSV and one part file per category for a single JSON file.
+    Returns the category part files that were written.
+    """
+    os.makedirs(parts_folder, exist_ok=True)
+    app_writer = LazyCsvWriter(app_output_file)
+    category_writers = {}
+    try:
+        for row in iter_reviews(input_file):
+            app_writer.writerow(row)
+            categoryId = row['app_categoryId']
+            if categoryId not in category_writers:
+                category_writers[categoryId] = LazyCsvWriter(os.path.join(parts_folder, f"{categoryId}.csv"))
+            category_writers[categoryId].writerow(row)
+    finally:
+        app_writer.close()
+        for writer in category_writers.values():
+            writer.close()
+
+    return {categoryId: writer.output_file for categoryId, writer in category_writers.items()}
+
+
+def merge_category_parts(output_file, part_files):
+    # Concatenate the parts, keeping only the first header
+    with open(output_file, 'w', newline='', encoding='utf-8') as merged:
+        for i, part_file in enumerate(part_files):
+            with open(part_file, 'r', newline='', encoding='utf-8') as part:
+                header = part.readline()
+                if i == 0:
+                    merged.write(header)
+                shutil.copyfileobj(part, merged)
+
+
+def process_folder(input_folder, output_folder, workers=1):
     # Ensure the output folder exists
     os.makedirs(output_folder, exist_ok=True)
+    parts_root = os.path.join(output_folder, PARTS_DIRECTORY_NAME)
 
-    # A dictionary to group reviews by categoryId across all files
-    combined_grouped_reviews = defaultdict(list)
-
-    # Iterate over all JSON files in the input folder
-    for file_name in os.listdir(input_folder):
+    tasks = []
+    for file_name in sorted(os.listdir(input_folder)):
         if file_name.endswith('.json'):
             input_file = os.path.join(input_folder, file_name)
             app_output_file = os.path.join(output_folder, file_name.replace('.json', '.csv'))
-            
+            parts_folder = os.path.join(parts_root, file_name.replace('.json', ''))
+            tasks.append((input_file, app_output_file, parts_folder))
+
+    # Part files of each category, in input file order
+    category_parts = {}
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = [executor.submit(process_file, *task) for task in tasks]
+        for (input_file, app_output_file, _), future in zip(tasks, futures):
             print(f"Processing {input_file} -> {app_output_file}")
-            reviews_data, grouped_reviews = parse_reviews(input_file)
-
-            # Write CSV for each app
-            if reviews_data:
-                fieldnames = list(reviews_data[0].keys())
-                write_csv(app_output_file, reviews_data, fieldnames)
-
-            # Merge reviews into combined grouped reviews
-            for categoryId, reviews in grouped_reviews.items():
-                combined_grouped_reviews[categoryId].extend(reviews)
+            for categoryId, part_file in future.result().items():
+                category_parts.setdefault(categoryId, []).append(part_file)
 
     # Write separate CSV files for each categoryId
-    for categoryId, reviews in combined_grouped_reviews.items():
+    for categoryId, part_files in category_parts.items():
         category_output_file = os.path.join(output_folder, f"{categoryId}.csv")
         print(f"Saving reviews for categoryId={categoryId} -> {category_output_file}")
+        merge_category_parts(category_output_file, part_files)
 
-        # Write CSV for each categoryId
-        if reviews:
-            fieldnames = list(reviews[0].keys())
-            write_csv(category_output_file, reviews, fieldnames)
-
+    shutil.rmtree(parts_root, ignore_errors=True)
     print(f"All reviews processed. App files and category files saved in {output_folder}")
 
 
@@ -86,6 +153,7 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Parse JSON files and save reviews for apps and categories")
     parser.add_argument('--input_folder', required=True, help='Path to the input folder containing JSON files')
     parser.add_argument('--output_folder', required=True, help='Path to the output folder to save CSV files')
+    parser.add_argument('--workers', type=int, default=1, help='Number of JSON files converted in parallel')
 
     args = parser.parse_args()
-    process_folder(args.input_folder, args.output_folder)
+    process_folder(args.input_folder, args.output_folder, args.workers)
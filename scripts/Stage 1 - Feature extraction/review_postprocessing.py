@@ -2,61 +2,95 @@ import os
 import json
 import pandas as pd
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from columnar_format import write_columnar
 
-def parse_and_add_column(csv_folder, json_folder, output_folder):
+FEATURE_PATH = 'featureData.feature'
+
+
+def normalize_features(json_data):
+    """
+    Flatten the TransFeatEx analyzed reviews into a (reviewId, feature) frame,
+    one row per non-empty feature in sentence order.
+    """
+    # Reviews without sentences contribute no features
+    analyzed_reviews = [review for review in json_data.get("analyzed_reviews", []) if review.get("sentences")]
+    if not analyzed_reviews:
+        return pd.DataFrame(columns=['reviewId', 'feature'])
+
+    sentences = pd.json_normalize(analyzed_reviews, record_path='sentences', meta=['reviewId'], errors='ignore')
+    if FEATURE_PATH not in sentences.columns:
+        return pd.DataFrame(columns=['reviewId', 'feature'])
+
+    features = sentences[['reviewId', FEATURE_PATH]].rename(columns={FEATURE_PATH: 'feature'})
+    return features[features['reviewId'].notna() & (features['reviewId'] != '')
+                    & features['feature'].notna() & (features['feature'] != '')]
+
+
+def process_pair(csv_path, json_path, output_folder, output_format='csv'):
+    # Load the CSV file
+    df = pd.read_csv(csv_path)
+
+    # Rename 'extracted_features' to 'extracted_features_T-FREX'
+    if 'extracted_features' in df.columns:
+        df.rename(columns={'extracted_features': 'extracted_features_T-FREX'}, inplace=True)
+
+    # Load the JSON file
+    with open(json_path, 'r') as jf:
+        json_data = json.load(jf)
+
+    features = normalize_features(json_data)
+    grouped = features.groupby('reviewId', sort=False)['feature']
+    base_name = os.path.splitext(os.path.basename(csv_path))[0]
+
+    if output_format == 'parquet':
+        # Keep the features as lists, the columnar writer stores them without joining
+        review_features = grouped.agg(list).rename('features_list').reset_index()
+        df = df.merge(review_features, on='reviewId', how='inner')
+        output_path = write_columnar(df, os.path.join(output_folder, base_name),
+                                     features=df.pop('features_list'))
+    else:
+        # Add the 'extracted_features_TransFeatEx' column, reviews without features are dropped by the inner join
+        review_features = grouped.agg(';'.join).rename('extracted_features_TransFeatEx').reset_index()
+        df = df.merge(review_features, on='reviewId', how='inner')
+        # Save the updated DataFrame to the output folder
+        output_path = os.path.join(output_folder, os.path.basename(csv_path))
+        df.to_csv(output_path, sep=',', index=False)
+
+    return output_path
+
+
+def parse_and_add_column(csv_folder, json_folder, output_folder, workers=1, output_format='csv'):
     # Ensure output folder exists
     os.makedirs(output_folder, exist_ok=True)
-    
+
     # List all CSV and JSON files
     csv_files = {os.path.splitext(f)[0]: f for f in os.listdir(csv_folder) if f.endswith('.csv')}
     json_files = {os.path.splitext(f)[0]: f for f in os.listdir(json_folder) if f.endswith('.json')}
-    
+
+    pairs = []
     for base_name, csv_file in csv_files.items():
         json_file = json_files.get(base_name)
-        
+
         if not json_file:
             print(f"No matching JSON file found for {csv_file}. Skipping.")
             continue
-        
-        # Load the CSV file
-        csv_path = os.path.join(csv_folder, csv_file)
-        df = pd.read_csv(csv_path)
-        
-        # Rename 'extracted_features' to 'extracted_features_T-FREX'
-        if 'extracted_features' in df.columns:
-            df.rename(columns={'extracted_features': 'extracted_features_T-FREX'}, inplace=True)
-        
-        # Load the JSON file
-        json_path = os.path.join(json_folder, json_file)
-        with open(json_path, 'r') as jf:
-            json_data = json.load(jf)
-        
-        # Build a mapping of reviewId to features
-        review_features_map = {}
-        for review in json_data.get("analyzed_reviews", []):
-            review_id = review.get("reviewId")
-            if review_id:
-                features = [
-                    sentence.get("featureData", {}).get("feature", "")
-                    for sentence in review.get("sentences", [])
-                ]
-                # Concatenate features separated by ';'
-                review_features_map[review_id] = ";".join(filter(None, features))
-        
-        # Add the 'extracted_features_TransFeatEx' column
-        df['extracted_features_TransFeatEx'] = df['reviewId'].map(review_features_map)
-        # Filter out rows where extracted_features_TransFeatEx is empty
-        df = df[df['extracted_features_TransFeatEx'].notna() & (df['extracted_features_TransFeatEx'] != '')]
-        # Save the updated DataFrame to the output folder
-        output_path = os.path.join(output_folder, csv_file)
-        df.to_csv(output_path, sep=',', index=False)
-        print(f"Processed {csv_file} and saved to {output_path}")
+        pairs.append((csv_file, os.path.join(csv_folder, csv_file), os.path.join(json_folder, json_file)))
+
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = [executor.submit(process_pair, csv_path, json_path, output_folder, output_format)
+                   for _, csv_path, json_path in pairs]
+        for (csv_file, _, _), future in zip(pairs, futures):
+            print(f"Processed {csv_file} and saved to {future.result()}")
 
 if __name__ == "__main__":
     parser = ArgumentParser(description="Parse CSV files and add a column with features extracted from JSON files.")
     parser.add_argument("--csv_folder", required=True, help="Path to the folder containing CSV files.")
     parser.add_argument("--json_folder", required=True, help="Path to the folder containing JSON files.")
     parser.add_argument("--output_folder", required=True, help="Path to the output folder for processed CSV files.")
-    
+    parser.add_argument("--workers", type=int, default=1, help="Number of file pairs processed in parallel.")
+    parser.add_argument("--format", dest="output_format", choices=["csv", "parquet"], default="csv",
+                        help="Write CSV files or the columnar reviews and features tables.")
+
     args = parser.parse_args()
-    parse_and_add_column(args.csv_folder, args.json_folder, args.output_folder)
+    parse_and_add_column(args.csv_folder, args.json_folder, args.output_folder, args.workers, args.output_format)
@@ -1,55 +1,64 @@
 import os
 import json
+import hashlib
 import argparse
 import unicodedata
 import re
+from concurrent.futures import ProcessPoolExecutor
 from lingua import Language, LanguageDetectorBuilder
 
-# Set up the Lingua language detector
-detector = LanguageDetectorBuilder.from_all_languages().build()
+# Candidate languages for detection; restricting them is much faster than from_all_languages()
+# and Lingua needs at least two of them to tell English apart
+DEFAULT_LANGUAGES = ["ENGLISH", "SPANISH", "FRENCH", "GERMAN", "ITALIAN", "PORTUGUESE"]
+MANIFEST_FILE_NAME = ".preprocessing_manifest.json"
+SPECIAL_CHARACTERS_RATIO = 0.5
+SPECIAL_CHARACTERS_PATTERN = re.compile(r'[^\w\s]')
+REMOVAL_REASONS = ["too_short", "non_english", "special_characters"]
 
-# Initialize counters for tracking removal reasons
-removal_reasons = {
-    "too_short": 0,
-    "non_english": 0,
-    "special_characters": 0
-}
+# Detector built once per worker process
+detector = None
 
-def detect_language(text):
-    language = detector.detect_language_of(text)
-    if language:
-        return str(language.iso_code_639_1).lower()  # Convert Enum to string and make it lowercase
-    return "unknown"
 
+def build_detector(languages=DEFAULT_LANGUAGES):
+    return LanguageDetectorBuilder.from_languages(*[getattr(Language, name.upper()) for name in languages]).build()
 
-def is_noisy_review(review_text):
 
-    global removal_reasons
+def init_worker(languages):
+    global detector
+    detector = build_detector(languages)
 
+
+def cheap_noise_reason(review_text):
+    """
+    Length and special character checks, run before the expensive language detection.
+    """
     # Check if review is empty or too short
     if not review_text or len(review_text.strip()) <= 3:
-        removal_reasons["too_short"] += 1
-        return True
+        return "too_short"
+
+    # Check for excessive special characters (could indicate strange encoding)
+    if len(SPECIAL_CHARACTERS_PATTERN.findall(review_text)) / len(review_text) > SPECIAL_CHARACTERS_RATIO:
+        return "special_characters"
+
+    return None
 
-    # Detect language using Lingua; mark as noisy if it's not English
+
+def detect_languages(texts):
     try:
-        language = detect_language(review_text)
-        if language != "isocode639_1.en":
-            #print(language + ": " + review_text)  # Log non-English reviews
-            removal_reasons["non_english"] += 1
-            return True
+        return detector.detect_languages_in_parallel_of(texts)
     except Exception as e:
-        # Handle potential issues with language detection
-        print(f"Error detecting language for text: {review_text[:30]}... {str(e)}")
-        removal_reasons["non_english"] += 1
-        return True
+        print(f"Error detecting languages in batch, falling back to single reviews: {str(e)}")
 
-    # Check for excessive special characters (could indicate strange encoding)
-    if len(re.findall(r'[^\w\s]', review_text)) / len(review_text) > 0.5:
-        removal_reasons["special_characters"] += 1
-        return True
+    languages = []
+    for text in texts:
+        try:
+            languages.append(detector.detect_language_of(text))
+        except Exception as e:
+            # Handle potential issues with language detection
+            print(f"Error detecting language for text: {text[:30]}... {str(e)}")
+            languages.append(None)
+    return languages
 
-    return False
 
 def normalize_review_text(text):
     if not text:
@@ -60,67 +69,147 @@ def normalize_review_text(text):
     cleaned_text = ''.join(c for c in normalized_text if c.isprintable())
     return cleaned_text
 
-def clean_reviews(reviews):
-    cleaned_reviews = []
+
+def clean_reviews(reviews, removal_reasons):
+    """
+    Return the non-noisy reviews, counting removals in removal_reasons.
+    Language detection runs once over all reviews that pass the cheap checks.
+    """
+    candidates = []
     for review in reviews:
         if "review" in review:
             # Normalize text
             review["review"] = normalize_review_text(review["review"])
-            # Check if the review is noisy
-            if not is_noisy_review(review["review"]):
-                cleaned_reviews.append(review)
+            reason = cheap_noise_reason(review["review"])
+            if reason:
+                removal_reasons[reason] += 1
+            else:
+                candidates.append(review)
+
+    languages = detect_languages([review["review"] for review in candidates])
+
+    cleaned_reviews = []
+    for review, language in zip(candidates, languages):
+        if language == Language.ENGLISH:
+            cleaned_reviews.append(review)
+        else:
+            removal_reasons["non_english"] += 1
     return cleaned_reviews
 
-def process_json_files(input_folder, output_folder):
-    global removal_reasons
 
+def process_json_file(input_file_path, output_file_path):
+    # Load JSON file
+    with open(input_file_path, 'r', encoding='utf-8') as infile:
+        data = json.load(infile)
+
+    stats = {
+        "total_reviews_before": 0,
+        "total_reviews_after": 0,
+        "removal_reasons": {reason: 0 for reason in REMOVAL_REASONS},
+    }
+
+    # Process 'reviews' subarray
+    for item in data:
+        if "reviews" in item:
+            stats["total_reviews_before"] += len(item["reviews"])
+            item["reviews"] = clean_reviews(item["reviews"], stats["removal_reasons"])
+            stats["total_reviews_after"] += len(item["reviews"])
+
+    # Save cleaned data to output folder
+    with open(output_file_path, 'w', encoding='utf-8') as outfile:
+        json.dump(data, outfile, ensure_ascii=False, indent=4)
+
+    return stats
+
+
+def file_hash(file_path, languages):
+    digest = hashlib.sha256()
+    # Changing the candidate languages changes the output, so it is part of the key
+    digest.update(",".join(sorted(name.upper() for name in languages)).encode('utf-8'))
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(output_folder):
+    manifest_path = os.path.join(output_folder, MANIFEST_FILE_NAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r', encoding='utf-8') as manifest_file:
+        return json.load(manifest_file)
+
+
+def save_manifest(output_folder, manifest):
+    manifest_path = os.path.join(output_folder, MANIFEST_FILE_NAME)
+    with open(manifest_path, 'w', encoding='utf-8') as manifest_file:
+        json.dump(manifest, manifest_file, indent=4)
+
+
+def print_stats(file_name, stats):
+    # Print traces
+    print(f"Processed file: {file_name}")
+    print(f"Total reviews before cleaning: {stats['total_reviews_before']}")
+    print(f"Total reviews after cleaning: {stats['total_reviews_after']}")
+    print("Reviews removed due to:")
+    for reason, count in stats["removal_reasons"].items():
+        print(f"  - {reason.replace('_', ' ').capitalize()}: {count}")
+    print("-" * 50)
+
+
+def process_json_files(input_folder, output_folder, languages=DEFAULT_LANGUAGES, workers=1, force=False):
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
-    for file_name in os.listdir(input_folder):
+    manifest = load_manifest(output_folder)
+    pending = []
+    for file_name in sorted(os.listdir(input_folder)):
         if file_name.endswith(".json"):
             input_file_path = os.path.join(input_folder, file_name)
             output_file_path = os.path.join(output_folder, file_name)
+            content_hash = file_hash(input_file_path, languages)
+
+            # Skip files whose input is unchanged since they were last cleaned
+            if not force and os.path.exists(output_file_path) \
+                    and manifest.get(file_name, {}).get("hash") == content_hash:
+                print(f"Skipping already cleaned file: {file_name}")
+                continue
+            pending.append((file_name, input_file_path, output_file_path, content_hash))
+
+    all_stats = {}
+    with ProcessPoolExecutor(max_workers=max(1, workers), initializer=init_worker,
+                             initargs=(languages,)) as executor:
+        futures = [executor.submit(process_json_file, input_file_path, output_file_path)
+                   for _, input_file_path, output_file_path, _ in pending]
+
+        for (file_name, _, _, content_hash), future in zip(pending, futures):
+            stats = future.result()
+            print_stats(file_name, stats)
+            manifest[file_name] = {"hash": content_hash, **stats}
+            all_stats[file_name] = stats
+            save_manifest(output_folder, manifest)
+
+    return all_stats
 
-            # Load JSON file
-            with open(input_file_path, 'r', encoding='utf-8') as infile:
-                data = json.load(infile)
-
-            # Initialize counts
-            total_reviews_before = 0
-            total_reviews_after = 0
-
-            # Reset counters for removal reasons
-            for key in removal_reasons.keys():
-                removal_reasons[key] = 0
-
-            # Process 'reviews' subarray
-            for item in data:
-                if "reviews" in item:
-                    total_reviews_before += len(item["reviews"])
-                    item["reviews"] = clean_reviews(item["reviews"])
-                    total_reviews_after += len(item["reviews"])
-
-            # Save cleaned data to output folder
-            with open(output_file_path, 'w', encoding='utf-8') as outfile:
-                json.dump(data, outfile, ensure_ascii=False, indent=4)
-
-            # Print traces
-            print(f"Processed file: {file_name}")
-            print(f"Total reviews before cleaning: {total_reviews_before}")
-            print(f"Total reviews after cleaning: {total_reviews_after}")
-            print("Reviews removed due to:")
-            for reason, count in removal_reasons.items():
-                print(f"  - {reason.replace('_', ' ').capitalize()}: {count}")
-            print("-" * 50)
 
 def main():
     parser = argparse.ArgumentParser(description="Clean noisy reviews and normalize encoding in JSON files.")
     parser.add_argument("input_folder", type=str, help="Path to the input folder containing JSON files.")
     parser.add_argument("output_folder", type=str, help="Path to the output folder for cleaned JSON files.")
+    parser.add_argument("--languages", type=str, default=",".join(DEFAULT_LANGUAGES),
+                        help="Comma-separated candidate languages for detection (at least two, including English).")
+    parser.add_argument("--workers", type=int, default=1, help="Number of files processed in parallel.")
+    parser.add_argument("--force", action="store_true", help="Clean all files even if their input is unchanged.")
     args = parser.parse_args()
 
-    process_json_files(args.input_folder, args.output_folder)
+    languages = [name.strip().upper() for name in args.languages.split(",") if name.strip()]
+    if "ENGLISH" not in languages:
+        parser.error("--languages must include ENGLISH")
+    unknown = [name for name in languages if not hasattr(Language, name)]
+    if unknown:
+        parser.error(f"Unknown languages: {', '.join(unknown)}")
+
+    process_json_files(args.input_folder, args.output_folder, languages, args.workers, args.force)
 
 if __name__ == "__main__":
     main()
@@ -2,197 +2,256 @@ import argparse
 import pandas as pd
 import os
 import re
+import json
+import hashlib
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 import spacy
+import matplotlib
+# Headless backend, heatmaps are rendered in worker processes
+matplotlib.use('Agg')
 import seaborn as sns
 import matplotlib.pyplot as plt
 import numpy as np
+from scipy.sparse import csr_matrix
+from columnar_format import is_reviews_file, read_features, REVIEWS_SUFFIX
+
+VERB_TAGS = {'VERB', 'AUX'}
+NOUN_TAGS = {'NOUN', 'PROPN'}
+MANIFEST_FILE_NAME = '.statistics_manifest.json'
 
 def parse_pascal_case(text):
     """Convert PascalCase to space-separated lowercase words"""
     return re.sub(r'(?<!^)(?=[A-Z])', ' ', text).lower()
 
-def process_files(input_folder, output_folder, top_n):
+def read_csv_features(input_path):
+    """Return the flattened features of a CSV file and the features of each category"""
+    df = pd.read_csv(input_path)
+
+    # Extract and flatten features
+    all_features = []
+    for cell in df['extracted_features_TransFeatEx'].dropna():
+        features = cell.split(';')
+        all_features.extend(features)
+
+    features_by_category = {}
+    for category, group in df.groupby('app_categoryId'):
+        features_by_category[category] = []
+        for cell in group['extracted_features_TransFeatEx'].dropna():
+            features_by_category[category].extend(cell.split(';'))
+
+    return all_features, features_by_category
+
+def read_columnar_features(input_path):
+    """Same as read_csv_features, scanning the exploded features table of a Parquet file"""
+    features = read_features(input_path, columns=['app_categoryId', 'feature']).to_pandas()
+    all_features = features['feature'].tolist()
+    features_by_category = {category: group['feature'].tolist()
+                            for category, group in features.groupby('app_categoryId', observed=True)}
+    return all_features, features_by_category
+
+def count_parsed_features(features):
+    """Count features after parsing them from PascalCase, parsing each distinct string once"""
+    parsed_counts = Counter()
+    for feature, count in Counter(features).items():
+        parsed_counts[parse_pascal_case(feature)] += count
+    return parsed_counts
+
+class FeatureTagger:
+    """POS tags each distinct feature once, the tags are shared by every file and category"""
+
+    def __init__(self, nlp, batch_size=256):
+        self.nlp = nlp
+        self.batch_size = batch_size
+        self.cache = {}
+
+    def tag(self, features):
+        """Return the (verbs, nouns) tokens of each feature"""
+        pending = [feature for feature in features if feature not in self.cache]
+        for feature, doc in zip(pending, self.nlp.pipe(pending, batch_size=self.batch_size)):
+            self.cache[feature] = ([token.text for token in doc if token.pos_ in VERB_TAGS],
+                                   [token.text for token in doc if token.pos_ in NOUN_TAGS])
+        return [self.cache[feature] for feature in features]
+
+def token_matrix(token_lists):
+    """Sparse feature x token count matrix, tokens numbered by first appearance"""
+    vocabulary = {}
+    rows, cols = [], []
+    for row, tokens in enumerate(token_lists):
+        for token in tokens:
+            cols.append(vocabulary.setdefault(token, len(vocabulary)))
+            rows.append(row)
+    matrix = csr_matrix((np.ones(len(rows), dtype=np.int64), (rows, cols)),
+                        shape=(len(token_lists), len(vocabulary)))
+    return matrix, list(vocabulary)
+
+def top_tokens(matrix, counts, top_n):
+    """Columns of the top_n most frequent tokens, ties kept in order of first appearance like Counter.most_common"""
+    totals = matrix.T @ counts
+    return np.argsort(-totals, kind='stable')[:top_n]
+
+def compute_statistics(feature_counts, tagger, top_n):
+    """
+    Build the feature statistics and the verb-noun co-occurrence matrix from feature counts.
+    Every occurrence of a feature contributes one pair per (verb, noun) in it, so the matrix is
+    verbs^T @ diag(counts) @ nouns over the distinct features.
+    """
+    features = list(feature_counts.keys())
+    counts = np.array(list(feature_counts.values()), dtype=np.int64)
+
+    # Create statistics
+    stats_df = pd.DataFrame({
+        'feature': features,
+        'count': counts
+    }).sort_values('count', ascending=False)
+
+    tags = tagger.tag(features)
+    verbs, verb_vocabulary = token_matrix([feature_verbs for feature_verbs, _ in tags])
+    nouns, noun_vocabulary = token_matrix([feature_nouns for _, feature_nouns in tags])
+
+    # Get top N most common verbs and nouns
+    verb_columns = top_tokens(verbs, counts, top_n)
+    noun_columns = top_tokens(nouns, counts, top_n)
+
+    weighted_nouns = csr_matrix(nouns[:, noun_columns].multiply(counts[:, None]))
+    co_occurrences = (verbs[:, verb_columns].T @ weighted_nouns).toarray()
+
+    heatmap_data = pd.DataFrame(co_occurrences,
+                                index=[verb_vocabulary[i] for i in verb_columns],
+                                columns=[noun_vocabulary[i] for i in noun_columns])
+    return stats_df, heatmap_data
+
+def render_heatmap(heatmap_data, title, heatmap_output, dpi=None):
+    """Render one heatmap, run in the worker processes with the headless Agg backend"""
+    # Apply log1p transformation (log(1+x)) to the data
+    heatmap_data_log = np.log1p(heatmap_data)
+
+    # Create and save heatmap with transformed data
+    fig = plt.figure(figsize=(15, 10))
+    sns.heatmap(heatmap_data_log, cmap='YlOrRd')
+    plt.title(title)
+    plt.tight_layout()
+
+    fig.savefig(heatmap_output, dpi=dpi or 'figure')
+    plt.close(fig)
+    return heatmap_output
+
+def heatmap_hash(heatmap_data, title, dpi):
+    """Hash of everything that determines the rendered heatmap"""
+    digest = hashlib.sha256()
+    digest.update(f"{title}|{dpi}".encode('utf-8'))
+    digest.update(heatmap_data.to_csv().encode('utf-8'))
+    return digest.hexdigest()
+
+def load_manifest(output_folder):
+    manifest_path = os.path.join(output_folder, MANIFEST_FILE_NAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r', encoding='utf-8') as manifest_file:
+        return json.load(manifest_file)
+
+def save_manifest(output_folder, manifest):
+    with open(os.path.join(output_folder, MANIFEST_FILE_NAME), 'w', encoding='utf-8') as manifest_file:
+        json.dump(manifest, manifest_file, indent=4)
+
+class ReportWriter:
+    """
+    Writes the statistics right away and renders heatmaps in a process pool.
+    Heatmaps whose data, title and options are unchanged since the last run are not rendered again.
+    """
+
+    def __init__(self, output_folder, render=True, image_format='png', dpi=None, workers=1, force=False):
+        self.output_folder = output_folder
+        self.render = render
+        self.image_format = image_format
+        self.dpi = dpi
+        self.force = force
+        self.manifest = load_manifest(output_folder)
+        self.executor = ProcessPoolExecutor(max_workers=max(1, workers)) if render else None
+        self.pending = []
+        self.skipped = 0
+
+    def write(self, stats_df, heatmap_data, title, output_name):
+        stats_df.to_csv(os.path.join(self.output_folder, f"{output_name}_statistics.csv"), index=False)
+        if not self.render:
+            return
+
+        heatmap_file = f"{output_name}_heatmap.{self.image_format}"
+        heatmap_output = os.path.join(self.output_folder, heatmap_file)
+        input_hash = heatmap_hash(heatmap_data, title, self.dpi)
+        if not self.force and os.path.exists(heatmap_output) and self.manifest.get(heatmap_file) == input_hash:
+            self.skipped += 1
+            return
+
+        future = self.executor.submit(render_heatmap, heatmap_data, title, heatmap_output, self.dpi)
+        self.pending.append((heatmap_file, input_hash, future))
+
+    def close(self):
+        if self.executor is None:
+            return
+        for heatmap_file, input_hash, future in self.pending:
+            future.result()
+            self.manifest[heatmap_file] = input_hash
+        self.executor.shutdown()
+        save_manifest(self.output_folder, self.manifest)
+        print(f"Rendered {len(self.pending)} heatmaps, {self.skipped} unchanged")
+
+def process_files(input_folder, output_folder, top_n, render=True, image_format='png', dpi=None, workers=1,
+                  force=False):
     # Load spaCy English model
-    nlp = spacy.load('en_core_web_sm')
-    
+    tagger = FeatureTagger(spacy.load('en_core_web_sm'))
+
     # Create output folder if it doesn't exist
     os.makedirs(output_folder, exist_ok=True)
-    
-    # Dictionary to store features by category
-    category_features = {}
-    
-    # Process each CSV file in the input folder
+    reports = ReportWriter(output_folder, render, image_format, dpi, workers, force)
+
+    # Feature counts by category, accumulated from the same pass over the files
+    category_counts = {}
+
+    # Process each CSV or columnar file in the input folder
     for filename in os.listdir(input_folder):
-        if not filename.endswith('.csv'):
-            continue
-            
         input_path = os.path.join(input_folder, filename)
-        base_name = os.path.splitext(filename)[0]
-        
-        # Read CSV file
-        df = pd.read_csv(input_path)
-        
-        # Extract and flatten features
-        all_features = []
-        for cell in df['extracted_features_TransFeatEx'].dropna():
-            features = cell.split(';')
-            all_features.extend(features)
-            
-        # Parse features from PascalCase
-        parsed_features = [parse_pascal_case(f) for f in all_features]
-        
-        # Create statistics
-        feature_counts = Counter(parsed_features)
-        stats_df = pd.DataFrame({
-            'feature': list(feature_counts.keys()),
-            'count': list(feature_counts.values())
-        }).sort_values('count', ascending=False)
-        
-        # Save individual file statistics
-        stats_output = os.path.join(output_folder, f"{base_name}_statistics.csv")
-        stats_df.to_csv(stats_output, index=False)
-        
-        # Process with spaCy for POS tagging
-        pos_data = []
-        for feature in parsed_features:
-            doc = nlp(feature)
-            pos_data.extend([(token.text, token.pos_) for token in doc])
-            
-        # Extract verbs and nouns
-        verb_tags = {'VERB', 'AUX'}
-        noun_tags = {'NOUN', 'PROPN'}
-        
-        verbs = [word for word, pos in pos_data if pos in verb_tags]
-        nouns = [word for word, pos in pos_data if pos in noun_tags]
-        
-        # Get top N most common verbs and nouns
-        top_verbs = Counter(verbs).most_common(top_n)
-        top_nouns = Counter(nouns).most_common(top_n)
-        
-        # Create cross-tabulation matrix
-        matrix_data = []
-        for feature in parsed_features:
-            doc = nlp(feature)
-            feature_verbs = [token.text for token in doc if token.pos_ in verb_tags]
-            feature_nouns = [token.text for token in doc if token.pos_ in noun_tags]
-            
-            for verb in feature_verbs:
-                for noun in feature_nouns:
-                    matrix_data.append((verb, noun))
-        
-        # Create heatmap matrix
-        verb_dict = dict(top_verbs)
-        noun_dict = dict(top_nouns)
-        
-        heatmap_data = pd.DataFrame(0, 
-                                  index=verb_dict.keys(),
-                                  columns=noun_dict.keys())
-        
-        for verb, noun in matrix_data:
-            if verb in verb_dict and noun in noun_dict:
-                heatmap_data.loc[verb, noun] += 1
-        
-        # Apply log1p transformation (log(1+x)) to the data
-        heatmap_data_log = np.log1p(heatmap_data)
-        
-        # Create and save heatmap with transformed data
-        plt.figure(figsize=(15, 10))
-        sns.heatmap(heatmap_data_log, cmap='YlOrRd')
-        plt.title(f'Verb-Noun Heatmap for {base_name} (log scale)')
-        plt.tight_layout()
-        
-        heatmap_output = os.path.join(output_folder, f"{base_name}_heatmap.png")
-        plt.savefig(heatmap_output)
-        plt.close()
-        
+        if filename.endswith('.csv'):
+            base_name = os.path.splitext(filename)[0]
+            all_features, features_by_category = read_csv_features(input_path)
+        elif is_reviews_file(filename):
+            base_name = filename[:-len(REVIEWS_SUFFIX)]
+            all_features, features_by_category = read_columnar_features(input_path)
+        else:
+            continue
+
+        stats_df, heatmap_data = compute_statistics(count_parsed_features(all_features), tagger, top_n)
+        reports.write(stats_df, heatmap_data, f'Verb-Noun Heatmap for {base_name} (log scale)', base_name)
+
         # Group features by category
-        for category, group in df.groupby('app_categoryId'):
-            if category not in category_features:
-                category_features[category] = []
-                
-            # Extract and flatten features for this category
-            for cell in group['extracted_features_TransFeatEx'].dropna():
-                features = cell.split(';')
-                category_features[category].extend(features)
-    
+        for category, features in features_by_category.items():
+            category_counts.setdefault(category, Counter()).update(count_parsed_features(features))
+
     # Process each category's features
-    for category, features in category_features.items():
-        # Parse features from PascalCase
-        parsed_features = [parse_pascal_case(f) for f in features]
-        
-        # Create statistics
-        feature_counts = Counter(parsed_features)
-        stats_df = pd.DataFrame({
-            'feature': list(feature_counts.keys()),
-            'count': list(feature_counts.values())
-        }).sort_values('count', ascending=False)
-        
-        # Save category statistics
-        stats_output = os.path.join(output_folder, f"category_{category}_statistics.csv")
-        stats_df.to_csv(stats_output, index=False)
-        
-        # Process with spaCy for POS tagging
-        pos_data = []
-        for feature in parsed_features:
-            doc = nlp(feature)
-            pos_data.extend([(token.text, token.pos_) for token in doc])
-            
-        # Extract verbs and nouns
-        verb_tags = {'VERB', 'AUX'}
-        noun_tags = {'NOUN', 'PROPN'}
-        
-        verbs = [word for word, pos in pos_data if pos in verb_tags]
-        nouns = [word for word, pos in pos_data if pos in noun_tags]
-        
-        # Get top N most common verbs and nouns
-        top_verbs = Counter(verbs).most_common(top_n)
-        top_nouns = Counter(nouns).most_common(top_n)
-        
-        # Create cross-tabulation matrix
-        matrix_data = []
-        for feature in parsed_features:
-            doc = nlp(feature)
-            feature_verbs = [token.text for token in doc if token.pos_ in verb_tags]
-            feature_nouns = [token.text for token in doc if token.pos_ in noun_tags]
-            
-            for verb in feature_verbs:
-                for noun in feature_nouns:
-                    matrix_data.append((verb, noun))
-        
-        # Create heatmap matrix
-        verb_dict = dict(top_verbs)
-        noun_dict = dict(top_nouns)
-        
-        heatmap_data = pd.DataFrame(0, 
-                                  index=verb_dict.keys(),
-                                  columns=noun_dict.keys())
-        
-        for verb, noun in matrix_data:
-            if verb in verb_dict and noun in noun_dict:
-                heatmap_data.loc[verb, noun] += 1
-        
-        # Apply log1p transformation (log(1+x)) to the data
-        heatmap_data_log = np.log1p(heatmap_data)
-        
-        # Create and save heatmap with transformed data
-        plt.figure(figsize=(15, 10))
-        sns.heatmap(heatmap_data_log, cmap='YlOrRd')
-        plt.title(f'Verb-Noun Heatmap for Category {category} (log scale)')
-        plt.tight_layout()
-        
-        heatmap_output = os.path.join(output_folder, f"category_{category}_heatmap.png")
-        plt.savefig(heatmap_output)
-        plt.close()
+    for category, feature_counts in category_counts.items():
+        stats_df, heatmap_data = compute_statistics(feature_counts, tagger, top_n)
+        reports.write(stats_df, heatmap_data, f'Verb-Noun Heatmap for Category {category} (log scale)',
+                      f"category_{category}")
+
+    reports.close()
+    print(f"Tagged {len(tagger.cache)} distinct features")
 
 def main():
     parser = argparse.ArgumentParser(description='Process feature extraction files')
-    parser.add_argument('--input_folder', required=True, help='Input folder containing CSV files')
+    parser.add_argument('--input_folder', required=True, help='Input folder containing CSV or Parquet files')
     parser.add_argument('--output_folder', required=True, help='Output folder for statistics and heatmaps')
     parser.add_argument('--top_n', type=int, default=50, help='Number of top verbs and nouns to extract')
-    
+    parser.add_argument('--format', dest='image_format', choices=['png', 'svg'], default='png',
+                        help='Image format of the heatmaps')
+    parser.add_argument('--dpi', type=int, default=None, help='Resolution of PNG heatmaps (matplotlib default if omitted)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes rendering heatmaps')
+    parser.add_argument('--no-render', dest='render', action='store_false',
+                        help='Only write the statistics CSV files, without heatmaps')
+    parser.add_argument('--force', action='store_true', help='Render every heatmap even if its data is unchanged')
+
     args = parser.parse_args()
-    process_files(args.input_folder, args.output_folder, args.top_n)
+    process_files(args.input_folder, args.output_folder, args.top_n, args.render, args.image_format, args.dpi,
+                  args.workers, args.force)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,55 @@
+import json
+import time
+import random
+import argparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Local stand-in for the TransFeatEx service to exercise feature_extraction_transfeatex.py
+
+
+def analyze(app_data):
+    analyzed_reviews = []
+    for app in app_data:
+        for review in app.get('reviews', []):
+            words = (review.get('review') or '').split()
+            analyzed_reviews.append({
+                'reviewId': review.get('reviewId'),
+                'review': review.get('review'),
+                'sentences': [{'featureData': {'feature': ''.join(word.capitalize() for word in words[:2])}}],
+            })
+    return {'analyzed_reviews': analyzed_reviews}
+
+
+def make_handler(delay, failure_rate):
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            time.sleep(delay)
+            if random.random() < failure_rate:
+                self.send_response(503)
+                self.end_headers()
+                return
+
+            response = json.dumps(analyze(json.loads(body))).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubHandler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a stub TransFeatEx extraction endpoint.")
+    parser.add_argument("--port", type=int, default=3004, help="Port to listen on.")
+    parser.add_argument("--delay", type=float, default=0.1, help="Seconds to wait before answering each request.")
+    parser.add_argument("--failure_rate", type=float, default=0.0, help="Fraction of requests answered with 503.")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(args.delay, args.failure_rate))
+    print(f"Stub TransFeatEx listening on http://127.0.0.1:{args.port}")
+    server.serve_forever()
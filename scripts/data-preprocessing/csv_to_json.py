@@ -1,44 +1,119 @@
 import sys
-import csv
 import argparse
-import re
 import json
 import os
-from collections import Counter, defaultdict
+import pandas as pd
 from datetime import datetime
 
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+DATE_FORMAT = '%a %b %d %H:%M:%S %Y'
+WINDOW_FREQUENCIES = {'monthly': 'M', 'quarterly': 'Q'}
+
 def read_csv(file_path):
-    data = []
     try:
-        with open(file_path, 'r', newline='', encoding='utf-8') as csvfile:
-            csv_reader = csv.DictReader(csvfile)
-            for row in csv_reader:
-                data.append(row)
-        return data
+        # Keep every field as a string, like csv.DictReader did
+        df = pd.read_csv(file_path, dtype=str, keep_default_na=False)
     except FileNotFoundError:
         print(f"Error: File '{file_path}' not found.")
         sys.exit(1)
-    except csv.Error as e:
+    except (pd.errors.ParserError, UnicodeDecodeError) as e:
         print(f"Error reading CSV file: {e}")
         sys.exit(1)
 
-def parse_date(date_string):
-    # Remove the timezone part (e.g., 'CET')
-    date_string_without_tz = ' '.join(date_string.split()[:-2]) + ' ' + date_string.split()[-1]
-    return datetime.strptime(date_string_without_tz, '%a %b %d %H:%M:%S %Y')
+    if 'TransFeatExFeatures' in df.columns:
+        df['features'] = df.pop('TransFeatExFeatures').str.split('; ')
+    return df
+
+def read_parquet(file_path):
+    # Columnar Stage 1 reviews table, features are already a list per review
+    if pq is None:
+        print("Error: reading Parquet files requires the pyarrow package.")
+        sys.exit(1)
+    try:
+        table = pq.read_table(file_path, memory_map=True)
+    except FileNotFoundError:
+        print(f"Error: File '{file_path}' not found.")
+        sys.exit(1)
+
+    date_column = 'Date' if 'Date' in table.column_names else 'at'
+    app_column = 'ApplicationId' if 'ApplicationId' in table.column_names else 'app_package'
+    return pd.DataFrame({
+        'Date': table[date_column].to_pandas(),
+        'ApplicationId': table[app_column].to_pandas().astype(object),
+        'features': table['features'].to_pandas(),
+    })
+
+def parse_dates(date_strings):
+    # Remove the timezone part (e.g., 'CET'), the second to last token
+    without_tz = date_strings.str.replace(r'\s+\S+\s+(\S+)\s*$', r' \1', regex=True).str.strip()
+    return pd.to_datetime(without_tz, format=DATE_FORMAT)
+
+def explode_features(df):
+    """One row per non-empty processed feature, in review order"""
+    columns = ['features'] + (['window'] if 'window' in df.columns else []) \
+        + (['ApplicationId'] if 'ApplicationId' in df.columns else [])
+    exploded = df[columns].explode('features')
+    features = exploded['features'].str.findall(r'[A-Z][a-z]*').str.join(' ').str.lower()
+    # Remove empty features
+    keep = features.notna() & (features.str.strip() != '')
+    return exploded[keep].assign(feature=features[keep]).drop(columns='features')
+
+def frequent_features(feature_counts, min_occurrences):
+    # Sort features by frequency (ties in order of first mention) and limit to those with at least min_occurrences
+    sorted_counts = feature_counts.sort_values(ascending=False, kind='stable')
+    return sorted_counts[sorted_counts >= min_occurrences]
 
+def write_features(output_file, features):
+    with open(output_file, 'w', encoding='utf-8') as jsonfile:
+        json.dump(list(features.index), jsonfile, indent=4)
 
-def format_date(date):
-    return date.strftime('%Y-%m-%d')
+def save_window(output_folder, output_name, counts, min_occurrences, has_apps):
+    """Write the global and per-app feature lists from the (app, feature) counts of one window"""
+    os.makedirs(output_folder, exist_ok=True)
+    output_file_path = os.path.join(output_folder, output_name)
+
+    global_features = frequent_features(counts.groupby(level='feature', sort=False).sum(), min_occurrences)
+
+    print(f"\nNumber of features with at least {min_occurrences} mentions: {len(global_features)}")
+    print("Sample of frequent features:")
+    for feature, count in global_features.head(20).items():  # Print first 20 frequent features as a sample
+        print(f"{feature}: {count} mentions")
+
+    # Save frequent features as JSON array
+    try:
+        write_features(output_file_path, global_features)
+        print(f"\nSuccessfully saved {len(global_features)} features to {output_file_path}")
+    except IOError as e:
+        print(f"Error writing to JSON file: {e}")
+        sys.exit(1)
+
+    if not has_apps:
+        return
+
+    # Save features for each ApplicationId
+    for app_id, app_counts in counts.groupby(level='ApplicationId', sort=False, dropna=False):
+        app_features = frequent_features(app_counts.droplevel('ApplicationId'), min_occurrences)
+        app_output_file = os.path.join(output_folder, f"{os.path.splitext(output_name)[0]}_{app_id}.json")
+        try:
+            write_features(app_output_file, app_features)
+            print(f"\nSuccessfully saved {len(app_features)} features for {app_id} to {app_output_file}")
+        except IOError as e:
+            print(f"Error writing to JSON file for {app_id}: {e}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Read a CSV file and filter features")
-    parser.add_argument("-i", "--input", required=True, help="Path to the input CSV file")
+    parser.add_argument("-i", "--input", required=True, help="Path to the input CSV or Parquet file")
     parser.add_argument("-o", "--output", required=True, help="Path to the output JSON file")
     parser.add_argument("--from", dest="from_date", help="Start date (YYYY-MM-DD)")
     parser.add_argument("--to", dest="to_date", help="End date (YYYY-MM-DD)")
     parser.add_argument("-n", "--min-occurrences", type=int, default=1, help="Minimum number of occurrences of a feature to be included")
-    
+    parser.add_argument("--windows", choices=list(WINDOW_FREQUENCIES),
+                        help="Also split the date range into monthly or quarterly windows, one subfolder each")
+
     args = parser.parse_args()
 
     csv_file_path = args.input
@@ -47,84 +122,49 @@ if __name__ == "__main__":
     to_date = datetime.strptime(args.to_date, '%Y-%m-%d') if args.to_date else None
     min_occurrences = args.min_occurrences
 
-    csv_data = read_csv(csv_file_path)
-    
-    # Filter data based on date range
-    filtered_data = []
-    for row in csv_data:
-        if 'Date' in row:
-            review_date = parse_date(row['Date'])
-            if (from_date is None or review_date >= from_date) and (to_date is None or review_date <= to_date):
-                filtered_data.append(row)
+    df = read_parquet(csv_file_path) if csv_file_path.endswith('.parquet') else read_csv(csv_file_path)
 
-    print(f"Successfully read {len(filtered_data)} rows from {csv_file_path} within the specified date range")
+    # Filter data based on date range
+    if 'Date' in df.columns:
+        df = df[df['Date'].notna() & (df['Date'] != '')]
+        dates = parse_dates(df['Date'])
+        in_range = pd.Series(True, index=df.index)
+        if from_date is not None:
+            in_range &= dates >= from_date
+        if to_date is not None:
+            in_range &= dates <= to_date
+        df = df[in_range]
+        dates = dates[in_range]
+    else:
+        df = df.iloc[0:0]
+        dates = pd.Series([], dtype='datetime64[ns]')
+
+    print(f"Successfully read {len(df)} rows from {csv_file_path} within the specified date range")
+
+    if 'features' not in df.columns:
+        df = df.assign(features=[[] for _ in range(len(df))])
+    has_apps = 'ApplicationId' in df.columns
+    if not has_apps:
+        df = df.assign(ApplicationId=None)
+    if args.windows:
+        df = df.assign(window=dates.dt.to_period(WINDOW_FREQUENCIES[args.windows]))
+
+    # Count every (window, app, feature) in a single groupby over the exploded features
+    features = explode_features(df)
+    keys = (['window'] if args.windows else []) + ['ApplicationId', 'feature']
+    counts = features.groupby(keys, sort=False, dropna=False).size()
 
     # Create subfolder with date interval
+    output_name = os.path.basename(output_file_path)
     date_interval = f"{args.from_date or 'start'}_{args.to_date or 'end'}"
     output_folder = os.path.join(os.path.dirname(output_file_path), date_interval)
-    os.makedirs(output_folder, exist_ok=True)
-
-    # Update output_file_path to use the new subfolder
-    output_file_path = os.path.join(output_folder, os.path.basename(output_file_path))
-
-    # Process TransFeatExFeatures
-    transfeatex_features = []
-    for row in filtered_data:
-        if 'TransFeatExFeatures' in row:
-            features = row['TransFeatExFeatures'].split('; ')
-            transfeatex_features.extend(features)
-
-    features = [' '.join(re.findall(r'[A-Z][a-z]*', feature)) for feature in transfeatex_features if feature]
-    features = [feature.lower() for feature in features]
-    # Remove empty features
-    features = [feature for feature in features if feature.strip()]
-
-    # Sort features by frequency and limit to those with at least min_occurrences
-    feature_counts = Counter(features)
-    sorted_features = sorted(feature_counts.items(), key=lambda x: x[1], reverse=True)
-    frequent_features = [feature for feature, count in sorted_features if count >= min_occurrences]
-
-    print(f"\nNumber of features with at least {min_occurrences} mentions: {len(frequent_features)}")
-    print("Sample of frequent features:")
-    for feature in frequent_features[:20]:  # Print first 20 frequent features as a sample
-        print(f"{feature}: {feature_counts[feature]} mentions")
-   
-    # Save frequent features as JSON array
-    try:
-        with open(output_file_path, 'w', encoding='utf-8') as jsonfile:
-            json.dump([feature for feature in frequent_features], jsonfile, indent=4)
-        print(f"\nSuccessfully saved {len(frequent_features)} features to {output_file_path}")
-    except IOError as e:
-        print(f"Error writing to JSON file: {e}")
-        sys.exit(1)
-        
-    # Group features by ApplicationId
-    app_features = defaultdict(list)
-    for row in filtered_data:
-        if 'TransFeatExFeatures' in row and 'ApplicationId' in row:
-            app_id = row['ApplicationId']
-            features = row['TransFeatExFeatures'].split('; ')
-            app_features[app_id].extend(features)
-
-    # Process and save features for each ApplicationId
-    for app_id, features in app_features.items():
-        # Process features
-        processed_features = [' '.join(re.findall(r'[A-Z][a-z]*', feature)) for feature in features if feature]
-        processed_features = [feature.lower() for feature in processed_features]
-        processed_features = [feature for feature in processed_features if feature.strip()]
-
-        # Count and sort features
-        feature_counts = Counter(processed_features)
-        sorted_features = sorted(feature_counts.items(), key=lambda x: x[1], reverse=True)
-        frequent_features = [feature for feature, count in sorted_features if count >= min_occurrences]
-
-        # Create output file name
-        app_output_file = os.path.join(output_folder, f"{os.path.splitext(os.path.basename(output_file_path))[0]}_{app_id}.json")
-
-        # Save frequent features as JSON array
-        try:
-            with open(app_output_file, 'w', encoding='utf-8') as jsonfile:
-                json.dump([feature for feature in frequent_features], jsonfile, indent=4)
-            print(f"\nSuccessfully saved {len(frequent_features)} features for {app_id} to {app_output_file}")
-        except IOError as e:
-            print(f"Error writing to JSON file for {app_id}: {e}")
+    save_window(output_folder, output_name,
+                counts.groupby(level=['ApplicationId', 'feature'], sort=False, dropna=False).sum() if args.windows else counts,
+                min_occurrences, has_apps)
+
+    if args.windows:
+        for window in sorted(counts.index.get_level_values('window').unique()):
+            window_interval = f"{window.start_time:%Y-%m-%d}_{window.end_time:%Y-%m-%d}"
+            print(f"\nWindow {window_interval}")
+            save_window(os.path.join(os.path.dirname(output_file_path), window_interval), output_name,
+                        counts.xs(window, level='window'), min_occurrences, has_apps)
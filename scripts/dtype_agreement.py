@@ -0,0 +1,65 @@
+import os
+import sys
+import argparse
+import joblib
+import numpy as np
+from scipy.spatial.distance import squareform
+from sklearn.metrics import adjusted_rand_score
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from backend.utils import Utils
+from backend.Affinity_strategy import cluster_embeddings, uses_precomputed_distances
+
+# Check that the float32 pipeline, and optionally float16 storage, keep the clusters of a float64 run.
+# The baseline artifact must come from a float64 run:
+#   DG_EMBEDDING_DTYPE=float64 DG_STORAGE_DTYPE=float64
+# Exits with 1 when an adjusted rand index is below --min-ari.
+
+
+def cluster_assignments(data_points, linkage, threshold, metric, dtype):
+    """Labels of the artifact's clustering run with distances computed in dtype."""
+    data = Utils.to_embedding_dtype(data_points, dtype)
+    distance_matrix = None
+    if uses_precomputed_distances(linkage, len(data)):
+        distance_matrix = squareform(Utils.condensed_distances(data, metric, dtype=dtype))
+    return cluster_embeddings(data, linkage, threshold, metric, distance_matrix=distance_matrix).labels_
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that lower precision pipelines keep the float64 clusters.")
+    parser.add_argument("pkl_file", help="Path to a Stage 2 clustering artifact generated in float64")
+    parser.add_argument("--storage", action='append', choices=['float32', 'float16'],
+                        help="Storage dtypes to check on top of float32 computation (default: float32)")
+    parser.add_argument("--min-ari", type=float, default=1.0,
+                        help="Lowest adjusted rand index accepted against the float64 baseline")
+    args = parser.parse_args()
+
+    model_info = joblib.load(args.pkl_file)
+    if model_info.get('storage_dtype') != 'float64':
+        print(f"{args.pkl_file} stores {model_info.get('storage_dtype')} embeddings, generate the baseline with "
+              f"DG_EMBEDDING_DTYPE=float64 DG_STORAGE_DTYPE=float64")
+        return 2
+
+    data_points = np.asarray(model_info['data_points'])
+    metric, linkage = model_info['affinity'].split()[-2:]
+    threshold = model_info['distance_threshold']
+
+    baseline = cluster_assignments(data_points, linkage, threshold, metric, np.float64)
+    print(f"float64 baseline: {len(set(baseline))} clusters over {len(baseline)} features")
+
+    failed = False
+    for storage_dtype in args.storage or ['float32']:
+        # The float32 pipeline embeds in float32, stores in storage_dtype and computes distances in float32
+        stored = data_points.astype(np.float32).astype(storage_dtype)
+        assignments = cluster_assignments(stored, linkage, threshold, metric, np.float32)
+        agreement = adjusted_rand_score(baseline, assignments)
+        passed = agreement >= args.min_ari
+        failed = failed or not passed
+        print(f"float32 with {storage_dtype} storage: {len(set(assignments))} clusters, "
+              f"adjusted rand index {agreement:.4f} {'ok' if passed else 'FAILED'}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+import os
+import sys
+import json
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from backend.onnx_inference import ONNX_MODELS, export_model, cosine_agreement_report
+
+
+def load_features(input_file, limit):
+    with open(input_file, 'r', encoding='utf-8') as file:
+        data = json.load(file)
+
+    # Accept both a plain feature list and a TransFeatEx 'analyzed_reviews' payload
+    if isinstance(data, dict):
+        data = [sentence.get('featureData', {}).get('feature')
+                for review in data.get('analyzed_reviews', [])
+                for sentence in review.get('sentences', [])]
+    features = [feature for feature in data if feature]
+    return features[:limit] if limit else features
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export embedding models to ONNX and validate them against PyTorch.")
+    parser.add_argument("--model", choices=list(ONNX_MODELS), action='append',
+                        help="Model to export (default: all)")
+    parser.add_argument("--quantize", action='store_true', help="Also export a dynamic int8 quantized model")
+    parser.add_argument("--input", help="JSON file with features used for the cosine-agreement report")
+    parser.add_argument("--limit", type=int, default=1000, help="Maximum number of features to validate with")
+    parser.add_argument("--output", help="Path to save the validation report as JSON")
+    args = parser.parse_args()
+
+    model_keys = args.model or list(ONNX_MODELS)
+    reports = []
+    for model_key in model_keys:
+        print(f"Exported {model_key} to {export_model(model_key)}")
+        if args.quantize:
+            print(f"Exported {model_key} to {export_model(model_key, quantize=True)}")
+
+        if args.input:
+            features = load_features(args.input, args.limit)
+            for quantize in ([False, True] if args.quantize else [False]):
+                report = cosine_agreement_report(model_key, features, quantize=quantize)
+                reports.append(report)
+                print(json.dumps(report, indent=4))
+
+    if args.output and reports:
+        with open(args.output, 'w') as output_file:
+            json.dump(reports, output_file, indent=4)
+        print(f"Validation report saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
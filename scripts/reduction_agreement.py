@@ -0,0 +1,55 @@
+import os
+import sys
+import json
+import argparse
+import joblib
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from backend.Affinity_strategy import cluster_embeddings
+from backend.dimensionality_reduction import check_reduction, parse_target, reduction_agreement_report
+
+# Compare the clusters of a Stage 2 artifact with those obtained after reducing its embeddings
+
+DEFAULT_REDUCTIONS = ['pca:0.9', 'pca:0.95', 'pca:128', 'svd:128', 'random:128']
+
+
+def parse_reduction(value):
+    method, _, target = value.partition(':')
+    return {'method': check_reduction(method), 'target': parse_target(target)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check how much dimensionality reduction changes the clusters.")
+    parser.add_argument("pkl_file", help="Path to a Stage 2 clustering artifact")
+    parser.add_argument("--reduction", action='append',
+                        help="method:target to compare, e.g. pca:0.95 or random:128 (default: "
+                             f"{', '.join(DEFAULT_REDUCTIONS)})")
+    parser.add_argument("--output", help="Path to save the report as JSON")
+    args = parser.parse_args()
+
+    model_info = joblib.load(args.pkl_file)
+    # The full embeddings are kept even when the artifact itself was clustered on reduced ones
+    data_points = np.asarray(model_info['data_points'], dtype=np.float32)
+    metric, linkage = model_info['affinity'].split()[-2:]
+    threshold = model_info['distance_threshold']
+
+    def cluster(dense_data_array):
+        return cluster_embeddings(dense_data_array, linkage, threshold, metric)
+
+    reductions = [parse_reduction(value) for value in args.reduction or DEFAULT_REDUCTIONS]
+    reports = reduction_agreement_report(data_points, cluster, reductions)
+    for report in reports:
+        print(f"{report['method']} {report['target']}: {report['input_dimension']} -> {report['n_components']} "
+              f"dimensions, {report['n_clusters']} clusters (baseline {report['baseline_n_clusters']}), "
+              f"adjusted rand index {report['adjusted_rand_index']:.4f}, "
+              f"clustering {report['cluster_seconds']:.2f}s (baseline {report['baseline_cluster_seconds']:.2f}s)")
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(reports, output_file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
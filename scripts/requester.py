@@ -1,10 +1,13 @@
 import os
+import csv
+import sys
 import requests
 import glob
 
 # Configurable parameters
 INPUT_FOLDER = r'C:\Users\Max\NLP4RE\Dendogram-Generator\data\Stage 2 - Hierarchical Clustering\input'
 BASE_URL = 'http://127.0.0.1:3008/dendogram/generate_kg'
+BATCH_URL = 'http://127.0.0.1:3008/dendogram/generate_batch'
 
 DEFAULT_PARAMS = {
     'preprocessing': 'true',
@@ -46,6 +49,34 @@ def process_csv_files(input_folder, base_url, default_params):
         print(f"Finished processing of: {csv_file}")
 
 
+def process_csv_files_batch(input_folder, batch_url, default_params):
+    # Send every app of the folder in a single request so the server encodes shared features once
+    apps = []
+    for csv_file in glob.glob(os.path.join(input_folder, '*.csv')):
+        features = []
+        with open(csv_file, 'r', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                extracted_features = row.get("extracted_features_TransFeatEx", "")
+                if extracted_features:
+                    features.extend(extracted_features.split(';'))
+        apps.append({'app_name': os.path.splitext(os.path.basename(csv_file))[0], 'features': features})
+
+    print(f"Sending {len(apps)} apps in one batch request")
+    try:
+        response = requests.post(batch_url, params=default_params, json={'apps': apps})
+        if response.status_code == 200:
+            for result in response.json()['results']:
+                print(f"Successfully processed {result['app_name']}: {result['dendrogram_path']}")
+        else:
+            print(f"Failed to process batch: {response.status_code} - {response.text}")
+    except Exception as e:
+        print(f"Error processing batch: {e}")
+
+
 if __name__ == '__main__':
     # Run the script
-    process_csv_files(INPUT_FOLDER, BASE_URL, DEFAULT_PARAMS)
+    if '--batch' in sys.argv:
+        process_csv_files_batch(INPUT_FOLDER, BATCH_URL, DEFAULT_PARAMS)
+    else:
+        process_csv_files(INPUT_FOLDER, BASE_URL, DEFAULT_PARAMS)
+
@@ -0,0 +1,114 @@
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from backend.runtime_config import CPU_COUNT, configure_environment, apply_runtime_config
+
+# Synthetic stand-in for one clustering request: encode features, then cluster them
+N_FEATURES = 2000
+HIDDEN_SIZE = 768
+N_LAYERS = 4
+SEQUENCE_LENGTH = 16
+
+
+def run_request(config, n_features):
+    import numpy as np
+    import torch
+    from sklearn.cluster import AgglomerativeClustering
+    from sklearn.metrics import pairwise_distances
+
+    torch.manual_seed(0)
+    layers = [torch.nn.Linear(HIDDEN_SIZE, HIDDEN_SIZE) for _ in range(N_LAYERS)]
+    embeddings = []
+    with torch.no_grad():
+        for i in range(0, n_features, 32):
+            hidden = torch.randn(min(32, n_features - i), SEQUENCE_LENGTH, HIDDEN_SIZE)
+            for layer in layers:
+                hidden = torch.relu(layer(hidden))
+            embeddings.append(hidden.mean(dim=1))
+    dense_data_array = torch.cat(embeddings).numpy().astype(np.float64)
+
+    distance_matrix = pairwise_distances(dense_data_array, metric='cosine', n_jobs=config['sklearn_n_jobs'])
+    AgglomerativeClustering(n_clusters=None, linkage='average', distance_threshold=0.2,
+                            metric='precomputed').fit(distance_matrix)
+
+
+def worker(config, n_requests, n_features, start_event, results):
+    configure_environment(config)
+    apply_runtime_config(config)
+    start_event.wait()
+    started = time.perf_counter()
+    for _ in range(n_requests):
+        run_request(config, n_features)
+    results.put(time.perf_counter() - started)
+
+
+def candidate_configs(cores):
+    workers = 1
+    while workers <= cores:
+        threads = max(1, cores // workers)
+        yield {
+            'workers': workers,
+            'torch_threads': threads,
+            'torch_interop_threads': 1,
+            'blas_threads': threads,
+            'spacy_n_process': 1,
+            'sklearn_n_jobs': threads,
+        }
+        workers *= 2
+
+
+def benchmark(config, n_requests, n_features):
+    context = multiprocessing.get_context('spawn')
+    start_event = context.Event()
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(config, n_requests, n_features, start_event, results))
+                 for _ in range(config['workers'])]
+    for process in processes:
+        process.start()
+
+    started = time.perf_counter()
+    start_event.set()
+    durations = [results.get() for _ in processes]
+    elapsed = time.perf_counter() - started
+    for process in processes:
+        process.join()
+
+    total_requests = n_requests * config['workers']
+    return {
+        'throughput': total_requests / elapsed,
+        'latency': sum(durations) / total_requests,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the thread/worker split with the best request throughput.")
+    parser.add_argument("--cores", type=int, default=CPU_COUNT, help="Number of cores to split between workers")
+    parser.add_argument("--requests", type=int, default=2, help="Requests run by each worker")
+    parser.add_argument("--features", type=int, default=N_FEATURES, help="Features clustered per request")
+    args = parser.parse_args()
+
+    print(f"Benchmarking {args.cores} cores with {args.features} features per request...")
+    print(f"{'workers':>8} {'threads':>8} {'req/s':>10} {'latency (s)':>12}")
+
+    results = []
+    for config in candidate_configs(args.cores):
+        result = benchmark(config, args.requests, args.features)
+        results.append((config, result))
+        print(f"{config['workers']:>8} {config['torch_threads']:>8} "
+              f"{result['throughput']:>10.3f} {result['latency']:>12.2f}")
+
+    best_config, best_result = max(results, key=lambda item: item[1]['throughput'])
+    print(f"\nBest throughput: {best_result['throughput']:.3f} req/s")
+    print(f"DG_WORKERS={best_config['workers']}")
+    print(f"DG_TORCH_THREADS={best_config['torch_threads']}")
+    print(f"DG_BLAS_THREADS={best_config['blas_threads']}")
+    print(f"DG_SKLEARN_N_JOBS={best_config['sklearn_n_jobs']}")
+
+
+if __name__ == "__main__":
+    main()